@@ -0,0 +1,222 @@
+'''
+
+Command line interface of the headless analysis (see engine module), run with:
+    python -m imagepy process IMAGE [IMAGE ...] [options]
+    python -m imagepy batch FOLDER_OR_MANIFEST [...] [options]
+Images (or folders of images) are segmented, or their cells are imported from ROI files, skeletonized,
+checked for connections and exported as tables and/or project files that can be opened in the GUI.
+The batch command analyses many files in parallel, resumes interrupted runs and merges the results
+(see batch module). The benchmark command times the skeletonization of synthetic cells (see benchmark module):
+    python -m imagepy benchmark [options]
+
+'''
+
+import argparse
+import os
+import sys
+import time
+import imagepy.batch as bt
+import imagepy.export as exp
+import imagepy.profiling as prof
+import imagepy.projectfile as pf
+from imagepy.imagefile import find_images
+
+
+def parse_zframes(text):
+    """
+    z-frames of the command line: comma separated numbers or ranges, numbered from 1 (e.g. '1-5,8').
+    :return: list of z-frames numbered from 0
+    """
+    zframes = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        zframes.extend(range(int(first) - 1, int(last or first)))
+
+    return zframes
+
+def segmentation_parameters(args):
+    """
+    Segmentation parameters given on the command line (see segmentation.SEGMENTATION_PARAMETERS).
+    """
+    parameters = {'method': args.method, 'sigma': args.sigma, 'min_size': args.min_size,
+                  'min_distance': args.min_distance, 'min_radius': args.min_radius}
+
+    return {key: value for key, value in parameters.items() if value is not None}
+
+def process_image(path, args):
+    """
+    Analysis of a single image: segmentation (or ROI import), skeletonization, connections and export.
+    :return: analysis engine with the results
+    """
+    start = time.time()
+    zframes = parse_zframes(args.zframes) if args.zframes is not None else None
+    engine = bt.analyse_image(path, bt.roi_file(args.rois, path), zframes, args.workers,
+                              segmentation_parameters(args))
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    os.makedirs(args.output, exist_ok=True)
+    if args.format != 'none':
+        engine.export(os.path.join(args.output, name + '.' + args.format))
+    if args.project:
+        engine.save(os.path.join(args.output, name + pf.PROJECT_EXTENSION))
+
+    print('{}: {} cells, {} connections ({:.1f} s)'.format(path, len(engine.shapecells), len(engine.connections),
+                                                          time.time() - start))
+
+    return engine
+
+def command_process(args):
+    """
+    process subcommand: analysis of images or folders of images, one after the other.
+    """
+    images = find_images(args.images)
+    if len(images) == 0:
+        print('No image found.', file=sys.stderr)
+        return 1
+
+    if args.profile is not None:
+        prof.PROFILER.enable(memory=args.profile_memory)
+
+    failed = 0
+    for path in images:
+        try:
+            process_image(path, args)
+        except Exception as error:  # keep processing the other images
+            print('{}: failed ({})'.format(path, error), file=sys.stderr)
+            failed += 1
+
+    if args.profile is not None:
+        prof.PROFILER.print_summary()
+        prof.PROFILER.export_trace(args.profile)
+
+    return 1 if failed > 0 else 0
+
+def command_batch(args):
+    """
+    batch subcommand: analysis of the files of folders and manifests in parallel, then merge of the results.
+    """
+    images = bt.collect_images(args.sources)
+    if len(images) == 0:
+        print('No image found.', file=sys.stderr)
+        return 1
+
+    options = {'rois': args.rois, 'project': args.project, 'workers': args.file_workers,
+               'zframes': parse_zframes(args.zframes) if args.zframes is not None else None,
+               'parameters': segmentation_parameters(args)}
+    budget = int(args.memory * 2 ** 30) if args.memory is not None else None
+
+    done, failed = bt.run_batch(images, args.output, options, args.workers, budget, resume=not args.restart)
+
+    if args.format != 'none' and len(done) > 0:
+        merged = os.path.join(args.output, 'merged.' + args.format)
+        bt.merge_results(args.output, done, merged)
+        print('{} files merged in {}'.format(len(done), merged))
+
+    return 1 if len(failed) > 0 else 0
+
+def command_benchmark(args):
+    """
+    benchmark subcommand: time the skeletonization of synthetic cells and compare it with the previous run.
+    """
+    import imagepy.benchmark as bm  # synthetic cells, not needed by the other subcommands
+
+    unknown = sorted(set(args.cases or []) - set(bm.CASES))
+    if len(unknown) > 0:
+        print('Unknown cases: {} (choose from {})'.format(', '.join(unknown), ', '.join(bm.CASES)), file=sys.stderr)
+        return 2
+    if args.results is None:
+        args.results = bm.RESULTS_FILE
+
+    if args.end_to_end:
+        import imagepy.guibenchmark as gbm  # GUI modules, not needed by the other benchmarks
+        stack = dict(gbm.STACK_PARAMETERS, zframes=args.zframes, timepoints=args.timepoints,
+                     size=(args.size, args.size))
+        results = [gbm.run_end_to_end(stack, args.cells)]
+    else:
+        cases = {case: bm.CASES[case] for case in (args.cases or bm.CASES)}
+        results = bm.run_benchmark(cases, args.repeat)
+
+    comparison = bm.compare_results(results, bm.load_results(args.results))
+    bm.print_results(results, comparison)
+    if not args.no_save:
+        bm.save_results(args.results, results)
+
+    return 1 if any(row[5] for row in comparison) else 0
+
+def add_analysis_arguments(parser):
+    """
+    Arguments of the analysis of each image, shared by the subcommands.
+    """
+    parser.add_argument('-o', '--output', default='.', help='output folder (default: current folder)')
+    parser.add_argument('--format', default='csv', choices=[e[1:] for e in exp.SINKS] + ['none'],
+                        help='format of the exported tables (default: csv)')
+    parser.add_argument('--project', action='store_true', help='save a project file for the GUI')
+    parser.add_argument('--rois', help='ROI file (columns roi, zframe, x, y) or folder of ROI files '
+                                       'named as the images, instead of the automatic segmentation')
+    parser.add_argument('--zframes', help="z-frames to segment, numbered from 1 (e.g. '1-5,8'), default all")
+    parser.add_argument('--method', choices=['otsu', 'adaptive'], help='threshold method')
+    parser.add_argument('--sigma', type=float, help='gaussian filter standard deviation [pixel]')
+    parser.add_argument('--min-size', type=int, help='smallest cell kept [pixel]')
+    parser.add_argument('--min-distance', type=int, help='minimum distance between two cell centres [pixel]')
+    parser.add_argument('--min-radius', type=float, help='minimum radius of a cell body [pixel]')
+
+def build_parser():
+    """
+    Command line parser, one subcommand for each kind of job.
+    """
+    parser = argparse.ArgumentParser(prog='python -m imagepy',
+                                     description='Headless analysis of cell protusions.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    process = subparsers.add_parser('process', help='analyse images or folders of images')
+    process.add_argument('images', nargs='+', help='image files or folders')
+    add_analysis_arguments(process)
+    process.add_argument('--workers', type=int, help='segmentation threads and skeletonization processes '
+                                                     '(default: all the cores)')
+    process.add_argument('--profile', metavar='TRACE', help='time the stages of the analysis and save the trace '
+                                                            'file (stages run by worker processes are not included)')
+    process.add_argument('--profile-memory', action='store_true', help='also trace the memory of each stage')
+    process.set_defaults(func=command_process)
+
+    batch = subparsers.add_parser('batch', help='analyse many images in parallel and merge the results')
+    batch.add_argument('sources', nargs='+', help='folders, image files or manifests (.txt or .csv files '
+                                                  'listing the images)')
+    add_analysis_arguments(batch)
+    batch.add_argument('--workers', type=int, help='files analysed at the same time (default: all the cores)')
+    batch.add_argument('--file-workers', type=int, default=1,
+                       help='segmentation threads and skeletonization processes of each file (default: 1)')
+    batch.add_argument('--memory', type=float, help='memory budget of the batch [GiB] '
+                                                    '(default: half of the computer memory)')
+    batch.add_argument('--restart', action='store_true', help='analyse again the files already done')
+    batch.set_defaults(func=command_batch)
+
+    benchmark = subparsers.add_parser('benchmark', help='time the skeletonization of synthetic cells')
+    benchmark.add_argument('--cases', nargs='+', metavar='CASE',
+                           help='cases to run (see benchmark.CASES, default: all)')
+    benchmark.add_argument('--repeat', type=int, default=3, help='runs of each case, the best is kept (default: 3)')
+    benchmark.add_argument('--results', help='results file, the run is compared with the previous one '
+                                             '(default: benchmarks.jsonl)')
+    benchmark.add_argument('--no-save', action='store_true', help='do not append the results to the results file')
+    benchmark.add_argument('--end-to-end', action='store_true',
+                           help='benchmark a GUI session without display on a synthetic stack instead: open, '
+                                'scrub all the z-frames, add cells, save and reload')
+    benchmark.add_argument('--zframes', type=int, default=20,
+                           help='z-frames of the synthetic stack (default: %(default)s)')
+    benchmark.add_argument('--timepoints', type=int, default=1,
+                           help='timepoints of the synthetic stack (default: %(default)s)')
+    benchmark.add_argument('--size', type=int, default=1024,
+                           help='rows and columns of the synthetic stack (default: %(default)s)')
+    benchmark.add_argument('--cells', type=int, default=10, help='cells added (default: %(default)s)')
+    benchmark.set_defaults(func=command_benchmark)
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
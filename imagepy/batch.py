@@ -0,0 +1,268 @@
+'''
+
+Module to analyse many image files in a batch, without the GUI (see engine module).
+
+Files are listed by folders and/or manifests (text files with one image path on each line, or CSV files
+with a 'path' column) and analysed in a pool of worker processes, one file for each process.
+The memory needed by each file is estimated from its size (see estimate_memory): a file is started
+only if the estimates of the running files fit in the memory budget, so large stacks run alone.
+The results of each file are written to the 'files' folder of the output:
+    <name>_<table>.csv      tables of the analysis (see export module)
+    <name>.ipj              project file, if requested
+    <name>.done.json        checkpoint written when the file is done (source file, options, summary)
+Files with an up to date checkpoint are skipped, so an interrupted batch is resumed by running it again.
+When all the files are done, their tables are merged in one dataset (a 'file' column identifies each file).
+
+'''
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import imagepy.engine as eng
+import imagepy.export as exp
+import imagepy.projectfile as pf
+from imagepy.imagefile import find_images
+from imagepy.memory import system_memory
+
+MANIFEST_EXTENSIONS = ('.txt', '.csv')
+CHECKPOINT_SUFFIX = '.done.json'
+FILES_FOLDER = 'files'
+MEMORY_FACTOR = 4 # memory used by the analysis for each byte of the image file
+PROCESS_MEMORY = 2 ** 29 # memory of a worker process before loading the image [bytes]
+MERGE_CHUNKSIZE = 100000 # number of rows merged at once
+
+
+def read_manifest(path):
+    """
+    Image files listed in a manifest: a text file with one path on each line (lines starting with # are skipped)
+    or a CSV file with a 'path' column. Relative paths are relative to the folder of the manifest.
+    """
+    folder = os.path.dirname(os.path.abspath(path))
+
+    if path.lower().endswith('.csv'):
+        paths = pd.read_csv(path)['path'].astype(str).tolist()
+    else:
+        with open(path) as f:
+            paths = [line.strip() for line in f]
+        paths = [p for p in paths if p != '' and not p.startswith('#')]
+
+    return [os.path.join(folder, p) for p in paths]
+
+def collect_images(sources):
+    """
+    Image files of a list of folders, manifests and image files (each file is listed once).
+    """
+    images = []
+    for source in sources:
+        if os.path.isfile(source) and source.lower().endswith(MANIFEST_EXTENSIONS):
+            images.extend(find_images(read_manifest(source)))
+        else:
+            images.extend(find_images([source]))
+
+    unique = dict()
+    for path in images:
+        unique.setdefault(os.path.abspath(path), path)
+
+    return list(unique.values())
+
+def output_names(images):
+    """
+    Names of the results of each image file: the file name without extension, numbered if repeated.
+    :return: dictionary { name : image path }
+    """
+    names = dict()
+    for path in images:
+        base = name = os.path.splitext(os.path.basename(path))[0]
+        n = 1
+        while name in names:
+            n += 1
+            name = '{}_{}'.format(base, n)
+        names[name] = path
+
+    return names
+
+def estimate_memory(path):
+    """
+    Estimate of the memory needed to analyse an image file [bytes].
+    """
+    return PROCESS_MEMORY + MEMORY_FACTOR * os.path.getsize(path)
+
+def source_signature(path):
+    """
+    Identify the version of an image file, to detect files changed after their checkpoint.
+    """
+    stat = os.stat(path)
+
+    return {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def checkpoint_path(folder, name):
+    return os.path.join(folder, name + CHECKPOINT_SUFFIX)
+
+def read_checkpoint(folder, name, path, options):
+    """
+    Checkpoint of an image file, None if missing or out of date (image file or options changed).
+    """
+    try:
+        with open(checkpoint_path(folder, name)) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if checkpoint.get('source') != source_signature(path) or checkpoint.get('options') != options:
+        return None
+
+    return checkpoint
+
+def write_checkpoint(folder, name, checkpoint):
+    """
+    Write the checkpoint of an image file, replacing the old one only when the new one is complete.
+    """
+    target = checkpoint_path(folder, name)
+    with open(target + '.tmp', 'w') as f:
+        json.dump(checkpoint, f, indent=1)
+    os.replace(target + '.tmp', target)
+
+def analyse_image(path, rois=None, zframes=None, workers=None, parameters=None):
+    """
+    Analysis of an image file: automatic segmentation or import of the cells from a ROI file.
+    :param rois: ROI file (see engine.AnalysisEngine.import_rois), automatic segmentation if None
+    :param zframes: z-frames to segment, all if None
+    :param parameters: segmentation parameters (see segmentation.SEGMENTATION_PARAMETERS)
+    :return: analysis engine with the results
+    """
+    engine = eng.AnalysisEngine.from_path(path)
+
+    if rois is not None:
+        engine.import_rois(rois, workers)
+    else:
+        engine.segment(zframes, workers, **(parameters or dict()))
+
+    return engine
+
+def roi_file(rois, path):
+    """
+    ROI file of an image: rois is a ROI file, or a folder of ROI files named as the images.
+    """
+    if rois is not None and os.path.isdir(rois):
+        return os.path.join(rois, os.path.splitext(os.path.basename(path))[0] + '.csv')
+
+    return rois
+
+def run_file(path, name, folder, options):
+    """
+    Analyse an image file and write its results and checkpoint (task of the worker processes).
+    :param options: dictionary with rois, zframes, parameters, project and workers (processes of the file) entries
+    :return: checkpoint of the file
+    """
+    start = time.time()
+    engine = analyse_image(path, roi_file(options['rois'], path), options['zframes'], options['workers'],
+                           options['parameters'])
+
+    engine.export(os.path.join(folder, name + '.csv'))
+    if options['project']:
+        engine.save(os.path.join(folder, name + pf.PROJECT_EXTENSION))
+
+    checkpoint = {'source': source_signature(path), 'options': options,
+                  'summary': {'cells': len(engine.shapecells), 'connections': len(engine.connections),
+                              'components': int(engine.network.components()[0]), 'tracks': len(engine.tracks()),
+                              'seconds': round(time.time() - start, 3)}}
+    write_checkpoint(folder, name, checkpoint)
+
+    return checkpoint
+
+def run_batch(images, output, options, workers=None, memory_budget=None, resume=True):
+    """
+    Analyse image files in a pool of worker processes, within a memory budget.
+    Files are started from the largest one, a file that does not fit the budget waits for the running ones
+    (a file bigger than the whole budget runs alone).
+    :param images: image files
+    :param output: output folder, results of each file are written to its 'files' folder
+    :param workers: number of files analysed at the same time, all the available cores if None
+    :param memory_budget: memory available to the batch [bytes], half of the computer memory if None
+    :param resume: skip the files with an up to date checkpoint
+    :return: dictionaries { name : checkpoint } of the files done and { name : error } of the failed ones
+    """
+    folder = os.path.join(output, FILES_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    options = json.loads(json.dumps(options)) # same types of the checkpoints
+    names = output_names(images)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if memory_budget is None:
+        memory_budget = (system_memory() or 2 ** 33) // 2
+
+    done = dict()
+    pending = []
+    for name, path in names.items():
+        checkpoint = read_checkpoint(folder, name, path, options) if resume else None
+        if checkpoint is not None:
+            done[name] = checkpoint
+        else:
+            pending.append((estimate_memory(path), name, path))
+    pending.sort(key=lambda job: job[0], reverse=True)
+
+    if len(done) > 0:
+        print('{} files already done, {} to analyse'.format(len(done), len(pending)))
+
+    failed = dict()
+    running = dict() # { future : (memory estimate, name, path) }
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while len(pending) > 0 or len(running) > 0:
+            used = sum(job[0] for job in running.values())
+            for job in list(pending):
+                if len(running) >= workers:
+                    break
+                if len(running) == 0 or used + job[0] <= memory_budget:
+                    running[pool.submit(run_file, job[2], job[1], folder, options)] = job
+                    pending.remove(job)
+                    used += job[0]
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                _, name, path = running.pop(future)
+                try:
+                    done[name] = future.result()
+                except Exception as error:  # keep analysing the other files
+                    failed[name] = error
+                    print('{}: failed ({})'.format(path, error))
+                    continue
+                summary = done[name]['summary']
+                print('{}: {} cells, {} connections ({:.1f} s) [{}/{}]'.format(
+                    path, summary['cells'], summary['connections'], summary['seconds'],
+                    len(done), len(names)))
+
+    return done, failed
+
+def merge_results(output, done, path, tables=exp.TABLES):
+    """
+    Merge the tables of the files done in one dataset, the format is chosen by the extension of path (see export.SINKS).
+    Tables are read and written in chunks. The 'files' table lists the files with the summary of their analysis.
+    :param done: dictionary { name : checkpoint } of the files done (see run_batch)
+    """
+    folder = os.path.join(output, FILES_FOLDER)
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in exp.SINKS:
+        raise ValueError('Unknown export format: ' + extension)
+
+    metadata = dict()
+    for name in done:
+        with open(os.path.join(folder, name + '_metadata.json')) as f:
+            metadata[name] = json.load(f)
+
+    sink = exp.SINKS[extension](path, {'files': metadata})
+    try:
+        sink.write('files', pd.DataFrame([dict(file=name, source=checkpoint['source']['path'], **checkpoint['summary'])
+                                          for name, checkpoint in done.items()]))
+        for table in tables:
+            for name in done:
+                tablefile = os.path.join(folder, name + '_' + table + '.csv')
+                if not os.path.exists(tablefile):
+                    continue
+                for chunk in pd.read_csv(tablefile, chunksize=MERGE_CHUNKSIZE):
+                    chunk.insert(0, 'file', name)
+                    sink.write(table, chunk)
+    finally:
+        sink.close()
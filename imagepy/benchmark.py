@@ -0,0 +1,196 @@
+'''
+
+Module to benchmark the skeletonization of the cells (see skeletonprocessing module) on synthetic cells
+(see synthetic module), so that performance regressions show up.
+
+Each case of the benchmark is a star shaped cell with a given frame size, number, length and branching of
+its protusions. The skeletonization of each cell is timed as a whole and stage by stage: the functions of
+STAGES are wrapped by timers while the benchmark runs (calls and time of each stage, nested stages included).
+Results are appended to a JSON lines file, one line for each case of each run, and compared with
+the previous run of the same case.
+
+'''
+
+import json
+import os
+import platform
+import subprocess
+import time
+from contextlib import contextmanager
+from functools import wraps
+import numpy as np
+import imagepy.skeletonprocessing as skpro
+from imagepy.synthetic import star_mask
+
+# stages of the skeletonization { stage : (object, function name) }
+STAGES = {'medial_axis': (skpro, 'medial_axis'),
+          'cellbody_threshold': (skpro, 'automatic_cellbody_threshold'),
+          'cellbody_skeleton': (skpro, 'cellbody_skeletonization'),
+          'protusions_skeleton': (skpro, 'branch_skletonization'),
+          'label': (skpro, 'label'),
+          'regionprops': (skpro, 'regionprops'),
+          'edgepoint_detect': (skpro, 'edgepoint_detect'),
+          'route_through_array': (skpro, 'route_through_array'),
+          'path_lengths': (skpro, 'path_lengths'),
+          'csr.summarise': (skpro.csr, 'summarise')}
+
+# synthetic cells of the benchmark { case : star_mask parameters }
+CASES = {'small': {'shape': (256, 256), 'protusions': 4, 'length': 60},
+         'many-protusions': {'shape': (512, 512), 'protusions': 12, 'length': 120},
+         'branched': {'shape': (512, 512), 'protusions': 6, 'length': 120, 'branches': 3},
+         'long-protusions': {'shape': (1024, 1024), 'protusions': 6, 'length': 400},
+         'large-frame': {'shape': (2048, 2048), 'protusions': 6, 'length': 150}}
+
+RESULTS_FILE = 'benchmarks.jsonl'
+TOLERANCE = 0.2 # relative slowdown reported as a regression
+MIN_SLOWDOWN = 0.005 # shorter slowdowns are timing noise [s]
+
+
+@contextmanager
+def stage_timers(stages=STAGES):
+    """
+    Time the stages of the skeletonization while the context is active.
+    :return: dictionary { stage : [calls, time [s]] } updated by the timers
+    """
+    timings = {stage: [0, 0.] for stage in stages}
+    originals = dict()
+
+    def timer(stage, function):
+        @wraps(function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings[stage][0] += 1
+                timings[stage][1] += time.perf_counter() - start
+        return timed
+
+    try:
+        for stage, (owner, name) in stages.items():
+            originals[stage] = getattr(owner, name)
+            setattr(owner, name, timer(stage, originals[stage]))
+        yield timings
+    finally:
+        for stage, function in originals.items():
+            owner, name = stages[stage]
+            setattr(owner, name, function)
+
+def benchmark_cell(mask, physicspacing=1, repeat=3):
+    """
+    Time the skeletonization of a cell mask (see skeletonprocessing.skeletonize_mask), best of repeat runs.
+    A first run is not timed, to exclude the compilation of the skeleton analysis.
+    :return: total time [s] and dictionary { stage : {'calls': calls, 'seconds': time [s]} }
+    """
+    skpro.skeletonize_mask(mask, physicspacing)
+
+    best = None
+    for _ in range(repeat):
+        with stage_timers() as timings:
+            start = time.perf_counter()
+            skpro.skeletonize_mask(mask, physicspacing)
+            total = time.perf_counter() - start
+        if best is None or total < best[0]:
+            best = (total, timings)
+
+    total, timings = best
+    return total, {stage: {'calls': calls, 'seconds': seconds} for stage, (calls, seconds) in timings.items()}
+
+def source_revision():
+    """
+    Git commit of the source code, None if unknown.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_metadata():
+    """
+    Identify a benchmark run: date, source revision, versions and computer.
+    """
+    return {'run': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': source_revision(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.node()}
+
+def json_parameters(parameters):
+    """
+    Parameters of a benchmark case as stored in the results file (e.g. tuples become lists), so they can be compared.
+    """
+    return json.loads(json.dumps(parameters))
+
+def run_benchmark(cases=CASES, repeat=3, seed=0):
+    """
+    Benchmark the skeletonization of the synthetic cells of each case.
+    :param cases: dictionary { case : star_mask parameters }
+    :return: list of results, one for each case
+    """
+    run = run_metadata()
+
+    results = []
+    for case, parameters in cases.items():
+        mask = star_mask(seed=seed, **parameters)
+        total, stages = benchmark_cell(mask, repeat=repeat)
+        results.append(dict(run, case=case, parameters=json_parameters(parameters),
+                            pixels=int(mask.sum()), seconds=total, stages=stages))
+
+    return results
+
+def save_results(path, results):
+    """
+    Append benchmark results to a JSON lines file.
+    """
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+
+def load_results(path):
+    """
+    Benchmark results of a JSON lines file, empty list if the file is missing.
+    """
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip() != '']
+
+def compare_results(results, history, tolerance=TOLERANCE):
+    """
+    Compare benchmark results with the previous run of each case (same case and parameters).
+    :param history: results of the previous runs (see load_results)
+    :return: list of (case, stage, previous time [s], time [s], ratio, regression), stage is 'total' for the whole
+    skeletonization
+    """
+    rows = []
+    for result in results:
+        previous = [h for h in history if h['case'] == result['case'] and h['parameters'] == result['parameters']
+                    and h['run'] != result['run']]
+        if len(previous) == 0:
+            continue
+        previous = previous[-1]
+
+        times = [('total', previous['seconds'], result['seconds'])]
+        times += [(stage, previous['stages'][stage]['seconds'], timing['seconds'])
+                  for stage, timing in result['stages'].items() if stage in previous['stages']]
+        for stage, before, after in times:
+            ratio = after / before if before > 0 else np.inf
+            rows.append((result['case'], stage, before, after, ratio,
+                         ratio > 1 + tolerance and after - before > MIN_SLOWDOWN))
+
+    return rows
+
+def print_results(results, comparison=()):
+    """
+    Print the benchmark results and their comparison with the previous run.
+    """
+    for result in results:
+        print('\n{} ({} pixels): {:.3f} s'.format(result['case'], result['pixels'], result['seconds']))
+        for stage, timing in sorted(result['stages'].items(), key=lambda s: -s[1]['seconds']):
+            if timing['calls'] > 0:
+                print('    {:<22}{:>6} calls {:>10.4f} s'.format(stage, timing['calls'], timing['seconds']))
+
+    regressions = [row for row in comparison if row[5]]
+    if len(comparison) > 0:
+        print('\n{} regressions compared with the previous run'.format(len(regressions)))
+    for case, stage, before, after, ratio, _ in regressions:
+        print('    {} {}: {:.4f} s -> {:.4f} s (x{:.2f})'.format(case, stage, before, after, ratio))
@@ -0,0 +1,318 @@
+'''
+
+Module to serialize cell records (cell shape data of the analysis) without pickle.
+
+A cell record has a fixed set of fields (CELL_FIELDS): z-frame, contour (points, color, area, mask),
+cell body skeleton and protusions skeleton. Each field is stored as one or more typed numpy arrays
+(see pack_value), in a compact binary container:
+    magic (4 bytes), schema version and flags (uint16), header length (uint32)
+    JSON header: name, dtype and shape of each array
+    data: raw bytes of the arrays, zlib compressed
+Records written with an older schema are migrated to the current one when decoded (see MIGRATIONS):
+    version 0   cell objects pickled by older versions (imageprocesser.storeProcessedAspickle)
+    version 1   compressed numpy archives (.npz) of project files with format version 1
+    version 2   current binary container
+
+'''
+
+import io
+import json
+import pickle
+import struct
+import time
+import zlib
+import numpy as np
+
+SCHEMA_VERSION = 2
+RECORD_MAGIC = b'IPCR'
+RECORD_HEADER = struct.Struct('<4sHHI')
+FLAG_ZLIB = 1
+CELL_FIELDS = ('zframe', 'contour', 'skelbody', 'skelprot')
+
+
+class CellRecord():
+    """
+    Cell shape data of the analysis: zframe, contour, skelbody and skelprot attributes
+    (skeleton attributes are missing if the cell was not skeletonized).
+    """
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+def pack_value(key, value, arrays):
+    """
+    Store a value of a cell attribute in a dictionary of numpy arrays.
+    The kind of value is appended to the key, so that it can be restored by unpack_values.
+    """
+    if isinstance(value, dict):
+        for k, v in value.items():
+            pack_value(key + '/' + k, v, arrays)
+    elif value is None:
+        arrays[key + '@none'] = np.zeros(0)
+    elif isinstance(value, np.ndarray) and value.dtype == bool and value.ndim == 2:
+        # full frame mask: bit-packed crop of the bounding box
+        rows = np.flatnonzero(value.any(axis=1))
+        cols = np.flatnonzero(value.any(axis=0))
+        if rows.size == 0:
+            bbox = np.zeros(4, dtype=np.int64)
+        else:
+            bbox = np.array([rows[0], cols[0], rows[-1] + 1, cols[-1] + 1])
+        arrays[key + '@mask@shape'] = np.array(value.shape)
+        arrays[key + '@mask@bbox'] = bbox
+        arrays[key + '@mask@bits'] = np.packbits(value[bbox[0]:bbox[2], bbox[1]:bbox[3]])
+    elif isinstance(value, np.ndarray):
+        arrays[key + '@array'] = value
+    elif isinstance(value, (list, tuple)) and len(value) > 0 and all(isinstance(v, np.ndarray) for v in value):
+        # list of arrays with different lengths (e.g. skeleton paths)
+        arrays[key + '@ragged@data'] = np.concatenate(value)
+        arrays[key + '@ragged@offsets'] = np.cumsum([0] + [len(v) for v in value])
+    elif (isinstance(value, (list, tuple)) and len(value) > 0 and all(isinstance(v, list) for v in value)
+          and all(isinstance(p, np.ndarray) for v in value for p in v)):
+        # list of lists of arrays (e.g. secondary paths of each protusion)
+        paths = [p for v in value for p in v]
+        arrays[key + '@ragged2@groups'] = np.cumsum([0] + [len(v) for v in value])
+        arrays[key + '@ragged2@offsets'] = np.cumsum([0] + [len(p) for p in paths])
+        if len(paths) > 0:
+            arrays[key + '@ragged2@data'] = np.concatenate(paths)
+        else:
+            arrays[key + '@ragged2@data'] = np.zeros((0, 2), dtype=int)
+    elif isinstance(value, tuple):
+        arrays[key + '@tuple'] = np.array(value)
+    elif isinstance(value, list):
+        arrays[key + '@list'] = np.array(value)
+    else:
+        arrays[key + '@scalar'] = np.array(value)
+
+def unpack_values(arrays):
+    """
+    Restore the values stored by pack_value.
+    :return: nested dictionary of values
+    """
+    # group the arrays of each value: { key : (kind, { part : array }) }
+    entries = dict()
+    for name, array in arrays.items():
+        key, kind, part = (name.split('@') + [None])[:3]
+        entries.setdefault(key, (kind, dict()))[1][part] = array
+
+    values = dict()
+    for key, (kind, parts) in entries.items():
+        if kind == 'none':
+            value = None
+        elif kind == 'mask':
+            bbox = parts['bbox']
+            cropshape = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+            value = np.zeros(tuple(parts['shape']), dtype=bool)
+            bits = np.unpackbits(parts['bits'])[:cropshape[0] * cropshape[1]]
+            value[bbox[0]:bbox[2], bbox[1]:bbox[3]] = bits.reshape(cropshape).astype(bool)
+        elif kind == 'ragged':
+            data, offsets = parts['data'], parts['offsets']
+            value = [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        elif kind == 'ragged2':
+            data, offsets, groups = parts['data'], parts['offsets'], parts['groups']
+            paths = [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            value = [paths[groups[i]:groups[i + 1]] for i in range(len(groups) - 1)]
+        elif kind == 'array':
+            value = parts[None]
+        elif kind == 'tuple':
+            value = tuple(parts[None].tolist())
+        elif kind == 'list':
+            value = parts[None].tolist()
+        else:
+            value = parts[None].item()
+
+        nested = values
+        path = key.split('/')
+        for level in path[:-1]:
+            nested = nested.setdefault(level, dict())
+        nested[path[-1]] = value
+
+    return values
+
+def encode_arrays(arrays, compress=True):
+    """
+    Serialize a dictionary of numpy arrays in the binary container of the cell records.
+    """
+    header = []
+    buffers = []
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        if array.dtype.hasobject:
+            raise TypeError('Value ' + name + ' is not an array of numbers.')
+        header.append([name, array.dtype.str, list(array.shape)])
+        buffers.append(array.tobytes())
+
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    data = b''.join(buffers)
+    flags = 0
+    if compress:
+        data = zlib.compress(data, 1)
+        flags |= FLAG_ZLIB
+
+    return RECORD_HEADER.pack(RECORD_MAGIC, SCHEMA_VERSION, flags, len(header)) + header + data
+
+def decode_arrays(data):
+    """
+    Deserialize a dictionary of numpy arrays written by encode_arrays.
+    Compressed numpy archives (.npz, schema version 1) are read as well.
+    :return: dictionary of arrays and schema version
+    """
+    if data[:2] == b'PK':
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            return {name: npz[name] for name in npz.files}, 1
+
+    magic, version, flags, headerlength = RECORD_HEADER.unpack_from(data)
+    if magic != RECORD_MAGIC:
+        raise ValueError('Not a cell record.')
+    if version > SCHEMA_VERSION:
+        raise ValueError('Cell record created by a newer version of the software.')
+
+    start = RECORD_HEADER.size + headerlength
+    header = json.loads(data[RECORD_HEADER.size:start].decode('utf-8'))
+    block = data[start:]
+    if flags & FLAG_ZLIB:
+        block = zlib.decompress(block)
+    block = bytearray(block)  # writable arrays
+
+    arrays = dict()
+    offset = 0
+    for name, dtype, shape in header:
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(block, dtype=dtype, count=count, offset=offset).reshape(shape)
+        offset += count * dtype.itemsize
+
+    return arrays, version
+
+def migrate_v0(attributes):
+    """
+    Cell objects pickled by older versions: skeletons store a scalar pixel spacing, extend it to both axes.
+    """
+    for field in ('skelbody', 'skelprot'):
+        skeleton = attributes.get(field)
+        if isinstance(skeleton, dict) and np.ndim(skeleton.get('physical-space', 1)) == 0:
+            skeleton['physical-space'] = np.ones(2) * skeleton.get('physical-space', 1)
+
+    return attributes
+
+def migrate_v1(attributes):
+    """
+    Records written before the schema stored every attribute of the cell objects:
+    drop the ones that are not part of the schema (e.g. the summary strings added when the cell body was modified).
+    """
+    return {field: attributes[field] for field in CELL_FIELDS if field in attributes}
+
+# functions migrating the attributes of a record to the next schema version { version : function }
+MIGRATIONS = {0: migrate_v0, 1: migrate_v1}
+
+def migrate(attributes, version):
+    """
+    Migrate the attributes of a cell record from a schema version to the current one.
+    """
+    for v in range(version, SCHEMA_VERSION):
+        attributes = MIGRATIONS[v](attributes)
+
+    return attributes
+
+class LegacyUnpickler(pickle.Unpickler):
+    """
+    Unpickler of the project files saved by older versions (.pk): only the classes stored by the analysis
+    (numpy arrays, the connections DataFrame, the image and cell objects) can be loaded, instead of arbitrary code.
+    Each class is allowed by its exact (module, name): other functions of the same modules (e.g. numpy.testing or
+    pandas.read_pickle) could run code.
+    """
+
+    ALLOWED_CLASSES = frozenset([
+        # numpy arrays, scalars and data types (numpy._core in numpy >= 2)
+        ('numpy.core.multiarray', '_reconstruct'), ('numpy.core.multiarray', 'scalar'),
+        ('numpy._core.multiarray', '_reconstruct'), ('numpy._core.multiarray', 'scalar'),
+        ('numpy', 'ndarray'), ('numpy', 'dtype'),
+        # pandas DataFrame (connections table), as pickled by pandas 0.23 (project files of older versions)
+        # and by the versions tested since: 0.25, 1.1, 1.3, 1.5 and 2.0 to 2.2. pandas 1.3 builds the blocks with
+        # functools.partial of new_block: a partial can only wrap the callables allowed here
+        ('pandas.core.frame', 'DataFrame'), ('pandas.core.series', 'Series'),
+        ('pandas.core.internals', 'BlockManager'), ('pandas.core.internals.managers', 'BlockManager'),
+        ('pandas._libs.internals', '_unpickle_block'), ('pandas.core.internals.blocks', 'new_block'),
+        ('functools', 'partial'),
+        ('pandas.core.indexes.base', '_new_Index'), ('pandas.core.indexes.base', 'Index'),
+        ('pandas.core.indexes.range', 'RangeIndex'), ('pandas.core.indexes.numeric', 'Int64Index'),
+        # image and cell objects of the analysis
+        ('imagepy.imagemanager', 'pbf2pickle'), ('imagepy.imagefile', 'pbf2pickle'),
+        ('imagepy.imageprocesser', 'storeProcessedAspickle'), ('imagepy.cellrecord', 'CellRecord'),
+        ('pims.frame', 'Frame'),
+        # built-in types
+        ('collections', 'OrderedDict'), ('copyreg', '_reconstructor'), ('_codecs', 'encode'),
+        ('builtins', 'object'), ('builtins', 'dict'), ('builtins', 'list'), ('builtins', 'tuple'),
+        ('builtins', 'set'), ('builtins', 'frozenset'), ('builtins', 'slice'), ('builtins', 'range'),
+        ('builtins', 'complex'), ('builtins', 'bytearray'), ('builtins', 'int'), ('builtins', 'float'),
+        ('builtins', 'str'), ('builtins', 'bool')])
+
+    def find_class(self, module, name):
+        if (module, name) in self.ALLOWED_CLASSES:
+            return super().find_class(module, name)
+
+        raise pickle.UnpicklingError('Class ' + module + '.' + name + ' is not allowed in project files.')
+
+def load_legacy_project(file):
+    """
+    Load a project file saved by older versions (.pk), migrating its cells to cell records.
+    :param file: file object open in binary mode
+    :return: dictionary with imgfile, shapecells, cell_zframes and connections entries
+    """
+    dictload = LegacyUnpickler(file).load()
+    dictload['shapecells'] = {cellid: record_from_object(cell) for cellid, cell in dictload['shapecells'].items()}
+
+    return dictload
+
+def record_from_object(cellobj):
+    """
+    Cell record with the attributes of a cell shape object of any version (e.g. loaded from a pickle file).
+    """
+    return CellRecord(**migrate(dict(vars(cellobj)), 0))
+
+def encode_cell(cell):
+    """
+    Serialize the schema fields of a cell shape object (see CellRecord).
+    """
+    arrays = dict()
+    attributes = vars(cell)
+    for field in CELL_FIELDS:
+        if field in attributes:
+            pack_value(field, attributes[field], arrays)
+
+    return encode_arrays(arrays)
+
+def decode_cell(data):
+    """
+    Deserialize a cell record written by encode_cell, migrating it to the current schema.
+    """
+    arrays, version = decode_arrays(data)
+
+    return CellRecord(**migrate(unpack_values(arrays), version))
+
+def benchmark_serialization(shapecells, repeat=3):
+    """
+    Compare the round trip (serialization and deserialization) of cell records with pickle.
+    :param shapecells: dictionary containing cell shape objects { Cell # : cell object }
+    :return: dictionary { method : (encoding time [s], decoding time [s], size [bytes]) }, best of repeat runs
+    """
+    cells = list(shapecells.values())
+    methods = {'pickle': (lambda cell: pickle.dumps(cell, protocol=pickle.HIGHEST_PROTOCOL), pickle.loads),
+               'cellrecord': (encode_cell, decode_cell)}
+
+    results = dict()
+    for method, (encode, decode) in methods.items():
+        encodetime = decodetime = np.inf
+        for _ in range(repeat):
+            start = time.perf_counter()
+            data = [encode(cell) for cell in cells]
+            encodetime = min(encodetime, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            for d in data:
+                decode(d)
+            decodetime = min(decodetime, time.perf_counter() - start)
+
+        results[method] = (encodetime, decodetime, sum(len(d) for d in data))
+
+    return results
@@ -0,0 +1,270 @@
+'''
+
+Module to analyse the network of the cell connections: degree distribution, connected components and path
+lengths between cells, across the z-frames.
+
+Cells are the nodes of the network, connected by two kinds of edges:
+    contacts    cells connected on the same z-frame (connections table, see engine.cell_connections)
+    links       the same cell on different z-frames (cells stacked in a 3D skeleton, see volumeprocessing module)
+The degree of a cell counts its contacts, while components and path lengths follow both kinds of edges,
+so that cells connected through other z-frames belong to the same component.
+The network is updated incrementally from the tables of the analysis: only the cells, connections and 3D skeletons
+added since the last update are read (see ConnectionGraph.update). Statistics are computed on scipy sparse
+adjacency matrices, built when queried and cached until the network changes, so they scale to thousands of cells.
+
+'''
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse import csgraph
+
+CONTACT = 0
+LINK = 1
+SAMPLE_SOURCES = 256 # path lengths are measured from at most this many cells
+NETWORK_COLUMNS = ['cell#', 'zframe', 'degree', 'component', 'component-size']
+
+
+class ConnectionGraph():
+    """
+    Class that stores the network of the cell connections and computes its statistics.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """
+        Remove all the cells and the edges.
+        """
+        self.cells = [] # cell # of each node
+        self.zframes = [] # z-frame of each node
+        self.index = dict() # { cell # : node }
+        self.edges = {CONTACT: ([], []), LINK: ([], [])} # { kind : (first nodes, second nodes) }
+
+        # parts of the analysis tables already read (see update)
+        self.zframes_read = dict() # { z-frame : number of cells read }
+        self.connections_read = 0
+        self.volumes_read = set()
+
+        self.cache = dict() # results of the queries, cleared when the network changes
+
+    @classmethod
+    def from_analysis(cls, cell_zframes, connections, volumecells=None):
+        """
+        Network of the cells of an analysis (see update).
+        """
+        network = cls()
+        network.update(cell_zframes, connections, volumecells)
+
+        return network
+
+    def update(self, cell_zframes, connections, volumecells=None):
+        """
+        Add the cells, connections and 3D skeletons added to the analysis since the last update.
+        The tables of the analysis only grow while cells are added: if the connections table is shorter than
+        the part already read (e.g. another project was loaded), the network is built again.
+        :param cell_zframes: cells of each z-frame { z-frame : [Cell #] }
+        :param connections: table of the connections (see engine.empty_connections)
+        :param volumecells: 3D skeletons { Volume # : skeleton dictionary } (see volumeprocessing module)
+        :return: the network
+        """
+        if len(connections) < self.connections_read:
+            self.clear()
+
+        for zframe, cellids in cell_zframes.items():
+            read = self.zframes_read.get(zframe, 0)
+            for cellid in cellids[read:]:
+                self.add_cell(cellid, int(zframe))
+            self.zframes_read[zframe] = len(cellids)
+
+        if len(connections) > self.connections_read:
+            self.add_connections(connections.iloc[self.connections_read:])
+            self.connections_read = len(connections)
+
+        for volumeid, skelvol in (volumecells or dict()).items():
+            if volumeid not in self.volumes_read:
+                self.add_links(skelvol['cells'])
+                self.volumes_read.add(volumeid)
+
+        return self
+
+    def add_cell(self, cellid, zframe):
+        """
+        Add a cell to the network, if it's not already in.
+        :return: node of the cell
+        """
+        cellid = int(cellid)
+        if cellid not in self.index:
+            self.index[cellid] = len(self.cells)
+            self.cells.append(cellid)
+            self.zframes.append(int(zframe))
+            self.cache.clear()
+
+        return self.index[cellid]
+
+    def add_edges(self, kind, pairs):
+        """
+        Add edges between the nodes of the pairs given.
+        """
+        first, second = self.edges[kind]
+        for a, b in pairs:
+            if a != b:
+                first.append(a)
+                second.append(b)
+        self.cache.clear()
+
+    def add_connections(self, table):
+        """
+        Add the contacts of a table of connections (see engine.cell_connections), one for each row.
+        """
+        values = table[['zframe', 'cell1', 'cell2']].values.astype(int)
+        self.add_edges(CONTACT, [(self.add_cell(cell1, zframe), self.add_cell(cell2, zframe))
+                                 for zframe, cell1, cell2 in values])
+
+    def add_links(self, cellids):
+        """
+        Link cells that are the same cell on different z-frames, one link between consecutive z-frames.
+        Cells that are not in the network are ignored.
+        """
+        nodes = sorted((self.index[int(c)] for c in cellids if int(c) in self.index), key=lambda n: self.zframes[n])
+        self.add_edges(LINK, zip(nodes[:-1], nodes[1:]))
+
+    def cached(self, query, compute):
+        """
+        Result of a query, computed the first time after each change of the network.
+        """
+        if query not in self.cache:
+            self.cache[query] = compute()
+
+        return self.cache[query]
+
+    def matrix(self, kinds=(CONTACT, LINK)):
+        """
+        Symmetric adjacency matrix of the cells (scipy sparse CSR matrix of 0 and 1), for the kinds of edges given.
+        Rows and columns are the nodes of the network (see cells).
+        """
+        def compute():
+            first = np.concatenate([np.asarray(self.edges[kind][0], dtype=int) for kind in kinds])
+            second = np.concatenate([np.asarray(self.edges[kind][1], dtype=int) for kind in kinds])
+            n = len(self.cells)
+            adjacency = sparse.coo_matrix((np.ones(len(first)), (first, second)), shape=(n, n)).tocsr()
+            adjacency = adjacency + adjacency.T
+            adjacency.data[:] = 1  # several connections between the same cells are one edge
+
+            return adjacency
+
+        return self.cached(('matrix', tuple(kinds)), compute)
+
+    def degrees(self):
+        """
+        Number of cells in contact with each cell, on the same z-frame.
+        """
+        return self.cached('degrees', lambda: np.diff(self.matrix(kinds=(CONTACT,)).indptr))
+
+    def degree_distribution(self):
+        """
+        Number of cells of each degree: element k is the number of cells in contact with k cells.
+        """
+        return np.bincount(self.degrees(), minlength=1)
+
+    def components(self):
+        """
+        Connected components of the network, through contacts and links.
+        :return: number of components and component of each node
+        """
+        return self.cached('components', lambda: csgraph.connected_components(self.matrix(), directed=False))
+
+    def component_sizes(self):
+        """
+        Number of cells of the component of each node.
+        """
+        ncomponents, labels = self.components()
+
+        return np.bincount(labels, minlength=ncomponents)[labels]
+
+    def path_lengths(self, cellids=None):
+        """
+        Number of edges of the shortest paths from the cells given to all the cells (inf if they are not connected).
+        :param cellids: cells # where the paths start, all the cells if None
+        :return: array (cells given, cells of the network), columns are the nodes of the network
+        """
+        indices = None if cellids is None else [self.index[int(c)] for c in cellids]
+
+        return csgraph.shortest_path(self.matrix(), directed=False, unweighted=True, indices=indices)
+
+    def distance(self, cell1, cell2):
+        """
+        Number of edges of the shortest path between two cells, inf if they are not connected.
+        """
+        return float(self.path_lengths([cell1])[0, self.index[int(cell2)]])
+
+    def path_statistics(self, samples=SAMPLE_SOURCES, seed=0):
+        """
+        Mean length and longest of the shortest paths between connected cells.
+        Paths start from all the cells, or from a random sample of them in networks of more cells
+        (drawn from the cells sorted by cell #, so that it doesn't depend on the order the cells were added).
+        :return: mean path length, diameter (longest path) and True if the paths start from a sample of the cells
+        """
+        def compute():
+            n = len(self.cells)
+            sampled = n > samples
+            sources = np.argsort(self.cells)[np.random.RandomState(seed).choice(n, samples, replace=False)] \
+                if sampled else None
+            lengths = csgraph.shortest_path(self.matrix(), directed=False, unweighted=True, indices=sources)
+            lengths = lengths[np.isfinite(lengths) & (lengths > 0)]
+            if lengths.size == 0:
+                return 0., 0, sampled
+
+            return float(lengths.mean()), int(lengths.max()), sampled
+
+        return self.cached(('paths', samples, seed), compute)
+
+    def summary(self):
+        """
+        Statistics of the network.
+        :return: dictionary of statistics
+        """
+        degrees = self.degrees()
+        ncomponents, _ = self.components()
+        meanpath, diameter, sampled = self.path_statistics()
+
+        return {'cells': len(self.cells),
+                'contacts': int(self.matrix(kinds=(CONTACT,)).nnz // 2),
+                'links': int(self.matrix(kinds=(LINK,)).nnz // 2),
+                'mean-degree': float(degrees.mean()) if len(degrees) > 0 else 0.,
+                'max-degree': int(degrees.max()) if len(degrees) > 0 else 0,
+                'isolated-cells': int(np.sum(degrees == 0)),
+                'degree-distribution': self.degree_distribution().tolist(),
+                'components': int(ncomponents),
+                'largest-component': int(self.component_sizes().max()) if len(self.cells) > 0 else 0,
+                'mean-path-length': meanpath,
+                'diameter': diameter,
+                'sampled-paths': sampled}
+
+    def summary_text(self):
+        """
+        Short description of the network (e.g. for the summary window).
+        """
+        summary = self.summary()
+
+        return '{} cells, {} contacts, {} links | degree: mean {:.2f}, max {} | {} isolated cells | ' \
+               '{} components (largest {} cells) | path length: mean {:.2f}, longest {}{}'.format(
+                   summary['cells'], summary['contacts'], summary['links'], summary['mean-degree'],
+                   summary['max-degree'], summary['isolated-cells'], summary['components'],
+                   summary['largest-component'], summary['mean-path-length'], summary['diameter'],
+                   ' (sampled)' if summary['sampled-paths'] else '')
+
+    def cell_table(self):
+        """
+        Table of the cells of the network, one row for each cell: degree, component and size of the component.
+        """
+        _, labels = self.components()
+        order = np.argsort(self.cells, kind='stable')
+        data = {'cell#': np.asarray(self.cells, dtype=int)[order],
+                'zframe': np.asarray(self.zframes, dtype=int)[order],
+                'degree': self.degrees()[order],
+                'component': labels[order] + 1,
+                'component-size': self.component_sizes()[order]}
+
+        return pd.DataFrame(data, columns=NETWORK_COLUMNS)
@@ -0,0 +1,201 @@
+'''
+
+Module to detect the contacts of the protusion tips with the other cells on the same z-frame.
+
+Connections found by overlapping masks (see engine.mask_connections) miss the protusions that touch another cell
+without overlapping its contour. A tip (final node of a primary protusion, see skeletonprocessing module) touches
+another cell when it is closer to the boundary of its mask than a physical distance tolerance. Skeletons lie inside
+the masks, so the boundary is also the closest a skeleton of the other cell can be. Tips inside the mask of the other
+cell are left to the overlap detection, and pairs of cells that overlap get no tip connection, so that overlaps are
+not counted twice (see engine.cell_connections). Each pair of cells gets at most one tip connection.
+Boundaries and tips of the cells of each z-frame are stored in a ContactIndex: each cell is measured once, and the
+KD-trees (scipy cKDTree) of the points are built when queried and kept until a cell of the z-frame changes.
+Checking a new cell costs O(tips log points) instead of a full frame mask intersection for each pair of cells.
+When memory is short, the z-frames checked least recently are released (see ContactIndex.release): their cells are
+measured again the next time the z-frame is checked.
+
+'''
+
+from collections import OrderedDict
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+# default distance between a tip and the touched cell [pixel]: tips of the medial axis end inside their cell,
+# a pixel or two from its boundary
+CONTACT_TOLERANCE = 3
+
+
+def crop_cell(mask):
+    """
+    Crop a cell mask to its bounding box.
+    :return: cropped mask and (row, column) position of the crop in the full frame, None if the mask is empty
+    """
+    region = ndimage.find_objects(mask.view(np.uint8))
+    if len(region) == 0:
+        return None
+
+    return mask[region[0]], np.array([s.start for s in region[0]])
+
+def cell_boundary(crop, offset):
+    """
+    Boundary pixels of a cropped cell mask (see crop_cell).
+    :return: array (points, 2) of (row, column) in the full frame
+    """
+    boundary = crop & ~ndimage.binary_erosion(crop, border_value=0)
+
+    return np.argwhere(boundary) + offset
+
+def inside(crop, offset, point):
+    """
+    True if a (row, column) point of the full frame is in a cropped cell mask (see crop_cell).
+    """
+    row, col = point[0] - offset[0], point[1] - offset[1]
+
+    return 0 <= row < crop.shape[0] and 0 <= col < crop.shape[1] and bool(crop[row, col])
+
+def protusion_tips(skelprot):
+    """
+    Tips of the primary protusions of a cell (final nodes, see skeletonprocessing.branch_parameters_extration).
+    :param skelprot: protusions skeleton dictionary, None if the cell was not skeletonized
+    :return: array (tips, 2) of (row, column)
+    """
+    if not isinstance(skelprot, dict):
+        return np.zeros((0, 2), dtype=int)
+
+    return np.column_stack([np.asarray(skelprot.get('final_node-coord-' + str(axis), []), dtype=int)
+                            for axis in (0, 1)]).reshape(-1, 2)
+
+
+class ContactIndex():
+    """
+    Class that stores the boundaries and tips of the cells of each z-frame and finds the contacts of the tips.
+    """
+
+    def __init__(self, physicspacing=1, tolerance=None):
+        """
+        :param physicspacing: pixel physical size (row, column) (see skeletonprocessing.pixel_spacing)
+        :param tolerance: largest distance between a tip and the touched cell [physical unit],
+        CONTACT_TOLERANCE pixels if None
+        """
+        self.spacing = np.broadcast_to(np.asarray(physicspacing, dtype=float), (2,))
+        self.tolerance = tolerance if tolerance is not None else CONTACT_TOLERANCE * float(self.spacing.mean())
+        # { z-frame : { Cell # : (cropped mask, crop position, boundary, tips) } }, least recently checked first
+        self.frames = OrderedDict()
+        self.trees = dict() # { z-frame : (boundary tree, cell # of each boundary point, tips, cell # of each tip) }
+
+    def discard(self, cellid):
+        """
+        Forget a cell (e.g. when its skeleton changes): it is measured again when needed.
+        """
+        for zframe, cells in self.frames.items():
+            if cells.pop(int(cellid), None) is not None:
+                self.trees.pop(zframe, None)
+
+    def add_cell(self, zframe, cellid, mask, skelprot=None):
+        """
+        Measure a cell: boundary of its mask and tips of its protusions. Only the crop of the mask is kept.
+        """
+        cropped = crop_cell(mask)
+        if cropped is None:
+            cropped = np.zeros((0, 0), dtype=bool), np.zeros(2, dtype=int)
+        crop, offset = cropped
+
+        self.frames.setdefault(int(zframe), dict())[int(cellid)] = (crop, offset, cell_boundary(crop, offset),
+                                                                     protusion_tips(skelprot))
+        self.trees.pop(int(zframe), None)
+
+    def cell_crop(self, zframe, cellid):
+        """
+        Cropped mask of a cell in the index and (row, column) position of the crop in the full frame.
+        """
+        crop, offset, _, _ = self.frames[int(zframe)][int(cellid)]
+
+        return crop, offset
+
+    def ensure_cells(self, zframe, cellIDs, shapecells):
+        """
+        Measure the cells of a z-frame that are not in the index yet (e.g. cells of a project file).
+        """
+        cells = self.frames.get(int(zframe), dict())
+        for cellid in cellIDs:
+            if int(cellid) not in cells:
+                cell = shapecells[str(cellid)]
+                self.add_cell(zframe, cellid, cell.contour['mask'], getattr(cell, 'skelprot', None))
+        if int(zframe) in self.frames:
+            self.frames.move_to_end(int(zframe))
+
+    def nbytes(self):
+        """
+        Memory of the cropped masks, boundaries and tips of the cells in the index, in bytes.
+        """
+        return sum(array.nbytes for cells in self.frames.values() for values in cells.values() for array in values)
+
+    def release(self, size):
+        """
+        Remove the z-frames checked least recently, until at least size bytes are released.
+        :return: bytes released
+        """
+        released = 0
+        while released < size and len(self.frames) > 0:
+            zframe, cells = self.frames.popitem(last=False)
+            released += sum(array.nbytes for values in cells.values() for array in values)
+            self.trees.pop(zframe, None)
+
+        return released
+
+    def frame_trees(self, zframe):
+        """
+        KD-tree of the boundary points (in physical units) and tips of the cells of a z-frame, with their cells.
+        """
+        zframe = int(zframe)
+        if zframe not in self.trees:
+            cells = self.frames.get(zframe, dict())
+            arrays = []
+            for item in (2, 3):  # boundaries, tips
+                points = [values[item] for values in cells.values()] + [np.zeros((0, 2), dtype=int)]
+                owners = [np.full(len(values[item]), cellid, dtype=int) for cellid, values in cells.items()] + \
+                         [np.zeros(0, dtype=int)]
+                arrays.extend([np.concatenate(points), np.concatenate(owners)])
+            boundaries, boundaryowners, tips, tipowners = arrays
+            self.trees[zframe] = (cKDTree(boundaries * self.spacing), boundaryowners, tips, tipowners)
+
+        return self.trees[zframe]
+
+    def tip_contacts(self, zframe, cellid, mask, skelprot, cellIDs):
+        """
+        Contacts between the tips of a cell and the other cells of the z-frame, and between the tips of the other
+        cells and the cell. Tips inside the mask of the touched cell are overlaps (see engine.mask_connections).
+        :param cellIDs: cells of the z-frame, already in the index (see ensure_cells)
+        :return: list of (touched cell #, row, column of the tip), one for each tip and touched cell
+        """
+        cellid = int(cellid)
+        others = set(int(c) for c in cellIDs) - {cellid}
+        contacts = []
+        if len(others) == 0:
+            return contacts
+
+        cells = self.frames[int(zframe)]
+        boundarytree, boundaryowners, frametips, tipowners = self.frame_trees(zframe)
+
+        # tips of the cell near the boundaries of the other cells
+        tips = protusion_tips(skelprot)
+        if len(tips) > 0 and boundarytree.n > 0:
+            for tip, near in zip(tips, boundarytree.query_ball_point(tips * self.spacing, self.tolerance)):
+                for other in np.unique(boundaryowners[near]):
+                    if other in others and not inside(cells[other][0], cells[other][1], tip):
+                        contacts.append((int(other), int(tip[0]), int(tip[1])))
+
+        # tips of the other cells near the boundary of the cell
+        cropped = crop_cell(mask)
+        candidates = np.isin(tipowners, list(others))
+        if cropped is not None and candidates.any():
+            crop, offset = cropped
+            boundarytree = cKDTree(cell_boundary(crop, offset) * self.spacing)
+            distances, _ = boundarytree.query(frametips[candidates] * self.spacing,
+                                              distance_upper_bound=self.tolerance + 1e-9)
+            for tip, other, distance in zip(frametips[candidates], tipowners[candidates], distances):
+                if np.isfinite(distance) and not inside(crop, offset, tip):
+                    contacts.append((int(other), int(tip[0]), int(tip[1])))
+
+        return contacts
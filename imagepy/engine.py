@@ -0,0 +1,363 @@
+'''
+
+Module to run the analysis of an image without the GUI (headless), e.g. on servers with no display.
+
+The engine uses the same algorithms of the GUI: cell contours (from the automatic segmentation or
+imported ROIs) are converted to masks, skeletonized and checked for connections with the cells
+on the same z-frame. Results are stored with the same structures of the GUI (see imageprocesser.ImProcc),
+so they can be saved as project files and opened in the GUI, or exported as tables.
+The functions used to convert contours to cells are shared with the GUI.
+
+'''
+
+import numpy as np
+import pandas as pd
+import matplotlib.path as mplPath
+from scipy.ndimage import label
+from skimage.measure import regionprops
+from skimage.morphology import closing
+try:
+    from matplotlib import colormaps
+    CELL_COLORS = colormaps['Set1'].colors
+except ImportError:  # matplotlib < 3.5
+    from matplotlib import cm
+    CELL_COLORS = cm.get_cmap('Set1').colors
+import imagepy.cellrecord as cr
+import imagepy.connectivity as conn
+import imagepy.contacts as ct
+import imagepy.tracking as tr
+import imagepy.parallelskeleton as pskel
+import imagepy.profiling as prof
+import imagepy.export as exp
+import imagepy.memory as mem
+import imagepy.projectfile as pf
+import imagepy.segmentation as seg
+import imagepy.skeletonprocessing as skpro
+from imagepy.imagefile import load_image, image_frame
+
+CONNECTION_COLUMNS = ['zframe', 'cell1', 'cell2', 'centerX', 'centerY', 'kind']
+# kinds of connections
+CONNECTION_OVERLAP = 0 # the masks of the cells overlap
+CONNECTION_TIP = 1 # a protusion tip touches the other cell (see contacts module)
+
+
+def contour_area(xdata, ydata, dxyz=None):
+    """
+    Area of a cell contour (shoelace formula), in physical units if the pixel size is known.
+    :param dxyz: pixel physical size (see imagefile.pbf2pickle), pixel units if None
+    """
+    area = 0.5 * np.abs(np.dot(xdata, np.roll(ydata, 1)) - np.dot(ydata, np.roll(xdata, 1)))
+
+    return area * np.prod(skpro.pixel_spacing(dxyz, ndim=2))
+
+def contour_mask(xdata, ydata, shape):
+    """
+    Create the cell image mask from the cell boundary.
+    Masking sometimes creates separate regions: only the biggest one is kept.
+    :param shape: (rows, columns) of the image
+    """
+    ny, nx = shape
+    poly_verts = [(xdata[0], ydata[0])]
+    for i in range(len(xdata) - 1, -1, -1):
+        poly_verts.append((xdata[i], ydata[i]))
+
+    # Create vertex coordinates for each grid cell...
+    # (<0,0> is at the top left of the grid in this system)
+    with prof.stage('mask.polygon'):
+        x, y = np.meshgrid(np.arange(nx), np.arange(ny))
+        points = np.vstack((x.flatten(), y.flatten())).T
+        mask = mplPath.Path(poly_verts).contains_points(points).reshape((ny, nx))
+
+    with prof.stage('mask.closing'):
+        mask = closing(mask)
+
+    with prof.stage('mask.label'):
+        structure = np.ones((3, 3), dtype=int)  # in this case we allow any kind of connection
+        labeled, ncomponents = label(mask, structure)
+        if ncomponents == 0:
+            return mask
+
+        areas = [r.area for r in regionprops(labeled)]
+
+    return labeled == np.array(areas).argmax() + 1
+
+def cell_color(cell_id):
+    """
+    Color of a cell, from the Set1 colormap.
+    """
+    return CELL_COLORS[cell_id % 7]  # 8 is the numbers of colors in the Set1 colormap
+
+def mask_connections(cellmask, cell_id, zframe, shapecells, cellIDs, contacts=None):
+    """
+    Determine cell connections with the other cells selected on the same frame, where their masks overlap.
+    Masks are compared only in the intersection of their bounding boxes.
+    :param cellIDs: cells on the same z-frame
+    :param contacts: index of the cropped masks of the cells (see contacts.ContactIndex), the masks of shapecells
+    are cropped if None
+    :return: list of connections [zframe, cell1, cell2, centerX, centerY, kind]
+    """
+    rows = []
+    cropped = ct.crop_cell(cellmask)
+    if cropped is None:
+        return rows
+    crop, offset = cropped
+
+    for cellID in cellIDs:
+        if contacts is not None:
+            othercrop, otheroffset = contacts.cell_crop(zframe, cellID)
+        else:
+            othercrop, otheroffset = ct.crop_cell(shapecells[str(cellID)].contour['mask']) or \
+                                     (np.zeros((0, 0), dtype=bool), np.zeros(2, dtype=int))
+
+        # check intersections between processed cell mask and one of a cell already processed on the same z frame
+        start = np.maximum(offset, otheroffset)
+        stop = np.minimum(offset + crop.shape, otheroffset + othercrop.shape)
+        if np.any(stop <= start):
+            continue
+        mask = crop[start[0] - offset[0]:stop[0] - offset[0], start[1] - offset[1]:stop[1] - offset[1]] & \
+               othercrop[start[0] - otheroffset[0]:stop[0] - otheroffset[0],
+                         start[1] - otheroffset[1]:stop[1] - otheroffset[1]]
+
+        structure = np.ones((3, 3), dtype=int)  # in this case we allow any kind of connection
+        # in case there more connections between the same cells
+        labeled, nconnections = label(mask, structure)
+
+        for r in regionprops(labeled):
+            center = (np.array(r.centroid) + start).astype(int).tolist()
+            rows.append([zframe, cell_id, cellID, center[1], center[0], CONNECTION_OVERLAP])
+
+    return rows
+
+def tip_connections(contacts, cellmask, skelprot, cell_id, zframe, shapecells, cellIDs, overlapping=()):
+    """
+    Determine cell connections with the other cells selected on the same frame, where a protusion tip touches
+    a cell without overlapping its mask (see contacts module), at most one for each pair of cells.
+    The cell is then added to the index of the contacts.
+    :param contacts: index of the cell boundaries and tips (see contacts.ContactIndex)
+    :param skelprot: protusions skeleton dictionary of the cell, None if the cell was not skeletonized
+    :param cellIDs: cells on the same z-frame
+    :param overlapping: cells whose masks overlap the cell (see mask_connections), they get no tip connection
+    :return: list of connections [zframe, cell1, cell2, centerX, centerY, kind], centered on the first tip found
+    """
+    contacts.ensure_cells(zframe, cellIDs, shapecells)
+    touched = set(int(c) for c in overlapping)
+    rows = []
+    for cellID, row, col in contacts.tip_contacts(zframe, cell_id, cellmask, skelprot, cellIDs):
+        if cellID not in touched:
+            touched.add(cellID)
+            rows.append([zframe, cell_id, cellID, col, row, CONNECTION_TIP])
+    contacts.add_cell(zframe, cell_id, cellmask, skelprot)
+
+    return rows
+
+def cell_connections(contacts, cellmask, skelprot, cell_id, zframe, shapecells, cellIDs):
+    """
+    Determine cell connections with the other cells selected on the same frame: overlapping masks
+    (see mask_connections) and protusion tips touching the cells that don't overlap (see tip_connections).
+    The cell is then added to the index of the contacts.
+    :return: list of connections [zframe, cell1, cell2, centerX, centerY, kind]
+    """
+    contacts.ensure_cells(zframe, cellIDs, shapecells)
+    rows = mask_connections(cellmask, cell_id, zframe, shapecells, cellIDs, contacts)
+
+    return rows + tip_connections(contacts, cellmask, skelprot, cell_id, zframe, shapecells, cellIDs,
+                                  overlapping=[row[2] for row in rows])
+
+def empty_connections():
+    """
+    Empty table of the cell connections.
+    """
+    return pd.DataFrame(np.empty((0, len(CONNECTION_COLUMNS)), dtype=int), columns=CONNECTION_COLUMNS)
+
+def normalize_connections(connections):
+    """
+    Table of the cell connections with all the columns: connections of older projects are mask overlaps.
+    """
+    if 'kind' not in connections.columns:
+        connections = connections.assign(kind=CONNECTION_OVERLAP)
+    elif connections['kind'].isnull().any():  # journals of older sessions replayed on a newer table
+        connections = connections.assign(kind=connections['kind'].fillna(CONNECTION_OVERLAP).astype(int))
+
+    return connections
+
+
+class AnalysisEngine():
+    """
+    Class that contains the analysis results of an image and the methods to compute them without the GUI.
+    """
+
+    def __init__(self, imgfile):
+        """
+        Initialize an empty analysis.
+        :param imgfile: image (see imagefile.pbf2pickle)
+        """
+        self.imgfile = imgfile
+
+        self.shapecells = dict() # dictionary containing cell shape objects { Cell # : cell object }
+        self.cell_zframes = dict() # cells of each z-frame { z-frame : [Cell #] }
+        self.volumecells = dict() # dictionary containing 3D skeletons { Volume # : skeleton dictionary }
+        self.connections = empty_connections() # cells connections and their coordinates
+        self.network = conn.ConnectionGraph() # network of the cell connections (see connectivity module)
+        # boundaries and protusion tips of the cells, to find the tips touching other cells (see contacts module)
+        self.contacts = ct.ContactIndex(skpro.pixel_spacing(imgfile.dxyz, ndim=2))
+        # links of the cells through the z-frames (see tracking module)
+        self.tracker = tr.CellLinker(skpro.pixel_spacing(imgfile.dxyz, ndim=2))
+
+        # memory held by the analysis, kept within the budget (see memory module)
+        mem.ACCOUNTANT.register('frames', lambda: mem.nbytes(self.imgfile.imgdata))
+        mem.ACCOUNTANT.register('cells', lambda: pf.cells_nbytes(self.shapecells),
+                                lambda size: pf.release_cells(self.shapecells, size), mem.PRIORITY_CELLS)
+        mem.ACCOUNTANT.register('contacts', self.contacts.nbytes, self.contacts.release, mem.PRIORITY_CACHE)
+        mem.ACCOUNTANT.register('tracks', self.tracker.nbytes, self.tracker.release, mem.PRIORITY_CACHE)
+
+    @classmethod
+    def from_path(cls, path):
+        """
+        Initialize an empty analysis of an image file.
+        """
+        return cls(load_image(path))
+
+    @classmethod
+    def from_project(cls, path, imgfile=None):
+        """
+        Initialize the analysis from a project file (see projectfile module).
+        :param imgfile: source image, loaded from the path stored in the project if None
+        """
+        project = pf.load_project(path)
+        engine = cls(imgfile if imgfile is not None else load_image(project['image']['path']))
+        engine.shapecells = project['shapecells']
+        engine.cell_zframes = project['cell_zframes']
+        engine.connections = normalize_connections(project['connections'])
+        engine.volumecells = project['volumecells']
+        engine.network = conn.ConnectionGraph.from_analysis(engine.cell_zframes, engine.connections, engine.volumecells)
+
+        return engine
+
+    def add_cell(self, xdata, ydata, zframe):
+        """
+        Add a cell from its contour: mask, area, skeleton and connections with the cells on the same z-frame
+        (overlapping masks and touching protusion tips).
+        :return: cell #
+        """
+        return self.add_cells([(xdata, ydata, zframe)], workers=1)[0]
+
+    def add_cells(self, contours, workers=None):
+        """
+        Add many cells from their contours, cells are skeletonized in parallel (see parallelskeleton module).
+        :param contours: list of (xdata, ydata, z-frame)
+        :param workers: number of processes, all the available cores if None
+        :return: list of the cells added
+        """
+        imgfile = self.imgfile
+
+        try:
+            first_id = max(map(int, self.shapecells.keys())) + 1
+        except ValueError:
+            first_id = 1
+
+        cells = dict()
+        for cell_id, (xdata, ydata, zframe) in enumerate(contours, start=first_id):
+            shape = image_frame(imgfile, zframe).shape[:2]
+            cells[cell_id] = cr.CellRecord(zframe=zframe,
+                                           contour={'allxpoints': list(xdata), 'allypoints': list(ydata),
+                                                    'color': cell_color(cell_id),
+                                                    'area': contour_area(xdata, ydata, imgfile.dxyz),
+                                                    'mask': contour_mask(xdata, ydata, shape)})
+
+        physpace = skpro.pixel_spacing(imgfile.dxyz, ndim=2)
+        masks = {cell_id: cell.contour['mask'] for cell_id, cell in cells.items()}
+        for cell_id, result in pskel.skeletonize_cells(masks, physpace, workers):
+            if isinstance(result, Exception):
+                print('Cell # {}: skeletonization failed'.format(cell_id))
+            else:
+                _, cells[cell_id].skelbody, cells[cell_id].skelprot = result
+
+        # connections in the order of the cells, as if they were added one by one
+        for cell_id, cell in cells.items():
+            cellIDs = self.cell_zframes.get(str(cell.zframe), [])
+            rows = cell_connections(self.contacts, cell.contour['mask'], getattr(cell, 'skelprot', None), cell_id,
+                                    cell.zframe, self.shapecells, cellIDs)
+            if len(rows) > 0:
+                self.connections = pd.concat([self.connections, pd.DataFrame(rows, columns=CONNECTION_COLUMNS)],
+                                             ignore_index=True)
+
+            self.shapecells[str(cell_id)] = cell
+            self.cell_zframes.setdefault(str(cell.zframe), []).append(cell_id)
+            self.tracker.add_cell(cell.zframe, cell_id, cell.contour['mask'])
+        self.update_network()
+
+        return list(cells.keys())
+
+    def zframes(self):
+        """
+        All the z-frames of the image.
+        """
+        return list(range(self.imgfile.shape[2]))
+
+    def segment(self, zframes=None, workers=None, **parameters):
+        """
+        Automatic segmentation of z-frames (see segmentation module), each region is added as a cell.
+        :param zframes: z-frames to segment, all if None
+        :return: list of the cells added
+        """
+        if zframes is None:
+            zframes = self.zframes()
+
+        planes = {z: image_frame(self.imgfile, z) for z in zframes}
+        labeled = seg.segment_stack(planes, workers, **parameters)
+
+        contours = []
+        for zframe in sorted(labeled.keys()):
+            for xdata, ydata in seg.region_contours(labeled[zframe], tolerance=parameters.get('tolerance', 1.0)):
+                contours.append((xdata, ydata, zframe))
+
+        return self.add_cells(contours, workers)
+
+    def import_rois(self, path, workers=None):
+        """
+        Add the cells of a ROI file: CSV file with columns roi, zframe, x, y (one row for each vertex of the contours).
+        :return: list of the cells added
+        """
+        rois = pd.read_csv(path)
+
+        contours = [(roi['x'].values.astype(float), roi['y'].values.astype(float), int(zframe))
+                    for (_, zframe), roi in rois.groupby(['roi', 'zframe'], sort=False)]
+
+        return self.add_cells(contours, workers)
+
+    def save(self, path):
+        """
+        Save the analysis as a project file (see projectfile module), it can be opened in the GUI.
+        Cells saved can be released from memory when the memory budget is exceeded.
+        """
+        self.shapecells = pf.save_project(path, self.imgfile, self.shapecells, self.cell_zframes, self.connections,
+                                          self.volumecells)
+        mem.ACCOUNTANT.enforce()
+
+    def update_network(self):
+        """
+        Add the cells, connections and 3D skeletons added since the last update to the connection network.
+        :return: the network (see connectivity.ConnectionGraph)
+        """
+        return self.network.update(self.cell_zframes, self.connections, self.volumecells)
+
+    def tracks(self):
+        """
+        Tracks of the cells linked through the z-frames, solving the links of the z-frames with new cells.
+        :return: list of tracks (see tracking.CellTrack)
+        """
+        return self.tracker.update(self.cell_zframes, self.shapecells).tracks()
+
+    def memory_usage(self):
+        """
+        Memory held by the analysis (see memory module).
+        :return: dictionary { pool : bytes }, e.g. frames and cells
+        """
+        return mem.ACCOUNTANT.usage()
+
+    def export(self, path, tables=exp.TABLES):
+        """
+        Export the analysis results as tables (see export module).
+        """
+        exp.export_analysis(path, self.imgfile, self.shapecells, self.connections, self.volumecells, tables,
+                            network=self.update_network(), tracks=self.tracks())
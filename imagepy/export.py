@@ -0,0 +1,417 @@
+'''
+
+Module to export the analysis results as tables, written in chunks so that memory does not depend
+on the number of cells:
+    cells           one row for each cell (area, number and total length of the primary protusions)
+    protusions      one row for each primary protusion, with its morphology metrics (see protusion_tab)
+    paths           one row for each pixel of the skeleton paths (cell body and protusions)
+    connections     one row for each connection between cells
+    network         one row for each cell of the connection network (see connectivity.ConnectionGraph.cell_table)
+    tracks          one row for each cell linked through the z-frames (see tracking.track_tab)
+    volumes         one row for each protusion of the 3D skeletons (see volume_protusion_tab)
+Tables are written to CSV, Parquet (pyarrow), HDF5 (PyTables) or Excel files, chosen by the file extension.
+Excel files don't get the paths table, longer than the rows of a sheet for a few cells (see ExcelSink).
+Physical units and image size are stored as metadata (a sidecar .json file for CSV files), with the
+statistics of the connection network.
+
+'''
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from imagepy.skeletonprocessing import pixel_spacing
+from imagepy.skeletongraph import cell_graph
+from imagepy.tracking import track_tab
+
+CHUNKSIZE = 1000 # number of cells written at once
+EXCEL_ROWS = 1048575 # rows of an Excel sheet, without the heading
+HDF5_ITEMSIZE = 1024 # least width of the text columns of HDF5 tables, fixed when a table is created
+TABLES = ('cells', 'protusions', 'paths', 'connections', 'network', 'tracks', 'volumes')
+# morphology metrics of the protusions table and their decimals (see skeletongraph.SkeletonGraph.protusion_metrics)
+METRIC_DECIMALS = {'branches': 0, 'max-order': 0, 'secondary-length': 1, 'tortuosity': 3, 'width': 2,
+                   'orientation': 1}
+
+
+def export_metadata(imgfile, network=None):
+    """
+    Metadata of the exported tables: source image, image size, physical units of the columns and
+    statistics of the connection network (see connectivity.ConnectionGraph.summary), if given.
+    """
+    unit = getattr(imgfile, 'unit', None) or 'pixel'
+    dxyz = getattr(imgfile, 'dxyz', None)
+    spacing = pixel_spacing(dxyz, ndim=3)[::-1] # X, Y, Z
+
+    metadata = {'source': getattr(imgfile, 'path', None),
+                'image-size': {'x': imgfile.imgsize['x'], 'y': imgfile.imgsize['y'], 'z': imgfile.shape[2]},
+                'unit': unit,
+                'pixel-size': {'x': float(spacing[0]), 'y': float(spacing[1]),
+                               'z': float(spacing[2]) if dxyz is None or len(dxyz) > 2 else None},
+                'units': {'cells': {'area': unit + '^2', 'total-length': unit, 'body-length': unit},
+                          'protusions': {'area': unit + '^2', 'euclidean-length': unit, 'total-length': unit,
+                                         'secondary-length': unit, 'width': unit, 'orientation': 'degree'},
+                          'paths': {'row': 'pixel', 'column': 'pixel'},
+                          'connections': {'centerX': 'pixel', 'centerY': 'pixel'},
+                          'tracks': {'volume': unit + '^3', 'max-length': unit, 'mean-total-length': unit,
+                                     'width': unit},
+                          'volumes': {'euclidean-length': unit, 'path-length': unit}},
+                'zframe': 'z-frames are numbered from 0',
+                'connection-kinds': {'0': 'overlapping masks', '1': 'protusion tip touching the other cell'}}
+    if network is not None:
+        metadata['network'] = network.summary()
+
+    return metadata
+
+def protusion_tab(shapecells):
+    """
+    Create the updated protusion tab, one row for each primary protusion
+    (cells without protusions have one row with protusion_id 0).
+    The table is built in one pass from the values of all the cells gathered in columns.
+         list of values:
+         cell # and z frame
+         cell area
+         protusion id and length of the primary protusion
+         number of primary protusions and their total length (cell aggregates)
+         morphology metrics of the protusion (see skeletongraph.SkeletonGraph.protusion_metrics)
+    """
+    row = ['cell#', 'zframe', 'area', 'protusion_id', 'euclidean-length', 'protusions', 'total-length'] + \
+          list(METRIC_DECIMALS.keys())
+
+    cellids = sorted(shapecells.keys(), key=int)
+    zframes = np.empty(len(cellids), dtype=int)
+    areas = np.empty(len(cellids))
+    lengths = []
+    metrics = {metric: [] for metric in METRIC_DECIMALS}
+    for n, i in enumerate(cellids):
+        cell = shapecells[i]
+        zframes[n] = cell.zframe
+        areas[n] = cell.contour['area']
+        graph = cell_graph(cell)
+        if graph is None:  # cell not skeletonized
+            lengths.append(np.empty(0))
+            continue
+
+        lengths.append(np.asarray(cell.skelprot['euclidean-length'], dtype=float))
+        for metric, values in graph.protusion_metrics().items():
+            metrics[metric].append(values)
+
+    nprotusions = np.array([len(l) for l in lengths], dtype=int)
+    totlengths = np.array([l.sum() for l in lengths])
+    nrows = np.maximum(nprotusions, 1)  # one row for cells without protusions
+
+    # protusion id of each row: 1..n within each cell, 0 for cells without protusions
+    firstrow = np.repeat(np.cumsum(nrows) - nrows, nrows)
+    protids = np.arange(nrows.sum()) - firstrow + 1
+    protids[np.repeat(nprotusions == 0, nrows)] = 0
+
+    protlengths = np.full(nrows.sum(), np.nan)
+    protlengths[protids > 0] = np.concatenate(lengths + [np.empty(0)])
+
+    data = {'cell#': np.repeat(np.array(cellids, dtype=int), nrows),
+            'zframe': np.repeat(zframes, nrows),
+            'area': np.repeat(np.around(areas, decimals=1), nrows),
+            'protusion_id': protids,
+            'euclidean-length': np.around(protlengths, decimals=1),
+            'protusions': np.repeat(nprotusions, nrows),
+            'total-length': np.repeat(np.around(totlengths, decimals=1), nrows)}
+    for metric, decimals in METRIC_DECIMALS.items():
+        values = np.full(nrows.sum(), np.nan)
+        values[protids > 0] = np.concatenate(metrics[metric] + [np.empty(0)])
+        data[metric] = np.around(values, decimals=decimals)
+
+    return pd.DataFrame(data, columns=row)
+
+def volume_protusion_tab(volumecells):
+    """
+    Create the tab of the protusions extracted from 3D skeletons (see volumeprocessing module),
+    one row for each protusion.
+    """
+    row = ['volume#', 'cells', 'zframes', 'protusion_id', 'euclidean-length', 'path-length']
+    data = []
+    for i in volumecells.keys():
+        skelvol = volumecells[i]
+        cells = ', '.join(map(str, skelvol['cells']))
+        zframes = '{} - {}'.format(skelvol['zframes'][0] + 1, skelvol['zframes'][-1] + 1)
+        for protid, euclidean, path in zip(skelvol['protusion_id'], skelvol['euclidean-length'],
+                                           skelvol['path-length']):
+            data.append([int(i), cells, zframes, protid,
+                         np.around(euclidean, decimals=1), np.around(path, decimals=1)])
+
+    return pd.DataFrame(data, columns=row)
+
+def cell_chunks(shapecells, chunksize=CHUNKSIZE):
+    """
+    Table of the cells, one row for each cell.
+    :return: generator of DataFrame chunks
+    """
+    cellids = sorted(shapecells.keys(), key=int)
+    for start in range(0, len(cellids), chunksize):
+        chunk = {i: shapecells[i] for i in cellids[start:start + chunksize]}
+
+        protTab = protusion_tab(chunk)
+        cellTab = protTab.drop_duplicates('cell#')[['cell#', 'zframe', 'area', 'protusions', 'total-length']]
+
+        bodylengths = []
+        for cell in chunk.values():
+            try:
+                bodylengths.append(np.sum(cell.skelbody['lengths']))
+            except AttributeError:  # cell not skeletonized
+                bodylengths.append(np.nan)
+        cellTab = cellTab.assign(**{'body-length': np.around(bodylengths, decimals=1)})
+
+        yield cellTab.reset_index(drop=True)
+
+def protusion_chunks(shapecells, chunksize=CHUNKSIZE):
+    """
+    Table of the primary protusions, one row for each protusion (see protusion_tab).
+    :return: generator of DataFrame chunks
+    """
+    cellids = sorted(shapecells.keys(), key=int)
+    for start in range(0, len(cellids), chunksize):
+        yield protusion_tab({i: shapecells[i] for i in cellids[start:start + chunksize]})
+
+def path_chunks(shapecells, chunksize=CHUNKSIZE):
+    """
+    Table of the pixels of the skeleton paths, one row for each pixel.
+    protusion_id is 0 for the paths of the cell body, path is 0 for the primary path of a protusion
+    and 1, 2, ... for its secondary paths.
+    :return: generator of DataFrame chunks
+    """
+    row = ['cell#', 'protusion_id', 'path', 'point', 'row', 'column']
+
+    cellids = sorted(shapecells.keys(), key=int)
+    for start in range(0, len(cellids), chunksize):
+        # packed paths of the skeleton graphs (see skeletongraph module)
+        coords = []
+        labels = [] # (cell #, protusion id, path) of each pixel
+        points = [] # number of each pixel in its path
+        for i in cellids[start:start + chunksize]:
+            graph = cell_graph(shapecells[i])
+            if graph is None:  # cell not skeletonized
+                continue
+
+            npoints = np.diff(graph.offsets)
+            pathlabels = np.stack([np.full(len(npoints), int(i)), graph.path_protusion, graph.path_number], axis=1)
+            labels.append(np.repeat(pathlabels, npoints, axis=0))
+            coords.append(graph.coords)
+            points.append(np.arange(len(graph.coords)) - np.repeat(graph.offsets[:-1], npoints))
+
+        if len(coords) == 0:
+            continue
+
+        labels = np.concatenate(labels)
+        coords = np.concatenate(coords).astype(int)
+        points = np.concatenate(points)
+
+        yield pd.DataFrame({'cell#': labels[:, 0], 'protusion_id': labels[:, 1], 'path': labels[:, 2],
+                            'point': points, 'row': coords[:, 0], 'column': coords[:, 1]}, columns=row)
+
+def connection_chunks(connections, chunksize=CHUNKSIZE * 10):
+    """
+    Table of the connections between cells, one row for each connection.
+    :return: generator of DataFrame chunks
+    """
+    # at least one chunk, so that the table is written even without connections
+    for start in range(0, max(len(connections), 1), chunksize):
+        yield connections.iloc[start:start + chunksize].astype(np.int64).reset_index(drop=True)
+
+def network_chunks(network):
+    """
+    Table of the cells of the connection network (see connectivity.ConnectionGraph.cell_table).
+    The table has one row for each cell: it is written in one chunk.
+    :return: generator of DataFrame chunks
+    """
+    if network is not None:
+        yield network.cell_table()
+
+def track_chunks(tracks, shapecells, zspacing=1, chunksize=CHUNKSIZE):
+    """
+    Table of the cell tracks (see tracking.track_tab), one row for each track.
+    :param tracks: list of tracks (see tracking.CellLinker.tracks)
+    :return: generator of DataFrame chunks
+    """
+    for start in range(0, len(tracks), chunksize):
+        yield track_tab(tracks[start:start + chunksize], shapecells, zspacing)
+
+def volume_chunks(volumecells):
+    """
+    Table of the protusions of the 3D skeletons (see volume_protusion_tab).
+    3D skeletons are few: the table is written in one chunk.
+    :return: generator of DataFrame chunks
+    """
+    if len(volumecells) > 0:
+        yield volume_protusion_tab(volumecells)
+
+def flatten_metadata(metadata, prefix=''):
+    """
+    Metadata as a list of (name, value), nested names joined by dots.
+    """
+    items = []
+    for key, value in metadata.items():
+        if isinstance(value, dict):
+            items.extend(flatten_metadata(value, prefix + key + '.'))
+        elif isinstance(value, list):
+            items.append((prefix + key, ', '.join(map(str, value))))
+        else:
+            items.append((prefix + key, value))
+
+    return items
+
+
+class CsvSink():
+    """
+    Write each table to a CSV file (<name>_<table>.csv), metadata to <name>_metadata.json.
+    """
+
+    def __init__(self, path, metadata):
+        self.base = os.path.splitext(path)[0]
+        self.files = dict()
+
+        with open(self.base + '_metadata.json', 'w') as f:
+            json.dump(metadata, f, indent=1)
+
+    def write(self, table, chunk):
+        if table not in self.files:
+            self.files[table] = open(self.base + '_' + table + '.csv', 'w', newline='')
+            chunk.to_csv(self.files[table], index=False)
+        else:
+            chunk.to_csv(self.files[table], index=False, header=False)
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+class ParquetSink():
+    """
+    Write each table to a Parquet file (<name>_<table>.parquet), metadata in the schema of each file.
+    Requires pyarrow.
+    """
+
+    def __init__(self, path, metadata):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet export requires pyarrow (pip install pyarrow).')
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+
+        self.base = os.path.splitext(path)[0]
+        self.metadata = {b'imagepy': json.dumps(metadata).encode('utf-8')}
+        self.writers = dict()
+
+    def write(self, table, chunk):
+        arrowtable = self.pa.Table.from_pandas(chunk, preserve_index=False)
+        if table not in self.writers:
+            metadata = dict(arrowtable.schema.metadata or {})
+            metadata.update(self.metadata)
+            schema = arrowtable.schema.with_metadata(metadata)
+            self.writers[table] = self.pq.ParquetWriter(self.base + '_' + table + '.parquet', schema)
+        self.writers[table].write_table(arrowtable.cast(self.writers[table].schema))
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class Hdf5Sink():
+    """
+    Write all the tables to a HDF5 file, one node for each table, metadata in the attributes of each node.
+    The width of the text columns is fixed by the first chunk of a table: it is at least HDF5_ITEMSIZE characters,
+    so that the chunks written later (e.g. longer file names or track cells) fit. Requires PyTables.
+    """
+
+    def __init__(self, path, metadata):
+        try:
+            import tables
+        except ImportError:
+            raise ImportError('HDF5 export requires PyTables (pip install tables).')
+
+        self.store = pd.HDFStore(path, mode='w', complevel=5, complib='zlib')
+        self.metadata = metadata
+        self.created = set() # tables already in the file
+
+    def write(self, table, chunk):
+        itemsize = None
+        if table not in self.created:
+            self.created.add(table)
+            itemsize = {column: max(HDF5_ITEMSIZE, int(chunk[column].astype(str).str.len().max()))
+                        for column in chunk.columns if chunk[column].dtype == object and len(chunk) > 0}
+        self.store.append(table, chunk, format='table', index=False, min_itemsize=itemsize or None)
+
+    def close(self):
+        for table in self.store.keys():
+            self.store.get_storer(table).attrs.metadata = self.metadata
+        self.store.close()
+
+
+class ExcelSink():
+    """
+    Write each table to a sheet of an Excel file, metadata to the 'Metadata' sheet.
+    Excel files can't be written in chunks: tables are kept in memory until the file is closed.
+    The tables in SKIPPED (one row for each skeleton pixel) are not written, the metadata point to the CSV and
+    Parquet formats instead. Tables longer than EXCEL_ROWS are split across sheets (e.g. Protusions, Protusions 2).
+    """
+
+    SKIPPED = ('paths',)
+
+    def __init__(self, path, metadata, engine='xlsxwriter'):
+        self.path = path
+        self.engine = engine
+        self.metadata = metadata
+        self.chunks = dict()
+        self.skipped = set()
+
+    def write(self, table, chunk):
+        if table in self.SKIPPED:
+            self.skipped.add(table)
+            return
+        self.chunks.setdefault(table, []).append(chunk)
+
+    def close(self):
+        metadata = dict(self.metadata)
+        if len(self.skipped) > 0:
+            metadata['not-exported'] = {table: 'too many rows for Excel, export to CSV or Parquet'
+                                        for table in sorted(self.skipped)}
+        flat = pd.DataFrame(flatten_metadata(metadata), columns=['Metadata', 'Value'])
+
+        writer = pd.ExcelWriter(self.path, engine=self.engine)
+        for table, chunks in self.chunks.items():
+            data = pd.concat(chunks, ignore_index=True)
+            for sheet, start in enumerate(range(0, max(len(data), 1), EXCEL_ROWS)):
+                name = table.capitalize() + (' ' + str(sheet + 1) if sheet > 0 else '')
+                data.iloc[start:start + EXCEL_ROWS].to_excel(writer, sheet_name=name, index=False)
+        flat.to_excel(writer, sheet_name='Metadata', index=False)
+        writer.close()
+
+# sink of each file extension
+SINKS = {'.csv': CsvSink, '.parquet': ParquetSink, '.h5': Hdf5Sink, '.hdf5': Hdf5Sink, '.xlsx': ExcelSink}
+
+def export_analysis(path, imgfile, shapecells, connections, volumecells=None, tables=TABLES, chunksize=CHUNKSIZE,
+                    network=None, tracks=None):
+    """
+    Export the analysis results of an image, the format is chosen by the extension of path (see SINKS).
+    :param tables: names of the tables to export (see TABLES)
+    :param network: connection network of the cells (see connectivity module), the network table is not written if None
+    :param tracks: tracks of the cells through the z-frames (see tracking module), the tracks table is not written if None
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SINKS:
+        raise ValueError('Unknown export format: ' + extension)
+
+    sink = SINKS[extension](path, export_metadata(imgfile, network))
+    try:
+        chunks = {'cells': lambda: cell_chunks(shapecells, chunksize),
+                  'protusions': lambda: protusion_chunks(shapecells, chunksize),
+                  'paths': lambda: path_chunks(shapecells, chunksize),
+                  'connections': lambda: connection_chunks(connections),
+                  'network': lambda: network_chunks(network),
+                  'tracks': lambda: track_chunks(tracks or [], shapecells,
+                                                 pixel_spacing(getattr(imgfile, 'dxyz', None), ndim=3)[0], chunksize),
+                  'volumes': lambda: volume_chunks(volumecells or dict())}
+        for table in tables:
+            for chunk in chunks[table]():
+                sink.write(table, chunk)
+    finally:
+        sink.close()
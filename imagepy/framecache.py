@@ -0,0 +1,129 @@
+'''
+
+Module to cache arrays derived from the z-frames of the image loaded in the GUI
+(e.g. edge cost maps), so that they are computed once per z-frame.
+
+'''
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+import threading
+
+
+class FrameCache():
+    """
+    Least recently used cache of arrays computed from single z-frames.
+    Items are identified by their kind (e.g. 'edge-cost') and z-frame.
+    The cache can be shared by worker threads: an item requested by several threads at once is computed once,
+    the other threads wait for its result.
+    """
+
+    def __init__(self, maxitems=32, accountant=None):
+        """
+        Initialize an empty cache holding at most maxitems arrays.
+        :param accountant: memory accountant keeping the memory within a budget (see memory module),
+        the cache is released by the accountant if registered as a pool
+        """
+        self.maxitems = maxitems
+        self.accountant = accountant
+        self.items = OrderedDict()
+        self.pending = dict() # items being computed { key : Future }
+        self.reserved = [] # numbers of items held by the running tasks (see reserve)
+        self.size = 0 # bytes of the arrays cached
+        self.lock = threading.Lock()
+
+    def capacity(self):
+        """
+        Number of arrays the cache can hold: maxitems, or more while a task reserves them.
+        """
+        return max([self.maxitems] + self.reserved)
+
+    @contextmanager
+    def reserve(self, nitems):
+        """
+        Context in which the cache holds at least nitems arrays (e.g. all the z-frames of a propagation),
+        so that arrays still needed by the task are not evicted.
+        """
+        with self.lock:
+            self.reserved.append(nitems)
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.reserved.remove(nitems)
+                self.trim()
+
+    def trim(self):
+        """
+        Remove the least recently used arrays beyond the capacity (called with the lock held).
+        """
+        while len(self.items) > self.capacity():
+            self.size -= getattr(self.items.popitem(last=False)[1], 'nbytes', 0)
+
+    def get(self, kind, zframe, factory):
+        """
+        Return the array of a given kind computed on a z-frame.
+        If it's not cached, it's computed by calling factory() and stored. If it's being computed by another
+        thread, its result is awaited instead.
+        """
+        key = (kind, zframe)
+
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = factory()
+        except BaseException as error:
+            with self.lock:
+                del self.pending[key]
+            future.set_exception(error)
+            raise
+
+        with self.lock:
+            del self.pending[key]
+            self.items[key] = value
+            self.size += getattr(value, 'nbytes', 0)
+            self.trim()
+        future.set_result(value)
+
+        if self.accountant is not None:
+            self.accountant.enforce()
+
+        return value
+
+    def release(self, size):
+        """
+        Remove the least recently used arrays, until at least size bytes are released.
+        :return: bytes released
+        """
+        released = 0
+        with self.lock:
+            while released < size and len(self.items) > 0:
+                released += getattr(self.items.popitem(last=False)[1], 'nbytes', 0)
+            self.size -= released
+
+        return released
+
+    def clear(self):
+        """
+        Remove all the arrays cached (e.g. when a new image is loaded).
+        """
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+    def nbytes(self):
+        """
+        Memory used by the arrays cached, in bytes.
+        """
+        return self.size
@@ -0,0 +1,166 @@
+'''
+
+Module to benchmark the GUI end to end without a display, on synthetic stacks (see synthetic module).
+
+The GUI classes (imagemanager.ImMan, imageprocesser.ImProcc and the project functions of menubarhandle)
+run with a headless controller: the figure is drawn by the non-interactive Agg backend and the Tk widgets
+are replaced by objects that ignore every call. The benchmark times the steps of a session:
+    open        load the synthetic stack (imagefile.pbf2pickle) and show it (ImMan.load_images)
+    scrub       show every z-frame with the slider (ImMan.update_image_idx)
+    add-cells   save N cells, as the manual selector does (singleCellShape.save_shape), redrawing each time
+    save        save the analysis as a project file (menubarhandle.save_analysis)
+    reload      load the project file and show it (menubarhandle.open_analysis)
+    rescrub     show every z-frame again, cells of the project are loaded when displayed
+Results have the format of the benchmark module, so runs are compared in the same way.
+
+'''
+
+import matplotlib
+matplotlib.use('Agg')  # before the GUI modules import pyplot
+
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import imagepy.benchmark as bm
+import imagepy.imagemanager as imm
+import imagepy.imageprocesser as imp
+import imagepy.journal as jr
+import imagepy.menubarhandle as mbh
+import imagepy.projectfile as pf
+from imagepy.imagefile import pbf2pickle
+from imagepy.synthetic import synthetic_stack
+
+# synthetic stack of the benchmark (see synthetic.synthetic_stack)
+STACK_PARAMETERS = {'zframes': 20, 'timepoints': 1, 'size': (1024, 1024), 'cells': 16}
+ADDED_CELLS = 10
+
+
+class NullWidget():
+    """
+    Stand-in of the Tk widgets and menus of the GUI: every attribute is a NullWidget and every call does nothing.
+    """
+
+    def __getattr__(self, name):
+        return NullWidget()
+
+    def __call__(self, *args, **kwargs):
+        return None
+
+    def __setitem__(self, key, value):
+        pass
+
+
+class HeadlessVariable(NullWidget):
+    """
+    Stand-in of the Tk variables and of the slider, holding a value.
+    """
+
+    def __init__(self, value=0):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+class HeadlessImMan(imm.ImMan):
+    """
+    Image manager of the GUI drawing on a canvas without window.
+    """
+
+    def create_canvas(self):
+        self.controller.canvas = FigureCanvasAgg(self.fig)
+        self.controller.canvas.draw()
+
+    def add_slider(self):
+        self.controller.scrollbar = HeadlessVariable(0)
+        self.controller.scrollbarValue = NullWidget()
+
+    def add_toolbar(self):
+        self.controller.toolbar = NullWidget()
+
+
+class HeadlessController(NullWidget):
+    """
+    Controller of the GUI (see mainGUI.ImagePyGUI) without window.
+    """
+
+    def __init__(self):
+        self.roiON = HeadlessVariable(0)
+        self.barON = HeadlessVariable(0)
+        self.show_cellshapeON = HeadlessVariable(0)
+        self.img = HeadlessImMan(parent=None, controller=self)
+
+
+def scrub(controller):
+    """
+    Show every z-frame with the slider, as the user dragging it.
+    """
+    for zframe in range(controller.img.imgfile.shape[2]):
+        controller.scrollbar.set(zframe)
+        controller.img.update_image_idx()
+
+def run_end_to_end(stack=STACK_PARAMETERS, ncells=ADDED_CELLS, seed=0):
+    """
+    Benchmark a GUI session on a synthetic stack: open, scrub, add cells, save, reload and scrub again.
+    :param stack: parameters of the synthetic stack (see synthetic.synthetic_stack)
+    :param ncells: number of cells added
+    :return: result in the format of benchmark.run_benchmark
+    """
+    folder = tempfile.mkdtemp(prefix='imagepy-benchmark-')
+    autosave = jr.AUTOSAVE_DIR
+    jr.AUTOSAVE_DIR = os.path.join(folder, 'autosave') # journals of the benchmark are not kept
+    steps = dict()
+
+    def timed(step, function, calls=1):
+        start = time.perf_counter()
+        value = function()
+        steps[step] = {'calls': calls, 'seconds': time.perf_counter() - start}
+        return value
+
+    try:
+        reader, contours = synthetic_stack(seed=seed, **stack)
+        imgpath = os.path.join(folder, 'stack.npy')
+        np.save(imgpath, np.asarray(reader.frames))
+
+        controller = HeadlessController()
+
+        def open_stack():
+            imgfile = pbf2pickle(pbfimage=reader, path=imgpath)
+            controller.img.load_images(imgfile=imgfile)
+            controller.img.processed.start_journal(base=None)
+            return imgfile
+        imgfile = timed('open', open_stack)
+
+        timed('scrub', lambda: scrub(controller), calls=imgfile.shape[2])
+
+        def add_cells():
+            for xdata, ydata, zframe in contours[:ncells]:
+                controller.scrollbar.set(zframe)
+                controller.img.update_image_idx()
+                cellobject = imp.singleCellShape(parent=controller.img.processed, controller=controller)
+                cellobject.save_shape(xdata=list(xdata), ydata=list(ydata), zframe=zframe)
+        timed('add-cells', add_cells, calls=min(ncells, len(contours)))
+
+        projectpath = os.path.join(folder, 'benchmark' + pf.PROJECT_EXTENSION)
+        timed('save', lambda: mbh.save_analysis(controller, projectpath))
+
+        timed('reload', lambda: mbh.open_analysis(controller, pf.load_project(projectpath), imgfile, projectpath))
+
+        controller.show_cellshapeON.set(1)
+        timed('rescrub', lambda: scrub(controller), calls=imgfile.shape[2])
+
+        controller.img.processed.journal.close()
+        projectsize = os.path.getsize(projectpath)
+    finally:
+        jr.AUTOSAVE_DIR = autosave
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return dict(bm.run_metadata(), case='end-to-end', parameters=bm.json_parameters(dict(stack, cells_added=ncells)),
+                pixels=int(np.prod(stack['size']) * stack['zframes'] * stack['timepoints']),
+                project_bytes=projectsize, seconds=sum(step['seconds'] for step in steps.values()), stages=steps)
@@ -31,6 +31,14 @@ class ImagePanel(tk.Frame):
         self.grid_rowconfigure(0, weight=10)
         self.grid_rowconfigure(1, weight=1)
 
+        # status bar, e.g. timings of the profiled stages (see profiling module)
+        controller.statuslabel = ttk.Label(self, text='', anchor='w', font=("Arial", 9))
+        controller.statuslabel.grid(row=2, column=0, columnspan=2, sticky="we", padx = 5)
+
+        # memory usage of the analysis (see memory module)
+        controller.memorylabel = ttk.Label(self, text='', anchor='w', font=("Arial", 9))
+        controller.memorylabel.grid(row=3, column=0, columnspan=2, sticky="we", padx = 5)
+
 
 class ButtonsFrame(tk.Frame):
     def __init__(self, parent, controller):
@@ -39,7 +47,7 @@ class ButtonsFrame(tk.Frame):
         color = '#%02x%02x%02x' % (220, 218, 213)  # background color of ttk widgets in Hex color format
         self.configure(background = color)
 
-        norows = 8
+        norows = 9
         for row in range(norows):
             self.grid_rowconfigure(row, weight=1)
 
@@ -60,7 +68,7 @@ class ButtonsFrame(tk.Frame):
         controller.lbl_cell_list.config(state="disabled")
 
         controller.cell_list = tk.StringVar() # value = countrynames
-        controller.lbox = tk.Listbox(self, listvariable = controller.cell_list)
+        controller.lbox = tk.Listbox(self, listvariable = controller.cell_list, selectmode = tk.EXTENDED)
         controller.lbox.config(state="disabled")
 
         controller.display_selectedbtn = ttk.Button(self, text="Display Selected Cell", command = lambda: controller.img.processed.display_cell_selected())
@@ -69,6 +77,12 @@ class ButtonsFrame(tk.Frame):
         controller.modifyBodyBtn = ttk.Button(self, text="Mod Body Skel", command = lambda: controller.img.processed.open_modify_body_skel())
         controller.modifyBodyBtn.config(state="disabled")
 
+        controller.volumeSkelBtn = ttk.Button(self, text="Skeleton 3D", command = lambda: controller.img.processed.skeletonize_volume())
+        controller.volumeSkelBtn.config(state="disabled")
+
+        controller.propagateBtn = ttk.Button(self, text="Propagate Cell", command = lambda: controller.img.processed.propagate_cell())
+        controller.propagateBtn.config(state="disabled")
+
         # buttons grid
 
         # controller.procesbtn.grid(row=1, column=1, sticky="nsew", pady = 5)
@@ -80,4 +94,6 @@ class ButtonsFrame(tk.Frame):
         controller.lbox.grid(row = 1, column = 0, rowspan = 4, sticky="nsew")
 
         controller.display_selectedbtn.grid(row = 5, column = 0, sticky="nsew")
-        controller.modifyBodyBtn.grid(row=6, column=0, columnspan=2, sticky="nsew")
\ No newline at end of file
+        controller.modifyBodyBtn.grid(row=6, column=0, columnspan=2, sticky="nsew")
+        controller.volumeSkelBtn.grid(row=7, column=0, columnspan=2, sticky="nsew")
+        controller.propagateBtn.grid(row=8, column=0, columnspan=2, sticky="nsew")
\ No newline at end of file
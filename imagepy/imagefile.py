@@ -0,0 +1,100 @@
+'''
+
+Module to load microscope images without the GUI (see imagemanager module for the GUI).
+
+'''
+
+import os
+import numpy as np
+import pims.bioformats as pbf
+
+# extensions of the image files searched in folders
+IMAGE_EXTENSIONS = ('.nd2', '.tif', '.tiff', '.czi', '.lif', '.lsm', '.oib', '.oif', '.ims', '.ome.tif')
+
+
+def load_image(path):
+    """
+    Load a microscope image (ex. .nd2 format) or a generic image (ex. .tiff), with its metadata if present.
+    """
+    return pbf2pickle(pbfimage=pbf.BioformatsReader(path), path=path)
+
+def find_images(paths):
+    """
+    Image files of a list of paths: files are kept, folders are replaced by the image files they contain.
+    """
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                          if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(path)
+
+    return images
+
+def image_frame(imgfile, zframe):
+    """
+    2D image of a z-frame (first timepoint).
+    """
+    if imgfile.shape[2] == 1:
+        # images[0] timepoint 0
+        return imgfile.imgdata[0]
+
+    # images[n][1,:,:] timepoint n, stack 1
+    return imgfile.imgdata[0][zframe, :, :]
+
+class pbf2pickle():
+    """
+    Class that converts an image object loaded with the pims.bioformats module to
+    an image object that can be handled by the pickle module.
+    """
+
+    def __init__(self, pbfimage, path=None):
+
+        self.path = path # source image file, referenced by the project files (see projectfile module)
+        self.imgdata = [i for i in pbfimage]
+        meta = pbfimage.metadata
+        self.imgcount = meta.ImageCount()
+        self.imgsize = pbfimage.sizes
+        # self.shape image loaded size
+        self.unit = None # metadata info, physical size unit
+        self.dxyz = None # metadata info, pixel physical size
+        self.volxyz = None # metadata info, volume physical size
+        self.maxpixel = self.imgdata[0].max()
+        self.minpixel = self.imgdata[0].min()
+
+        if 'z' not in self.imgsize.keys():
+            Zsize = 1
+        else:
+            Zsize = self.imgsize['z']
+
+        self.shape = [self.imgsize['x'], self.imgsize['y'], Zsize]
+
+        if 'Unit' in pbfimage.get_metadata_raw():
+            self.unit = pbfimage.get_metadata_raw()['Unit']
+            self.dxyz = [meta.PixelsPhysicalSizeX(0),
+                    meta.PixelsPhysicalSizeY(0)]
+            self.volxyz = [a * b for a, b in zip(self.dxyz, self.shape[0:2])]
+            if 'z' in self.imgsize.keys():
+                self.dxyz.append(meta.PixelsPhysicalSizeZ(0))
+                self.volxyz.append(self.shape[2]*self.dxyz[2])
+
+        print('\n%%%% NEW IMAGE LOADED%%%%')
+        self.print_image_info()
+
+    def print_image_info(self):
+
+        print('\n---- IMAGE PARAMETERS ---')
+
+        print('\nTimepoints imaged: {}'.format(self.imgcount))
+
+        print('Image size: {} x {}'.format(*(self.imgsize['x'], self.imgsize['y'])))
+
+        print('Z-stack images: {}'.format(self.shape[2]))
+
+        if self.unit is not None:
+            print('\nPixels Physical Size [', self.unit, ']')
+            print(*np.around(self.dxyz, decimals=3), sep=' x ')
+
+            print('\nImaged Surface/Volume Size [',self.unit,']')
+            print(*np.around(self.volxyz, decimals=2), sep=' x ')
\ No newline at end of file
@@ -17,6 +17,10 @@ import matplotlib.pyplot as plt
 from matplotlib_scalebar.scalebar import ScaleBar
 from tkinter import ttk  # https://docs.python.org/3/library/tkinter.ttk.html
 import imagepy.imageprocesser as imp
+from imagepy.imagefile import pbf2pickle # re-exported: older project files refer to imagemanager.pbf2pickle
+from imagepy.framecache import FrameCache
+import imagepy.memory as mem
+import imagepy.projectfile as pf
 import cv2
 
 color = '#%02x%02x%02x' % (220,218,213) # background color of ttk widgets in Hex color format
@@ -39,6 +43,19 @@ class ImMan():
 
         self.imgsh = None # image showed in the GUI
         self.old_ix = None # old index for the slider
+        # arrays computed from single z-frames (see framecache module)
+        self.framecache = FrameCache(accountant = mem.ACCOUNTANT)
+
+        # memory held by the GUI, kept within the budget (see memory module)
+        mem.ACCOUNTANT.register('frames', lambda: mem.nbytes(getattr(self.imgfile, 'imgdata', None)))
+        mem.ACCOUNTANT.register('frame-cache', self.framecache.nbytes, self.framecache.release, mem.PRIORITY_CACHE)
+        mem.ACCOUNTANT.register('cells', self.cells_nbytes, self.release_cells, mem.PRIORITY_CELLS)
+        # mask crops of the indexes of the analysis (see contacts and tracking modules), measured again on demand
+        mem.ACCOUNTANT.register('contacts', lambda: self.index_nbytes('contacts'),
+                                lambda size: self.release_index('contacts', size), mem.PRIORITY_CACHE)
+        mem.ACCOUNTANT.register('tracks', lambda: self.index_nbytes('tracker'),
+                                lambda size: self.release_index('tracker', size), mem.PRIORITY_CACHE)
+        mem.ACCOUNTANT.register('display', self.display_nbytes)
         
         self.fig = mplfig.Figure(figsize=(5, 4), dpi=100)
         self.ax = self.fig.add_axes([0, 0, 1, 1])
@@ -56,7 +73,16 @@ class ImMan():
                     fontsize=20, color = c,
                     transform=self.ax.transAxes)
         self.ax.axis('off')
-        
+
+        self.create_canvas()
+
+    def create_canvas(self):
+        """
+        Display the figure in the image panel
+        """
+
+        controller = self.controller
+
         controller.canvas = FigureCanvasTkAgg(self.fig, master= self.parent)
         controller.canvas.draw()
         controller.canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew")
@@ -80,7 +106,7 @@ class ImMan():
             if len(path) > 0:
                 images = pbf.BioformatsReader(path)
                 # sometimes it could be necessary to add ", java_memory='1024m'"
-                self.imgfile = pbf2pickle(pbfimage=images)
+                self.imgfile = pbf2pickle(pbfimage=images, path=path)
             else:
                 return
         else:
@@ -88,6 +114,7 @@ class ImMan():
             self.imgfile = imgfile
             self.imgfile.print_image_info()
 
+        self.framecache.clear()
         self.ax.clear()
         self.ax.lines = []
         controller.canvas.draw()
@@ -109,6 +136,8 @@ class ImMan():
         controller.manual_imbtn.config(state="normal")
         controller.filemenu.selectMenu.entryconfig(1, state='normal')
         controller.filemenu.selectMenu.entryconfig(2, state='normal')
+        controller.filemenu.selectMenu.entryconfig(3, state='normal')
+        controller.filemenu.selectMenu.entryconfig(4, state='normal')
 
         controller.lbl_cell_list.config(state="disabled")
         controller.cell_list.set('')
@@ -117,7 +146,14 @@ class ImMan():
 
         controller.filemenu.fileMenu.entryconfig(3, state='normal')
 
+        try:
+            self.processed.journal.close()
+        except AttributeError:
+            pass
         self.processed = imp.ImProcc(parent = self, controller = controller)
+        if imgfile is None:
+            # new analysis, a loaded project starts its journal once the cells are listed
+            self.processed.start_journal(base = None)
 
         self.plot_image()
             
@@ -156,6 +192,52 @@ class ImMan():
 
         controller.canvas.draw()
 
+    def cells_nbytes(self):
+        """
+        Memory of the cells of the analysis in memory, in bytes.
+        """
+        try:
+            return pf.cells_nbytes(self.processed.shapecells)
+        except AttributeError:
+            # no image loaded yet
+            return 0
+
+    def release_cells(self, size):
+        """
+        Release cells of the analysis from memory, only cells saved in the project file can be released.
+        """
+        try:
+            return pf.release_cells(self.processed.shapecells, size)
+        except AttributeError:
+            return 0
+
+    def index_nbytes(self, name):
+        """
+        Memory of an index of the cells of the analysis ('contacts' or 'tracker', see imageprocesser), in bytes.
+        """
+        index = getattr(getattr(self, 'processed', None), name, None)
+
+        return index.nbytes() if index is not None else 0
+
+    def release_index(self, name, size):
+        """
+        Release the mask crops of an index of the cells of the analysis, they are measured again when needed.
+        """
+        index = getattr(getattr(self, 'processed', None), name, None)
+
+        return index.release(size) if index is not None else 0
+
+    def display_nbytes(self):
+        """
+        Memory of the images and lines displayed, in bytes.
+        """
+        size = sum(mem.nbytes(image.get_array()) for image in self.ax.images)
+        size += sum(line.get_xydata().nbytes for line in self.ax.lines)
+        size += sum(mem.nbytes(collection.get_segments()) for collection in self.ax.collections
+                    if hasattr(collection, 'get_segments'))
+
+        return size
+
     def add_toolbar(self):
         """
         Display a toolbar below the window
@@ -247,58 +329,3 @@ class ImMan():
             
             except AttributeError:
                 pass
-
-class pbf2pickle():
-    """
-    Class that converts an image object loaded with the pims.bioformats module to
-    an image object that can be handled by the pickle module.
-    """
-
-    def __init__(self, pbfimage):
-
-        self.imgdata = [i for i in pbfimage]
-        meta = pbfimage.metadata
-        self.imgcount = meta.ImageCount()
-        self.imgsize = pbfimage.sizes
-        # self.shape image loaded size
-        self.unit = None # metadata info, physical size unit
-        self.dxyz = None # metadata info, pixel physical size
-        self.volxyz = None # metadata info, volume physical size
-        self.maxpixel = self.imgdata[0].max()
-        self.minpixel = self.imgdata[0].min()
-
-        if 'z' not in self.imgsize.keys():
-            Zsize = 1
-        else:
-            Zsize = self.imgsize['z']
-
-        self.shape = [self.imgsize['x'], self.imgsize['y'], Zsize]
-
-        if 'Unit' in pbfimage.get_metadata_raw():
-            self.unit = pbfimage.get_metadata_raw()['Unit']
-            self.dxyz = [meta.PixelsPhysicalSizeX(0),
-                    meta.PixelsPhysicalSizeY(0)]
-            self.volxyz = [a * b for a, b in zip(self.dxyz, self.shape[0:2])]
-            if 'z' in self.imgsize.keys():
-                self.dxyz.append(meta.PixelsPhysicalSizeZ(0))
-                self.volxyz.append(self.shape[2]*self.dxyz[2])
-
-        print('\n%%%% NEW IMAGE LOADED%%%%')
-        self.print_image_info()
-
-    def print_image_info(self):
-
-        print('\n---- IMAGE PARAMETERS ---')
-
-        print('\nTimepoints imaged: {}'.format(self.imgcount))
-
-        print('Image size: {} x {}'.format(*(self.imgsize['x'], self.imgsize['y'])))
-
-        print('Z-stack images: {}'.format(self.shape[2]))
-
-        if self.unit is not None:
-            print('\nPixels Physical Size [', self.unit, ']')
-            print(*np.around(self.dxyz, decimals=3), sep=' x ')
-
-            print('\nImaged Surface/Volume Size [',self.unit,']')
-            print(*np.around(self.volxyz, decimals=2), sep=' x ')
\ No newline at end of file
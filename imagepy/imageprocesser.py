@@ -8,22 +8,33 @@ Module to process microscope images in a GUI for cell dendrite tracking.
 
 from matplotlib.widgets import RectangleSelector
 from tkinter import messagebox
+from tkinter import simpledialog
 import imagepy.modifywindow as modw
 import imagepy.manualselection as ms
 import imagepy.printsummary as ps
 import imagepy.skeletonprocessing as skpro
 import imagepy.modifycellbody as modbody
+import imagepy.volumeprocessing as volpro
+import imagepy.segmentation as seg
+import imagepy.propagation as prop
+import imagepy.journal as jr
+import imagepy.projectfile as pf
+import imagepy.cellrecord as cr
+import imagepy.connectivity as conn
+import imagepy.contacts as ct
+import imagepy.tracking as tr
+import imagepy.engine as eng
+import imagepy.parallelskeleton as pskel
+import imagepy.profiling as prof
+import imagepy.memory as mem
+import imagepy.skeletongraph as sg
+from imagepy.imagefile import image_frame
 import tkinter as tk
 import numpy as np
 import matplotlib.pyplot as plt
-import matplotlib.path as mplPath
-from skimage.morphology import closing
-from scipy.ndimage.measurements import label
 import pandas as pd
-from skimage.measure import regionprops
 from matplotlib.patches import Circle
 from matplotlib.collections import PatchCollection
-import cv2
 
 
 class ImProcc():
@@ -47,11 +58,14 @@ class ImProcc():
 
         self.shapecells = dict() # dictionary containing cell shape objects { Cell # : cell object }
         self.cell_zframes = dict()
+        self.volumecells = dict() # dictionary containing 3D skeletons { Volume # : skeleton dictionary }
+        self.journal = None # autosave journal of the analysis edits (see journal module)
 
         # panda DataFrame containing the cells connections and their coordinates
-        row = ['zframe', 'cell1', 'cell2', 'centerX', 'centerY']
-        data = np.empty((0, 5), int)
-        self.connections = pd.DataFrame(data.tolist(), columns=row)
+        self.connections = eng.empty_connections()
+        self.network = conn.ConnectionGraph() # network of the cell connections (see connectivity module)
+        self.contacts = None # boundaries and protusion tips of the cells (see contacts module), see contact_index
+        self.tracker = None # links of the cells through the z-frames (see tracking module), see cell_linker
 
     def roi_selector(self):
         """
@@ -99,35 +113,96 @@ class ImProcc():
     def process_image(self):
         """
         Function to process the image of interest with default options.
+        Cells of the ROI selected (or of the whole z-frame if the ROI selector is off) are segmented
+        automatically and saved as cell shapes (see segmentation module).
+        """
+
+        zframe = round(self.controller.scrollbar.get())
 
-        TO WRITE
+        labeled, offset = self.apply_threshold(zframe)
+        self.save_segmented_cells({zframe: (labeled, offset)})
 
+    def process_stack(self):
+        """
+        Function to process all the z-frames of the image with default options.
+        z-frames are segmented in parallel (see segmentation module).
         """
 
-        parent = self.parent
+        planes = dict()
+        offsets = dict()
+        for zframe in range(self.parent.imgfile.shape[2]):
+            planes[zframe], offsets[zframe] = self.roi_image(zframe)
 
-        apply_threshold(self)
+        labeled = seg.segment_stack(planes)
 
-    def apply_threshold(self):
+        self.save_segmented_cells({zframe: (labeled[zframe], offsets[zframe]) for zframe in planes})
+
+    def roi_image(self, zframe):
+        """
+        Function to crop the ROI selected from a z-frame of the image.
+        The whole z-frame is returned if the ROI selector is off.
+        :return: image of the ROI and (row, column) position of its origin in the z-frame
         """
-        Function to apply image threshold.
 
-        TO WRITE
+        image = image_frame(self.parent.imgfile, zframe)
+
+        if self.click[0] is None or not self.controller.roiON.get():
+            return image, (0, 0)
 
+        x0, x1 = sorted([int(round(self.click[0])), int(round(self.release[0]))])
+        y0, y1 = sorted([int(round(self.click[1])), int(round(self.release[1]))])
+        x0, y0 = max(x0, 0), max(y0, 0)
+
+        return image[y0:y1, x0:x1], (y0, x0)
+
+    def apply_threshold(self, zframe):
+        """
+        Function to apply image threshold: automatic segmentation of the ROI of a z-frame.
+        :return: labeled image of the ROI and (row, column) position of its origin in the z-frame
         """
 
-        if self.click[0] is None:
-            messagebox.showerror("Error", "Select a ROI to process")
-        else:
-            parent = self.parent
-            if parent.shape[2] == 1:
-                # images[0] timepoint 0
-                # images[n][1,:,:] timepoint n, stack 1
-                self.image_roi = parent.file[0][self.click[1]:self.release[1], self.click[0]:self.release[0]]
-            else:
-                frame_displ = round(controller.scrollbar.get())
-                self.image_roi = parent.file[0][frame_displ, self.click[1]:self.release[1],
-                                 self.click[0]:self.release[0]]
+        self.image_roi, offset = self.roi_image(zframe)
+
+        return seg.segment_plane(self.image_roi), offset
+
+    def save_segmented_cells(self, segmented):
+        """
+        Function to save the regions segmented automatically as cell shapes,
+        through the same path used by the manual selection.
+        :param segmented: dictionary { z-frame : (labeled image, offset of the image) }
+        """
+
+        controller = self.controller
+
+        contours = []
+        for zframe in sorted(segmented.keys()):
+            labeled, offset = segmented[zframe]
+            contours.extend((xdata, ydata, zframe) for xdata, ydata in seg.region_contours(labeled, offset))
+
+        # cells are skeletonized in parallel before saving them (see parallelskeleton module)
+        shape = controller.img.imgsh.shape[:2]
+        masks = {n: eng.contour_mask(xdata, ydata, shape) for n, (xdata, ydata, _) in enumerate(contours)}
+        physpace = skpro.pixel_spacing(self.parent.imgfile.dxyz, ndim=2)
+        # cells are saved as their skeletons arrive, in the order of the contours so that cell numbers don't
+        # depend on which worker finishes first: skeletons arriving early wait for the cells before them
+        skeletons = dict()
+        saved = 0
+        for n, skeleton in pskel.skeletonize_cells(masks, physpace):
+            skeletons[n] = skeleton
+            while saved in skeletons:
+                xdata, ydata, zframe = contours[saved]
+                cellobject = singleCellShape(parent = self, controller = controller)
+                # masks already computed are passed on (and released as soon as the cell is saved)
+                cellobject.save_shape(xdata = xdata, ydata = ydata, zframe = zframe, display = False,
+                                      skeleton = skeletons.pop(saved), mask = masks.pop(saved))
+                saved += 1
+
+        if len(contours) == 0:
+            messagebox.showinfo("Automatic Segmentation", "No cell detected.")
+            return
+
+        controller.show_cellshapeON.set(1)
+        self.show_cellprocessed()
 
     def open_modify(self):
         """
@@ -168,11 +243,109 @@ class ImProcc():
 
         self.shapecells = procfile['shapecells']
         self.cell_zframes = procfile['cell_zframes']
-        self.connections = procfile['connections']
+        self.connections = eng.normalize_connections(procfile['connections'])
+        self.volumecells = procfile.get('volumecells', dict()) # not available in older projects
+        self.contacts = None
+        self.tracker = None
+        self.network = conn.ConnectionGraph.from_analysis(self.cell_zframes, self.connections, self.volumecells)
+
+        self.refresh_cell_list()
+
+    def refresh_cell_list(self):
+        """
+        Function to rebuild the list of cell processed showed in the listbox of the main GUI window.
+        """
+
+        self.controller.lbox.delete(0, 'end')
 
-        for i in self.shapecells.keys():
+        for i in sorted(self.shapecells.keys(), key=int):
             self.add_item_cell_list(int(i))
 
+    def start_journal(self, base = None):
+        """
+        Function to start the autosave journal of the analysis edits (see journal module).
+        Edits of a previous session on the same project that were not saved are recovered, if the user agrees.
+        :param base: project file loaded (None for a new analysis)
+        """
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+        imgpath = getattr(self.parent.imgfile, 'path', None)
+        if imgpath is None:
+            # projects loaded from pickle files don't know their source image
+            return
+
+        path = jr.autosave_path(imgpath)
+        records = jr.read_journal(path)
+        recovered = False
+        if jr.has_edits(records, base) and messagebox.askyesno("Recover Analysis",
+                                                               "Unsaved changes of a previous session found. "
+                                                               "Recover them?"):
+            project = dict(shapecells = self.shapecells, cell_zframes = self.cell_zframes,
+                           connections = self.connections, volumecells = self.volumecells)
+            jr.replay_journal(records, project)
+            self.connections = eng.normalize_connections(project['connections'])
+            self.contacts = None
+            self.tracker = None
+            self.network = conn.ConnectionGraph.from_analysis(self.cell_zframes, self.connections, self.volumecells)
+            self.refresh_cell_list()
+            recovered = True
+
+        self.journal = jr.ProjectJournal(path, base)
+
+        if recovered:
+            # compact the journal: the recovered edits are still not saved
+            self.journal.reset(base, project = dict(shapecells = self.shapecells,
+                                                    connections = self.connections,
+                                                    volumecells = self.volumecells))
+
+    def update_network(self):
+        """
+        Function to add the cells, connections and 3D skeletons added since the last update to the connection network.
+        :return: the network (see connectivity.ConnectionGraph)
+        """
+
+        return self.network.update(self.cell_zframes, self.connections, self.volumecells)
+
+    def contact_index(self):
+        """
+        Function to get the index of the cell boundaries and protusion tips (see contacts module), created when
+        first used. Cells already processed are measured when their z-frame is checked for connections.
+        """
+
+        if self.contacts is None:
+            self.contacts = ct.ContactIndex(skpro.pixel_spacing(self.controller.img.imgfile.dxyz, ndim=2))
+
+        return self.contacts
+
+    def cell_linker(self):
+        """
+        Function to get the linker of the cells through the z-frames (see tracking module), created when first used.
+        """
+
+        if self.tracker is None:
+            self.tracker = tr.CellLinker(skpro.pixel_spacing(self.controller.img.imgfile.dxyz, ndim=2))
+
+        return self.tracker
+
+    def update_tracks(self):
+        """
+        Function to get the tracks of the cells linked through the z-frames, measuring the cells not linked yet.
+        :return: list of tracks (see tracking.CellTrack)
+        """
+
+        return self.cell_linker().update(self.cell_zframes, self.shapecells).tracks()
+
+    def record_edit(self, kind, key, value):
+        """
+        Function to append an edit of the analysis to the autosave journal.
+        """
+
+        if self.journal is not None:
+            self.journal.record(kind, key, value)
+
     def add_item_cell_list(self, idx):
         """
         Function to update the list of cell processed to show in the listbox of the main GUI window.
@@ -189,12 +362,16 @@ class ImProcc():
             controller.filemenu.summaryMenu.entryconfig(1, state='normal')
             controller.filemenu.summaryMenu.entryconfig(2, state='normal')
             controller.modifyBodyBtn.config(state="normal")
+            controller.volumeSkelBtn.config(state="normal")
+            controller.propagateBtn.config(state="normal")
 
             #  focus_set method to move focus back to the scrollbar of the mainGUI
             controller.scrollbar.focus_set()
 
         controller.lbox.insert(tk.END, 'Cell # ' + str(idx))
-        color = '#%02x%02x%02x' % tuple([int(i * 255) for i in self.shapecells[str(idx)].contour['color']]) # Hex color format
+        # color from the cell index: cells of a project file are not loaded (see projectfile.LazyCellStore)
+        cellcolor = pf.cell_summary(self.shapecells, str(idx))['color']
+        color = '#%02x%02x%02x' % tuple([int(i * 255) for i in cellcolor]) # Hex color format
         controller.lbox.itemconfig(idx-1, {'fg': color})
 
     def cbtn_show_cellprocessed(self):
@@ -229,39 +406,34 @@ class ImProcc():
         """
         controller = self.controller
 
-        color_cellbody = '#ff0000'
-        for path in shapeobj.skelbody['paths']:
-            l = plt.Line2D(path[:, 1], path[:, 0], color = color_cellbody, **linekwargs)
-            controller.img.ax.add_line(l)
-
-        color_secondary = '#ffffff'  # '#ffc03e'
-        for protusion in shapeobj.skelprot['secondary-paths']:
-            for path in protusion:
-                l = plt.Line2D(path[:, 1], path[:, 0], color=color_secondary, **linekwargs)
-                controller.img.ax.add_line(l)
+        graph = sg.cell_graph(shapeobj)
+        if graph is None:
+            # skeletonization failed for this cell
+            return
 
-        # color = '#FFC125'
-        color_primary = '#ffff00'
-        for path in shapeobj.skelprot['primary-path']:
-            l = plt.Line2D(path[:, 1], path[:, 0], color=color_primary, **linekwargs)
-            controller.img.ax.add_line(l)
+        # one collection of lines for each kind of path (see skeletongraph module)
+        for collection in sg.line_collections(graph, **linekwargs):
+            controller.img.ax.add_collection(collection)
 
     def display_cell_connections(self, connobj):
         """
         Display cell connections in the canvas of the main GUI window.
         """
         controller = self.controller
-        rgbCol = (1, 0, 0)  # red
+        rgbCol = (1, 0, 0)  # red, overlapping masks
+        tipCol = (1, 0.5, 0)  # orange, touching protusion tips (see contacts module)
         patches = []
         coord = np.array([connobj.centerX.tolist(), connobj.centerY.tolist()]).transpose()
         coord = tuple(map(tuple, coord))
         for c in coord:
             circle = Circle(c, radius=15)
             patches.append(circle)
-        connectCollection = PatchCollection(patches, facecolors=rgbCol)
+        colors = [tipCol if kind == eng.CONNECTION_TIP else rgbCol for kind in connobj.kind.tolist()]
+        connectCollection = PatchCollection(patches, facecolors=colors)
         controller.img.ax.add_collection(connectCollection)
 
 
+    @prof.profiled('show_cellprocessed')
     def show_cellprocessed(self):
         """
         Function to activate cell processed visualization in the main GUI window.
@@ -283,7 +455,10 @@ class ImProcc():
 
         else:
             pass
-        controller.canvas.draw()
+        with prof.stage('show_cellprocessed.draw'):
+            controller.canvas.draw()
+
+        mem.ACCOUNTANT.enforce()
 
 
     def display_cell_selected(self):
@@ -304,6 +479,76 @@ class ImProcc():
             messagebox.showerror("Error", 'Select a cell to show from the ''Cell Processed List'' and press again the button.')
 
 
+    def propagate_cell(self):
+        """
+        Function to propagate the contour of the cell selected in the listbox to the neighbouring z-frames.
+        The refined contours are saved as new cell shapes (see propagation module).
+        """
+
+        controller = self.controller
+
+        try:
+            cell_id = controller.lbox.curselection()[0] + 1
+        except IndexError:
+            messagebox.showerror("Error", "Select a cell to propagate from the list and press again the button.")
+            return
+
+        nframes = simpledialog.askinteger("Propagate Cell", "Number of z-frames above and below the cell:",
+                                          initialvalue=3, minvalue=1, maxvalue=self.parent.imgfile.shape[2])
+        if nframes is None:
+            return
+
+        shapeobj = self.shapecells[str(cell_id)]
+        contours = prop.propagate_contour(controller.img.framecache, self.parent.imgfile,
+                                          shapeobj.contour['allxpoints'], shapeobj.contour['allypoints'],
+                                          shapeobj.zframe, nframes)
+
+        if len(contours) == 0:
+            messagebox.showinfo("Propagate Cell", "The cell was not found on the neighbouring z-frames.")
+            return
+
+        for zframe in sorted(contours.keys()):
+            xdata, ydata = contours[zframe]
+            cellobject = singleCellShape(parent = self, controller = controller)
+            cellobject.save_shape(xdata = xdata, ydata = ydata, zframe = zframe, display = False)
+
+        controller.show_cellshapeON.set(1)
+        self.show_cellprocessed()
+
+    def skeletonize_volume(self):
+        """
+        Function to extract the 3D skeleton of the cells selected in the listbox, stacking their contours
+        through the z-frames (see volumeprocessing module).
+        """
+
+        controller = self.controller
+
+        cellIDs = [i + 1 for i in controller.lbox.curselection()]
+        if len(cellIDs) == 0:
+            messagebox.showerror("Error", "Select the cells to stack from the list (one or more per z-frame) "
+                                          "and press again the button.")
+            return
+
+        skelvol = volpro.cell_volume_skeleton(self.shapecells, cellIDs, controller.img.imgfile.dxyz)
+
+        try:
+            volume_id = sorted(list(map(int, self.volumecells.keys())))[-1] + 1
+        except IndexError:
+            volume_id = 1
+        self.volumecells[str(volume_id)] = skelvol
+        self.record_edit('volume', str(volume_id), skelvol)
+        self.update_network()
+
+        unit = controller.img.imgfile.unit
+        if unit is None:
+            unit = 'pixel'
+        lengths = ', '.join(str(np.around(l, decimals=1)) for l in skelvol['path-length'])
+        messagebox.showinfo("3D Skeleton", 'Volume # {}\nCells: {}\nZ Frames: {} - {}\n'
+                                           '# Prot.: {}\nProt. Lengths [{}]: {}'.format(volume_id,
+                                            ', '.join(map(str, skelvol['cells'])),
+                                            skelvol['zframes'][0] + 1, skelvol['zframes'][-1] + 1,
+                                            len(skelvol['protusion_id']), unit, lengths))
+
     def print_summary(self):
         """
         Function to start the visualization and further saving of the parameters extracted by cell shape
@@ -337,10 +582,16 @@ class singleCellShape():
         # # array containing the cellID to which the processed cell connects
         # self.connections = np.empty((0), int)
 
-    def save_shape(self, xdata, ydata, zframe):
+    @prof.profiled('save_shape')
+    def save_shape(self, xdata, ydata, zframe, display = True, skeleton = None, mask = None):
         """
         Save cell contour data (from automatic processing or manual selection) to an
         element of the singleCellShape object (from parent)
+        If display is False, the main window is not redrawn (e.g. when many cells are saved at once) and the cell is
+        only measured for the tracks: the links are solved once when the tracks are requested (see update_tracks).
+        skeleton is the result of the skeletonization already computed (see parallelskeleton.skeletonize_cells),
+        the cell is skeletonized here if None.
+        mask is the cell mask already computed from the contour (see engine.contour_mask), computed here if None.
         """
 
         controller = self.controller
@@ -350,76 +601,86 @@ class singleCellShape():
         self.contour['allypoints'] = ydata
         self.measure_area()
 
-        mask = closing(self.getMask(cv2.cvtColor(controller.img.imgsh, cv2.COLOR_BGR2GRAY)))
-        # sometimes maskig creates separate regions. The following lines select the biggest one
-        structure = np.ones((3, 3), dtype=np.int)  # in this case we allow any kind of connection
-        labeled, ncomponents = label(mask, structure)
-        regprop = regionprops(labeled)
-        area = []
-        for r in regprop:
-            area.append(r.area)
-        self.contour['mask'] = labeled == np.array(area).argmax()+1
+        if mask is None:
+            with prof.stage('save_shape.mask'):
+                mask = self.getMask(controller.img.imgsh.shape[:2])
+        self.contour['mask'] = mask
         self.zframe = zframe
 
-
-        cmap_name = 'Set1'
-        cmap = plt.get_cmap(cmap_name)
-
         try:
             last_id = sorted(list(map(int,parent.shapecells.keys())))[-1]
             cell_id = last_id + 1
         except IndexError:
             cell_id = 1
 
-        color_id = (cell_id) % 7  # 8 is the numbers of colors in the Set1 colormap
-        self.contour['color'] = cmap.colors[color_id]
+        self.contour['color'] = eng.cell_color(cell_id)
 
-        try:
-            self.skeleton.skletonize_cell(cellmask = self.contour['mask'])
-        except IndexError:
-            print('\n\n%%%%%%%ERROR%%%%%%%%%\n\n')
+        if isinstance(skeleton, Exception):
+            # any failure of the skeletonization already computed (see parallelskeleton.skeletonize_cells),
+            # e.g. a worker process that died: the cell is saved without skeleton, as the other failures
+            print('Cell # {}: skeletonization failed ({!r})'.format(cell_id, skeleton))
             self.skeleton = []
-            pass
+        else:
+            try:
+                if skeleton is None:
+                    with prof.stage('save_shape.skeleton'):
+                        self.skeleton.skletonize_cell(cellmask = self.contour['mask'])
+                else:
+                    self.skeleton.mask = self.contour['mask']
+                    self.skeleton.thresh, self.skeleton.skelbody, self.skeleton.skelprot = skeleton
+            except (IndexError, ValueError):
+                print('\n\n%%%%%%%ERROR%%%%%%%%%\n\n')
+                self.skeleton = []
+                pass
 
         self.check_cell_connections(cellmask=self.contour['mask'], cellprocessID = cell_id)
 
         parent.shapecells[str(cell_id)] = storeProcessedAspickle(cellshapeobj = self)
+        parent.record_edit('cell', str(cell_id), parent.shapecells[str(cell_id)])
 
         try:
             parent.cell_zframes[str(self.zframe)].append(cell_id)
         except KeyError:
             parent.cell_zframes[str(self.zframe)] = [cell_id]
+        parent.update_network()
+        if display:
+            parent.cell_linker().link_cell(self.zframe, cell_id, self.contour['mask'], parent.cell_zframes,
+                                           parent.shapecells)
+        else:
+            parent.cell_linker().add_cell(self.zframe, cell_id, self.contour['mask'])
 
         parent.add_item_cell_list(idx = cell_id)
-        controller.show_cellshapeON.set(1)
-        parent.show_cellprocessed()
+        prof.count('cells')
+
+        if display:
+            controller.show_cellshapeON.set(1)
+            parent.show_cellprocessed()
 
 
+    @prof.profiled('save_shape.connections')
     def check_cell_connections(self, cellmask, cellprocessID):
         """
-        Determine cell connections with the other cells selected on the same frame.
+        Determine cell connections with the other cells selected on the same frame: overlapping masks and
+        protusion tips touching the other cells.
         """
         zframe = self.zframe
         parent = self.parent
+        skelprot = getattr(self.skeleton, 'skelprot', None)
 
-        if str(zframe) in parent.cell_zframes.keys():
-
-            for cellID in parent.cell_zframes[str(zframe)]:
-                # check intersections between processed cell mask and one of a cell already processed on the same z frame
-                mask = cellmask.astype(int) + parent.shapecells[str(cellID)].contour['mask'].astype(int)
-                mask = mask > 1
+        if str(zframe) not in parent.cell_zframes.keys():
+            # first cell of the z-frame: nothing to connect, it is only measured for the next cells
+            parent.contact_index().add_cell(zframe, cellprocessID, cellmask, skelprot)
 
-                structure = np.ones((3, 3), dtype=np.int)  # in this case we allow any kind of connection
-                # in case there more connections between the same cells
-                labeled, nconnections = label(mask, structure)
+        else:
 
-                regprop = regionprops(labeled)
+            rows = eng.cell_connections(parent.contact_index(), cellmask, skelprot, cellprocessID, zframe,
+                                        parent.shapecells, parent.cell_zframes[str(zframe)])
 
-                for r in regprop:
-                    center = np.array(r.centroid).astype(int).tolist()
-                    data = [zframe, cellprocessID, cellID, center[1], center[0]]
-                    frameRow = pd.DataFrame([data], columns = list(parent.connections))
-                    parent.connections = parent.connections.append(frameRow, ignore_index=True)
+            if len(rows) > 0:
+                newconnections = pd.DataFrame(rows, columns = list(parent.connections))
+                parent.connections = pd.concat([parent.connections, newconnections], ignore_index=True)
+                parent.record_edit('connections', None, newconnections)
+                prof.count('connections', len(rows))
 
                 # # store connection data in the cell object under process
                 # self.connections = np.append(self.connections, np.array([cellID] * nconnections).astype(int), axis = 0)
@@ -429,24 +690,13 @@ class singleCellShape():
                 #                                                        np.array([cellprocessID] * nconnections).astype(int),
                 #                                                        axis=0)
 
-    def getMask(self, currentImage):
+    def getMask(self, shape):
         """
-        Create the cell image mask from the cell boundary.
+        Create the cell image mask from the cell boundary (see engine.contour_mask).
+        :param shape: (rows, columns) of the image
         """
-        ny, nx = np.shape(currentImage)
-        poly_verts = [(self.contour['allxpoints'][0], self.contour['allypoints'][0])]
-        for i in range(len(self.contour['allxpoints']) - 1, -1, -1):
-            poly_verts.append((self.contour['allxpoints'][i], self.contour['allypoints'][i]))
 
-        # Create vertex coordinates for each grid cell...
-        # (<0,0> is at the top left of the grid in this system)
-        x, y = np.meshgrid(np.arange(nx), np.arange(ny))
-        x, y = x.flatten(), y.flatten()
-        points = np.vstack((x, y)).T
-
-        ROIpath = mplPath.Path(poly_verts)
-
-        return ROIpath.contains_points(points).reshape((ny, nx))
+        return eng.contour_mask(self.contour['allxpoints'], self.contour['allypoints'], shape)
 
     def measure_area(self):
 
@@ -456,18 +706,14 @@ class singleCellShape():
 
         controller = self.controller
 
-        x = self.contour['allxpoints']
-        y = self.contour['allypoints']
-        self.contour['area'] = 0.5 * np.abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
-
-        physical_size = controller.img.imgfile.dxyz # metadata info, pixel physical size (see imagemanager
-        if physical_size is not None:
-            self.contour['area'] = self.contour['area'] / (physical_size[0] * physical_size[1])
+        # metadata info, pixel physical size (see imagemanager). Pixel units if metadata are missing
+        self.contour['area'] = eng.contour_area(self.contour['allxpoints'], self.contour['allypoints'],
+                                                controller.img.imgfile.dxyz)
 
-class storeProcessedAspickle():
+class storeProcessedAspickle(cr.CellRecord):
     """
     Class to store all attributes of the singleCellShape class in an object without methods or tkinker reference,
-    thus "picklable".
+    thus "picklable" (see cellrecord module).
     """
 
     def __init__(self, cellshapeobj):
@@ -0,0 +1,234 @@
+'''
+
+Module to keep an append-only journal of the analysis edits (autosave).
+
+Each edit (new cell, cell body modification, new connections, 3D skeleton) is serialized when it's made
+and appended to the journal as a small record by a background thread, so that the cost of an edit does not
+depend on the size of the project. After a crash, the journal is replayed on the last saved project.
+The journal is compacted every time the project is saved.
+
+Record layout: magic (4 bytes), header length and payload length (uint32), JSON header, payload.
+Payloads are serialized with the projectfile and cellrecord modules.
+
+'''
+
+import hashlib
+import json
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import pandas as pd
+import imagepy.projectfile as pf
+import imagepy.cellrecord as cr
+
+AUTOSAVE_DIR = os.path.join(os.path.expanduser('~'), '.imagepy', 'autosave')
+RECORD_MAGIC = b'IPJ1'
+RECORD_HEADER = struct.Struct('<4sII')
+
+
+def autosave_path(imgpath):
+    """
+    Journal file of the analysis of an image (one journal for each source image).
+    """
+    key = hashlib.sha1(os.path.abspath(imgpath).encode('utf-8')).hexdigest()[:16]
+
+    return os.path.join(AUTOSAVE_DIR, key + '.journal')
+
+def encode_record(kind, key, value):
+    """
+    Serialize an edit of the analysis.
+    :return: header dictionary and payload bytes
+    """
+    header = {'kind': kind, 'key': key, 'time': time.time()}
+
+    if kind == 'cell':
+        payload = pf.pack_cell(value)
+    elif kind in ('connections', 'connections-table'):
+        # value is a DataFrame: one array per column
+        header['columns'] = list(value.columns)
+        payload = pf.table_to_bytes(value)
+    elif kind == 'start':
+        header.update(value)
+        payload = b''
+    else:
+        arrays = dict()
+        cr.pack_value('value', value, arrays)
+        payload = pf.arrays_to_bytes(arrays)
+
+    return header, payload
+
+def decode_record(header, payload):
+    """
+    Deserialize the value of an edit written by encode_record.
+    """
+    kind = header['kind']
+
+    if kind == 'cell':
+        return pf.unpack_cell(payload)
+    if kind in ('connections', 'connections-table'):
+        return pf.bytes_to_table(payload, header['columns'])
+    if kind == 'start':
+        return None
+
+    return cr.unpack_values(pf.bytes_to_arrays(payload))['value']
+
+def read_journal(path):
+    """
+    Read all the complete records of a journal. A record truncated by a crash ends the reading.
+    :return: list of (header, payload)
+    """
+    records = []
+    if not os.path.isfile(path):
+        return records
+
+    with open(path, 'rb') as f:
+        while True:
+            head = f.read(RECORD_HEADER.size)
+            if len(head) < RECORD_HEADER.size:
+                break
+            magic, headerlength, payloadlength = RECORD_HEADER.unpack(head)
+            if magic != RECORD_MAGIC:
+                break
+            header = f.read(headerlength)
+            payload = f.read(payloadlength)
+            if len(header) < headerlength or len(payload) < payloadlength:
+                break
+            records.append((json.loads(header.decode('utf-8')), payload))
+
+    return records
+
+def journal_base(records):
+    """
+    Project file the journal edits refer to (None if the analysis was never saved).
+    """
+    if len(records) > 0 and records[0][0]['kind'] == 'start':
+        return records[0][0]['base']
+
+    return None
+
+def has_edits(records, base):
+    """
+    Check if a journal contains edits made on the project base and not saved yet.
+    """
+    return journal_base(records) == base and any(header['kind'] != 'start' for header, _ in records)
+
+def replay_journal(records, project):
+    """
+    Apply the edits of a journal to a project.
+    :param project: dictionary with shapecells, cell_zframes, connections and volumecells entries
+    """
+    for header, payload in records:
+        kind = header['kind']
+        if kind == 'start':
+            continue
+
+        value = decode_record(header, payload)
+        key = header['key']
+
+        if kind == 'cell':
+            project['shapecells'][key] = value
+            zframe_cells = project['cell_zframes'].setdefault(str(value.zframe), [])
+            if int(key) not in zframe_cells:
+                zframe_cells.append(int(key))
+        elif kind == 'body':
+            cell = project['shapecells'][key]
+            cell.skelbody = value['skelbody']
+            cell.skelprot = value['skelprot']
+            project['shapecells'][key] = cell # cells of project files are modified by assignment
+        elif kind == 'connections':
+            project['connections'] = pd.concat([project['connections'], value], ignore_index=True)
+        elif kind == 'connections-table':
+            project['connections'] = value
+        elif kind == 'volume':
+            project['volumecells'][key] = value
+
+class ProjectJournal():
+    """
+    Append-only journal of the analysis edits, written by a background thread.
+    """
+
+    def __init__(self, path, base=None):
+        """
+        Start a new journal, discarding the previous records.
+        :param base: project file the edits refer to (None if the analysis was never saved)
+        """
+        self.path = path
+        self.records = queue.Queue()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = open(path, 'wb')
+        self.write_record(*encode_record('start', None, {'base': base}))
+
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def record(self, kind, key, value):
+        """
+        Queue an edit to be written in the journal. The edit is serialized on the calling thread,
+        so that later changes of the value (e.g. a cell modified in the GUI) don't reach the record.
+        """
+        self.records.put(encode_record(kind, key, value))
+
+    def write_record(self, header, payload):
+        """
+        Append a serialized edit to the journal file (see encode_record).
+        """
+        header = json.dumps(header).encode('utf-8')
+
+        self.file.write(RECORD_HEADER.pack(RECORD_MAGIC, len(header), len(payload)))
+        self.file.write(header)
+        self.file.write(payload)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write_loop(self):
+        """
+        Background thread writing the edits queued. A record that can't be written is reported and skipped,
+        so that the thread keeps writing the next ones (and flush never waits forever).
+        """
+        while True:
+            item = self.records.get()
+            try:
+                if item is None:
+                    return
+                self.write_record(*item)
+            except Exception as error:
+                print('Journal {}: {} record not written ({})'.format(self.path, item[0]['kind'], error),
+                      file=sys.stderr)
+            finally:
+                self.records.task_done()
+
+    def flush(self):
+        """
+        Wait until all the edits queued are written.
+        """
+        self.records.join()
+
+    def reset(self, base, project=None):
+        """
+        Compact the journal: discard all the records, e.g. after the project has been saved to base.
+        If project is given, its current state is written as the only records (the analysis is not saved).
+        """
+        self.flush()
+        self.file.seek(0)
+        self.file.truncate()
+        self.write_record(*encode_record('start', None, {'base': base}))
+
+        if project is not None:
+            for cellid, cell in project['shapecells'].items():
+                self.record('cell', cellid, cell)
+            self.record('connections-table', None, project['connections'])
+            for volumeid, volume in project['volumecells'].items():
+                self.record('volume', volumeid, volume)
+            self.flush()
+
+    def close(self):
+        """
+        Stop the background thread and close the journal file.
+        """
+        self.records.put(None)
+        self.writer.join()
+        self.file.close()
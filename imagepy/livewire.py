@@ -0,0 +1,74 @@
+'''
+
+Module to snap the segments of a manual selection to the edges of the image (live-wire / intelligent scissors).
+
+The segment between two points is the minimum cost path on an edge cost map, which is low on
+strong image gradients. The path search is restricted to a band around the straight segment,
+so that its cost depends on the segment length and not on the image size.
+
+'''
+
+import numpy as np
+from skimage import filters
+from skimage.graph import route_through_array
+from imagepy.imagefile import image_frame
+
+FRAME_BUDGET = 0.04 # maximum time spent updating the segment under the cursor [s]
+BAND_WIDTH = 25 # half width of the band around the segment where the path is searched [pixel]
+
+
+def edge_cost_map(image, sigma=1.5):
+    """
+    Compute the edge cost map of a 2D image: pixels on strong gradients have low cost.
+    :return: float32 cost map, values in (0, 1]
+    """
+    smoothed = filters.gaussian(image.astype(float), sigma=sigma, preserve_range=True)
+    gradient = filters.sobel(smoothed)
+
+    maxgradient = gradient.max()
+    if maxgradient > 0:
+        gradient = gradient / maxgradient
+
+    # small constant cost to favour short paths on flat regions
+    return (1 - gradient + 0.01).astype(np.float32)
+
+def cached_edge_cost_map(framecache, imgfile, zframe):
+    """
+    Edge cost map of a z-frame of the image, computed once and stored in the frame cache (see framecache module).
+    """
+
+    return framecache.get('edge-cost', zframe, lambda: edge_cost_map(image_frame(imgfile, zframe)))
+
+def livewire_path(costmap, start, end, band=BAND_WIDTH):
+    """
+    Minimum cost path between two points, searched in a band around the straight segment joining them.
+    :param costmap: edge cost map (see edge_cost_map)
+    :param start: (x, y) coordinates of the first point
+    :param end: (x, y) coordinates of the last point
+    :param band: half width of the band [pixel]
+    :return: lists of x and y coordinates of the path, from start to end
+    """
+    ny, nx = costmap.shape
+    start = np.clip(np.round(start[::-1]).astype(int), 0, [ny - 1, nx - 1])  # (row, column)
+    end = np.clip(np.round(end[::-1]).astype(int), 0, [ny - 1, nx - 1])
+
+    if (start == end).all():
+        return [float(start[1])], [float(start[0])]
+
+    # crop the cost map to the bounding box of the band
+    low = np.maximum(np.minimum(start, end) - band, 0)
+    high = np.minimum(np.maximum(start, end) + band + 1, [ny, nx])
+    crop = costmap[low[0]:high[0], low[1]:high[1]]
+
+    # pixels farther than band from the segment are impassable
+    rows, cols = np.mgrid[low[0]:high[0], low[1]:high[1]]
+    direction = end - start
+    t = ((rows - start[0]) * direction[0] + (cols - start[1]) * direction[1]) / np.dot(direction, direction)
+    t = np.clip(t, 0, 1)
+    distance = np.hypot(rows - start[0] - t * direction[0], cols - start[1] - t * direction[1])
+    crop = np.where(distance <= band, crop, np.inf)
+
+    path, _ = route_through_array(crop, start - low, end - low, fully_connected=True, geometric=True)
+    path = np.array(path) + low
+
+    return path[:, 1].astype(float).tolist(), path[:, 0].astype(float).tolist()
@@ -7,6 +7,7 @@ Created by Gabriele Nasello on Oct 12 2018
 '''
 
 
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.figure as mplfig
@@ -15,6 +16,8 @@ import tkinter as tk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 # in python 3.6 NavigationToolbar2TkAgg, in python 3.7 replace with NavigationToolbar2Tk
 from tkinter import ttk  # https://docs.python.org/3/library/tkinter.ttk.html
+import imagepy.livewire as lw
+import imagepy.skeletongraph as sg
 
 class ManualSelector():
     """
@@ -31,7 +34,9 @@ class ManualSelector():
 
         self.roip = None # polygonal region of interest object (manually selected)
 
+        self.img = img
         self.zframe = img.zframe_displ
+        self.snapON = tk.IntVar() # snap the segments to the image edges (live-wire)
 
         controller.modifyWindow = Toplevel()
         controller.modifyWindow.title(controller.interfacetitle + ' - Manual Selection Tool')
@@ -74,6 +79,21 @@ class ManualSelector():
         master.toolbar = NavigationToolbar2Tk(master.canvas, master.toolbarFrame)
         master.toolbar.update()
 
+    def edge_costmap(self):
+        """
+        Edge cost map of the z-frame under selection, cached in the image frame cache.
+        """
+
+        return lw.cached_edge_cost_map(self.img.framecache, self.img.imgfile, self.zframe)
+
+    def toggle_snap(self):
+        """
+        Precompute the edge cost map when the segment snapping is turned on.
+        """
+
+        if self.snapON.get():
+            self.edge_costmap()
+
     def start_roip(self):
         """
         Start the manual selection process.
@@ -155,23 +175,13 @@ class ImManualPanel(tk.Frame):
         """
         Display cell skeleton in the canvas of the Manual Selection GUI window.
         """
+        graph = sg.cell_graph(shapeobj)
+        if graph is None:
+            # skeletonization failed for this cell
+            return
 
-        color_cellbody = '#ff0000'
-        for path in shapeobj.skelbody['paths']:
-            l = plt.Line2D(path[:, 1], path[:, 0], color = color_cellbody, **linekwargs)
-            self.ax.add_line(l)
-
-        color_secondary = '#ffffff'  # '#ffc03e'
-        for protusion in shapeobj.skelprot['secondary-paths']:
-            for path in protusion:
-                l = plt.Line2D(path[:, 1], path[:, 0], color=color_secondary, **linekwargs)
-                self.ax.add_line(l)
-
-        # color = '#FFC125'
-        color_primary = '#ffff00'
-        for path in shapeobj.skelprot['primary-path']:
-            l = plt.Line2D(path[:, 1], path[:, 0], color=color_primary, **linekwargs)
-            self.ax.add_line(l)
+        for collection in sg.line_collections(graph, **linekwargs):
+            self.ax.add_collection(collection)
 
 
 class BtnManualPanel(tk.Frame):
@@ -203,6 +213,10 @@ class BtnManualPanel(tk.Frame):
         master.save_btn.grid(row=2, column=0, pady = 10)
         master.save_btn.config(state = 'disabled')
 
+        self.snap_cbtn = ttk.Checkbutton(self, text="Snap to Edges", variable = parent.snapON,
+                                         command = lambda: parent.toggle_snap())
+        self.snap_cbtn.grid(row=3, column=0, pady = 10)
+
 class RoiPol:
     '''Draw polygon regions of interest (ROIs) in matplotlib images,
     similar to Matlab's roipoly function.
@@ -218,6 +232,8 @@ class RoiPol:
         self.previous_point = []
         self.allxpoints = []
         self.allypoints = []
+        self.segment_sizes = [] # number of points added by each segment (more than one if snapped to edges)
+        self.last_motion = 0 # time of the last segment update under the cursor
         self.start_point = []
         self.end_point = []
         self.line = None
@@ -225,6 +241,7 @@ class RoiPol:
         self.fig = parent.im_manual_panel.fig
         self.ax = parent.im_manual_panel.ax
         self.master = parent.master
+        self.selector = parent
         self.closedpoly = False
 
         self.controller = controller
@@ -234,14 +251,32 @@ class RoiPol:
         self.__ID2 = self.fig.canvas.mpl_connect(
             'button_press_event', self.__button_press_callback)
 
+    def snap_segment(self, start, end):
+        """
+        Segment between two points: straight line, or path along the image edges if snapping is on.
+        :return: lists of x and y coordinates of the segment, from start to end
+        """
+        if self.selector.snapON.get():
+            return lw.livewire_path(self.selector.edge_costmap(), start, end)
+
+        return [start[0], end[0]], [start[1], end[1]]
+
     def __motion_notify_callback(self, event):
         if event.inaxes:
             ax = event.inaxes
             x, y = event.xdata, event.ydata
             if (event.button == None or event.button == 1) and self.line != None:  # Move line around
-                self.line.set_data([self.previous_point[0], x],
-                                   [self.previous_point[1], y])
-                self.fig.canvas.draw()
+                if self.selector.snapON.get():
+                    # skip cursor updates until the previous one has been drawn
+                    if time.time() - self.last_motion < lw.FRAME_BUDGET:
+                        return
+                    self.line.set_data(*self.snap_segment(self.previous_point, [x, y]))
+                    self.fig.canvas.draw()
+                    self.last_motion = time.time()
+                else:
+                    self.line.set_data([self.previous_point[0], x],
+                                       [self.previous_point[1], y])
+                    self.fig.canvas.draw()
 
     def clear_segment(self):
         """
@@ -250,6 +285,10 @@ class RoiPol:
 
         if self.closedpoly: # if the button is pressed after closing the polygon
             del (self.ax.lines[-1])
+            closing_size = self.segment_sizes.pop()
+            if closing_size > 0:
+                del (self.allxpoints[-closing_size:])
+                del (self.allypoints[-closing_size:])
             self.__ID1 = self.fig.canvas.mpl_connect(
                 'motion_notify_event', self.__motion_notify_callback)
             self.__ID2 = self.fig.canvas.mpl_connect(
@@ -259,10 +298,14 @@ class RoiPol:
             self.master.save_btn.config(state='disabled')
         else:
             try:
+                segment_size = self.segment_sizes.pop()
                 del (self.ax.lines[-2])
-                self.previous_point = [self.allxpoints[-2], self.allypoints[-2]]
-                del (self.allxpoints[-1])
-                del (self.allypoints[-1])
+                del (self.allxpoints[-segment_size:])
+                del (self.allypoints[-segment_size:])
+                self.previous_point = [self.allxpoints[-1], self.allypoints[-1]]
+                if self.selector.snapON.get():
+                    self.line.set_data([self.previous_point[0]] * 2, [self.previous_point[1]] * 2)
+                    self.fig.canvas.draw()
 
             except IndexError:
                 try: # to avoid IndexError if the user press the "Clear Last Segment" button before drawing
@@ -292,6 +335,19 @@ class RoiPol:
                     ax.add_line(self.line)
                     self.fig.canvas.draw()
                     # add a segment
+                elif self.selector.snapON.get():  # if there is a line, snap the segment to the edges
+                    xpath, ypath = self.snap_segment(self.previous_point, [x, y])
+                    self.line.set_data(xpath, ypath)
+                    self.line = plt.Line2D([xpath[-1], xpath[-1]],
+                                           [ypath[-1], ypath[-1]],
+                                           marker='o', color=self.roicolor)
+                    self.previous_point = [xpath[-1], ypath[-1]]
+                    self.allxpoints.extend(xpath[1:])
+                    self.allypoints.extend(ypath[1:])
+                    self.segment_sizes.append(len(xpath) - 1)
+
+                    event.inaxes.add_line(self.line)
+                    self.fig.canvas.draw()
                 else:  # if there is a line, create a segment
                     self.line = plt.Line2D([self.previous_point[0], x],
                                            [self.previous_point[1], y],
@@ -299,6 +355,7 @@ class RoiPol:
                     self.previous_point = [x, y]
                     self.allxpoints.append(x)
                     self.allypoints.append(y)
+                    self.segment_sizes.append(1)
 
                     event.inaxes.add_line(self.line)
                     self.fig.canvas.draw()
@@ -308,10 +365,12 @@ class RoiPol:
                 self.fig.canvas.mpl_disconnect(self.__ID1)  # joerg
                 self.fig.canvas.mpl_disconnect(self.__ID2)  # joerg
 
-                self.line.set_data([self.previous_point[0],
-                                    self.start_point[0]],
-                                   [self.previous_point[1],
-                                    self.start_point[1]])
+                xpath, ypath = self.snap_segment(self.previous_point, self.start_point)
+                self.line.set_data(xpath, ypath)
+                # the last point of the closing segment is the start point
+                self.allxpoints.extend(xpath[1:-1])
+                self.allypoints.extend(ypath[1:-1])
+                self.segment_sizes.append(max(len(xpath) - 2, 0))
                 ax.add_line(self.line)
                 self.fig.canvas.draw()
                 self.closedpoly = True
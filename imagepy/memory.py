@@ -0,0 +1,165 @@
+'''
+
+Module to account the memory held by the analysis and to keep it within a budget.
+
+The holders of memory (image frames, cells, caches of arrays computed from the z-frames, display artists)
+register a pool with the accountant: each pool measures the bytes it holds and, if its items can be computed
+or loaded again, releases its least recently used items. When the total exceeds the budget, the accountant
+releases the pools in order of priority (the cheapest items to get back first) until the total fits.
+Pools that can't be released (e.g. the image frames) are only reported.
+The budget is half of the computer memory, or the IMAGEPY_MEMORY_BUDGET environment variable [MB].
+
+'''
+
+import os
+import threading
+
+# priorities of the pools: released from the lowest
+PRIORITY_CACHE = 0 # arrays computed again on demand (e.g. edge cost maps)
+PRIORITY_CELLS = 10 # cells loaded again from the project file
+
+
+def system_memory():
+    """
+    Physical memory of the computer [bytes], None if unknown.
+    """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def default_budget():
+    """
+    Memory budget of the analysis [bytes]: IMAGEPY_MEMORY_BUDGET [MB], half of the computer memory otherwise.
+    """
+    if os.environ.get('IMAGEPY_MEMORY_BUDGET'):
+        return int(float(os.environ['IMAGEPY_MEMORY_BUDGET']) * 2 ** 20)
+
+    return (system_memory() or 2 ** 33) // 2
+
+def nbytes(value):
+    """
+    Bytes of the numpy arrays held by a value: arrays, nested dictionaries, lists and objects (e.g. cells).
+    Objects with an nbytes method (e.g. skeleton graphs) measure themselves. Other Python objects are not counted.
+    """
+    if hasattr(value, 'nbytes') and hasattr(value, 'dtype'):
+        return int(value.nbytes)
+    if callable(getattr(value, 'nbytes', None)):
+        return int(value.nbytes())
+    if isinstance(value, dict):
+        return sum(nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(v) for v in value)
+    if hasattr(value, '__dict__') and not isinstance(value, type):
+        return nbytes(vars(value))
+
+    return 0
+
+def format_bytes(size):
+    """
+    Size in a readable unit (e.g. '1.5 GB').
+    """
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(int(size))
+        size /= 1024
+
+
+class MemoryPool():
+    """
+    Holder of memory registered with the accountant.
+    """
+
+    def __init__(self, name, measure, release=None, priority=PRIORITY_CACHE):
+        """
+        :param measure: function returning the bytes held by the pool
+        :param release: function releasing at least the bytes given (least recently used items first)
+        and returning the bytes released, None if the pool can't be released
+        :param priority: pools with lower priority are released first
+        """
+        self.name = name
+        self.measure = measure
+        self.release = release
+        self.priority = priority
+
+
+class MemoryAccountant():
+    """
+    Class that accounts the memory of the registered pools and keeps it within a budget.
+    """
+
+    def __init__(self, budget=None):
+        """
+        :param budget: memory budget [bytes], see default_budget if None
+        """
+        self.budget = budget if budget is not None else default_budget()
+        self.pools = dict() # { name : pool }
+        self.listeners = [] # functions called after the budget is enforced, with the accountant
+        self.lock = threading.RLock()
+
+    def register(self, name, measure, release=None, priority=PRIORITY_CACHE):
+        """
+        Register a pool of memory (see MemoryPool), replacing the pool with the same name.
+        """
+        with self.lock:
+            self.pools[name] = MemoryPool(name, measure, release, priority)
+
+    def unregister(self, name):
+        with self.lock:
+            self.pools.pop(name, None)
+
+    def set_budget(self, budget):
+        """
+        Change the memory budget [bytes], releasing memory if needed.
+        """
+        self.budget = budget
+        self.enforce()
+
+    def usage(self):
+        """
+        Memory held by each pool.
+        :return: dictionary { pool : bytes }
+        """
+        with self.lock:
+            return {name: int(pool.measure()) for name, pool in self.pools.items()}
+
+    def total(self):
+        return sum(self.usage().values())
+
+    def enforce(self):
+        """
+        Release the pools, from the lowest priority, until the memory fits the budget.
+        :return: bytes released
+        """
+        with self.lock:
+            usage = self.usage()
+            excess = sum(usage.values()) - self.budget
+            released = 0
+
+            pools = sorted((pool for pool in self.pools.values() if pool.release is not None),
+                           key=lambda pool: pool.priority)
+            for pool in pools:
+                if excess <= 0:
+                    break
+                freed = pool.release(excess) or 0
+                excess -= freed
+                released += freed
+
+        for listener in self.listeners:
+            listener(self)
+
+        return released
+
+    def summary_text(self):
+        """
+        Short summary of the memory usage (e.g. for a status bar).
+        """
+        usage = self.usage()
+        parts = ['{} {}'.format(name, format_bytes(size)) for name, size in
+                 sorted(usage.items(), key=lambda item: -item[1]) if size > 0]
+
+        return 'Memory {} / {}'.format(format_bytes(sum(usage.values())), format_bytes(self.budget)) + \
+               (' (' + ', '.join(parts) + ')' if len(parts) > 0 else '')
+
+# accountant of the session, shared by all the modules
+ACCOUNTANT = MemoryAccountant()
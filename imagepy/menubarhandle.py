@@ -6,10 +6,55 @@ Created by Gabriele Nasello on Oct 16 2018
 
 '''
 
+import os
+import threading
 import tkinter as tk
 import tkinter.filedialog as tkfd
-import pickle as pk
-from imagepy.printsummary import save_excel_tab
+from tkinter import messagebox
+from tkinter import simpledialog
+import pims.bioformats as pbf
+import imagepy.imagemanager as imm
+import imagepy.projectfile as pf
+import imagepy.cellrecord as cr
+import imagepy.export as exp
+import imagepy.memory as mem
+import imagepy.profiling as prof
+
+def open_analysis(controller, dictload, imgfile, path):
+    """
+    Show a loaded analysis in the main GUI window.
+    :param dictload: analysis loaded from a project file (see projectfile.load_project) or a pickle file
+    :param path: file of the analysis
+    """
+
+    controller.img.load_images(imgfile = imgfile)
+
+    # cells of project files are loaded when displayed (see projectfile.LazyCellStore)
+    if len(dictload['shapecells']) > 0:
+        controller.img.processed.create_cell_list(procfile = dictload)
+
+    controller.img.processed.start_journal(base = os.path.abspath(path))
+
+    if len(controller.img.processed.shapecells) > 0:
+        controller.img.processed.show_cellprocessed()
+
+def save_analysis(controller, path):
+    """
+    Save the analysis of the main GUI window as a project file (see projectfile module).
+    """
+
+    # cells saved can be released from memory and loaded again from the project file (see memory module)
+    controller.img.processed.shapecells = pf.save_project(path, controller.img.imgfile,
+                                                          shapecells = controller.img.processed.shapecells,
+                                                          cell_zframes = controller.img.processed.cell_zframes,
+                                                          connections = controller.img.processed.connections,
+                                                          volumecells = controller.img.processed.volumecells)
+
+    # edits are now saved in the project: compact the autosave journal
+    if controller.img.processed.journal is None:
+        controller.img.processed.start_journal(base = os.path.abspath(path))
+    else:
+        controller.img.processed.journal.reset(base = os.path.abspath(path))
 
 # Here, we are creating our class, Window, and inheriting from the tk. Frame
 # class.
@@ -57,8 +102,14 @@ class MenuWindow(tk.Frame):
 
         self.selectMenu.add_command(label="Manual Selector",
                                     command = lambda: controller.img.processed.manual_selector())
+        self.selectMenu.add_command(label="Automatic Segmentation",
+                                    command = lambda: controller.img.processed.process_image())
+        self.selectMenu.add_command(label="Automatic Segmentation (All Z Frames)",
+                                    command = lambda: controller.img.processed.process_stack())
         self.selectMenu.entryconfig(1, state='disabled')
         self.selectMenu.entryconfig(2, state='disabled')
+        self.selectMenu.entryconfig(3, state='disabled')
+        self.selectMenu.entryconfig(4, state='disabled')
         self.menu.add_cascade(label='Select', menu=self.selectMenu)
 
         # create "show" menu
@@ -76,52 +127,190 @@ class MenuWindow(tk.Frame):
         self.summaryMenu.add_command(label="Print Summary",
                                     command = lambda: controller.img.processed.print_summary())
         self.summaryMenu.add_command(label="Save Summary",
-                                    command = lambda: save_excel_tab(controller = controller))
+                                    command = lambda: self.savesummary())
         self.summaryMenu.entryconfig(1, state='disabled')
         self.summaryMenu.entryconfig(2, state='disabled')
         self.menu.add_cascade(label='Summary', menu=self.summaryMenu)
 
+        # profiling of the analysis stages, timings are shown in the status bar (see profiling module)
+        self.profileMenu = tk.Menu(self.menu)
+        controller.profileON = tk.IntVar(value = int(prof.PROFILER.enabled))
+        controller.profilememON = tk.IntVar(value = int(prof.PROFILER.memory))
+        self.profileMenu.add_checkbutton(label="Enable Profiling", variable=controller.profileON,
+                                         command = lambda: self.toggle_profiling())
+        self.profileMenu.add_checkbutton(label="Trace Memory", variable=controller.profilememON,
+                                         command = lambda: self.toggle_profiling())
+        self.profileMenu.add_command(label="Print Profile", command = lambda: prof.PROFILER.print_summary())
+        self.profileMenu.add_command(label="Export Trace", command = lambda: self.export_trace())
+        self.profileMenu.add_command(label="Reset Profile", command = lambda: self.reset_profile())
+        self.profileMenu.add_separator()
+        self.profileMenu.add_command(label="Memory Budget", command = lambda: self.set_memory_budget())
+        self.menu.add_cascade(label='Profile', menu=self.profileMenu)
+        prof.PROFILER.listeners.append(self.show_profile)
+        mem.ACCOUNTANT.listeners.append(self.show_memory)
+
 
     def loadpicklefile(self):
         """
-        Load a processed image in pickle format
+        Load a processed image, saved as a project file (see projectfile module) or in pickle format
         """
 
-        path = tkfd.askopenfilename(filetypes=[("Pickle files (*.pk *.pickle)", "*.pk; *.pickle")])
+        path = tkfd.askopenfilename(filetypes=[("ImagePy projects (*" + pf.PROJECT_EXTENSION + ")",
+                                                "*" + pf.PROJECT_EXTENSION),
+                                               ("Pickle files (*.pk *.pickle)", "*.pk; *.pickle")])
 
         if len(path) == 0:  # asksaveasfile return `None` if dialog closed with "cancel".
             return
 
         controller = self.controller
 
-        with open(path, 'rb') as f:
-            dictload = pk.load(f)
+        if path.endswith(pf.PROJECT_EXTENSION):
+            dictload = pf.load_project(path)
+            imgfile = self.load_source_image(dictload['image'])
+            if imgfile is None:
+                return
+        else:
+            with open(path, 'rb') as f:
+                dictload = cr.load_legacy_project(f)
+            imgfile = dictload['imgfile']
 
-        imgfile = dictload['imgfile']
-        controller.img.load_images(imgfile = imgfile)
+        open_analysis(controller, dictload, imgfile, path)
 
-        if dictload['shapecells'] != {}:
-            controller.img.processed.create_cell_list(procfile = dictload)
-            controller.img.processed.show_cellprocessed()
+    def load_source_image(self, reference):
+        """
+        Load the source image of a project file. The user is asked to locate the image if it was moved,
+        and to confirm if the image content doesn't match the one analysed.
+        """
+
+        path = reference['path']
+
+        if not os.path.isfile(path):
+            messagebox.showinfo("Image Not Found", "Source image not found:\n" + path + "\n\nPlease locate it.")
+            path = tkfd.askopenfilename(initialfile=os.path.basename(path))
+            if len(path) == 0:
+                return None
+
+        if not pf.check_image_reference(reference, path):
+            if not messagebox.askyesno("Image Changed", "The image file doesn't match the one analysed "
+                                                        "in the project. Load it anyway?"):
+                return None
+
+        images = pbf.BioformatsReader(path)
+
+        return imm.pbf2pickle(pbfimage=images, path=path)
 
     def savefile(self):
         """
-        Save a processed image in pickle format
+        Save a processed image as a project file (see projectfile module).
+        The image data are not saved, only a reference to the source image file.
         """
 
         controller = self.controller
+        imgfile = controller.img.imgfile
 
         # if controller.img.imgfile is None:
         #     messagebox.showinfo("No Image", "Please load an image and later save the project")
         # else:
-        path = tkfd.asksaveasfilename(defaultextension=".pk", filetypes=[("Pickle files (*.pk)", "*.pk ")])
+        if getattr(imgfile, 'path', None) is None or not os.path.isfile(imgfile.path):
+            # projects loaded from pickle files don't know their source image
+            messagebox.showinfo("Source Image", "Please locate the source image of the analysis.")
+            imgpath = tkfd.askopenfilename()
+            if len(imgpath) == 0:
+                return
+            imgfile.path = imgpath
+
+        path = tkfd.asksaveasfilename(defaultextension=pf.PROJECT_EXTENSION,
+                                      filetypes=[("ImagePy projects (*" + pf.PROJECT_EXTENSION + ")",
+                                                  "*" + pf.PROJECT_EXTENSION)])
+        if len(path) == 0:  # asksaveasfile return `None` if dialog closed with "cancel".
+            return
+
+        save_analysis(controller, path)
+
+    def savesummary(self):
+        """
+        Export the cell shape parameters as tables (see export module).
+        The file format is chosen by the extension: Excel, CSV, Parquet or HDF5.
+        """
+
+        controller = self.controller
+
+        path = tkfd.asksaveasfilename(defaultextension=".xlsx",
+                                      filetypes=[("Excel files (*.xlsx)", "*.xlsx"),
+                                                 ("CSV files (*.csv)", "*.csv"),
+                                                 ("Parquet files (*.parquet)", "*.parquet"),
+                                                 ("HDF5 files (*.h5)", "*.h5")])
         if len(path) == 0:  # asksaveasfile return `None` if dialog closed with "cancel".
             return
 
-        self.data_save = dict(imgfile = controller.img.imgfile,
-                              shapecells = controller.img.processed.shapecells,
-                              cell_zframes = controller.img.processed.cell_zframes,
-                              connections = controller.img.processed.connections)
+        try:
+            exp.export_analysis(path, controller.img.imgfile,
+                                shapecells = controller.img.processed.shapecells,
+                                connections = controller.img.processed.connections,
+                                volumecells = controller.img.processed.volumecells,
+                                network = controller.img.processed.update_network(),
+                                tracks = controller.img.processed.update_tracks())
+        except (ImportError, ValueError) as error:
+            messagebox.showerror("Error", str(error))
+
+    def toggle_profiling(self):
+        """
+        Switch the profiling of the analysis stages on or off (see profiling module).
+        """
+
+        controller = self.controller
+
+        prof.PROFILER.disable()
+        if controller.profileON.get():
+            prof.PROFILER.enable(memory = bool(controller.profilememON.get()))
+            self.show_profile(prof.PROFILER)
+        else:
+            controller.statuslabel["text"] = ''
+
+    def show_profile(self, profiler):
+        """
+        Show the timings of the longest stages in the status bar (called when a stage ends).
+        """
+
+        # the status bar can be updated only by the GUI thread
+        if threading.current_thread() is threading.main_thread():
+            self.controller.statuslabel["text"] = profiler.summary_text()
+
+    def show_memory(self, accountant):
+        """
+        Show the memory usage in the status bar (called when the memory budget is enforced).
+        """
+
+        # the status bar can be updated only by the GUI thread
+        if threading.current_thread() is threading.main_thread():
+            self.controller.memorylabel["text"] = accountant.summary_text()
+
+    def set_memory_budget(self):
+        """
+        Ask the memory budget of the analysis: cached arrays and cells saved in the project file
+        are released when it is exceeded (see memory module).
+        """
+
+        budget = simpledialog.askfloat("Memory Budget", "Memory budget [MB]:",
+                                       initialvalue = round(mem.ACCOUNTANT.budget / 2 ** 20), minvalue = 1)
+        if budget is not None:
+            mem.ACCOUNTANT.set_budget(int(budget * 2 ** 20))
+
+    def reset_profile(self):
+        """
+        Clear the timings of the profiling session.
+        """
+
+        prof.PROFILER.reset()
+        self.show_profile(prof.PROFILER)
+
+    def export_trace(self):
+        """
+        Save the events of the profiling session as a trace file (Chrome trace format, see profiling module).
+        """
+
+        path = tkfd.asksaveasfilename(defaultextension=".json", filetypes=[("Trace files (*.json)", "*.json")])
+        if len(path) == 0:  # asksaveasfile return `None` if dialog closed with "cancel".
+            return
 
-        with open(path, 'wb') as f:
-            pk.dump(self.data_save, f)
\ No newline at end of file
+        prof.PROFILER.export_trace(path)
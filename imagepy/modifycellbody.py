@@ -18,7 +18,7 @@ from scipy.ndimage.measurements import label
 from skimage.measure import regionprops
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from tkinter import ttk  # https://docs.python.org/3/library/tkinter.ttk.html
-from skimage.morphology import medial_axis, binary_dilation
+from skimage.morphology import binary_dilation
 import imagepy.skeletonprocessing as skpro
 
 class CellBodyModify():
@@ -66,11 +66,14 @@ class CellBodyModify():
         self.skelbody, self.skelprot = skpro.full_cell_skeletonization(manpanel.distmap, manpanel.thresh,
                                                                        manpanel.maxthre, manpanel.physpace)
 
-        parent.shapecells[self.cellID].skelbody = self.skelbody
-        parent.shapecells[self.cellID].skelprot = self.skelprot
-        parent.shapecells[self.cellID].value = (str(np.around(parent.shapecells[self.cellID].contour['area'], decimals=1)),
-                                                str(max(self.skelprot['protusion_id'])),
-                                                ', '.join(str(np.around(len, decimals=1)) for len in self.skelprot['euclidean-length']))
+        # assign the cell, so that it is not released from memory before the project is saved (see memory module)
+        cell = parent.shapecells[self.cellID]
+        cell.skelbody = self.skelbody
+        cell.skelprot = self.skelprot
+        parent.shapecells[self.cellID] = cell
+        parent.record_edit('body', self.cellID, {'skelbody': self.skelbody, 'skelprot': self.skelprot})
+        if parent.contacts is not None:
+            parent.contacts.discard(self.cellID)  # tips changed, measured again for the next cells
 
         # plot modify skeletonization (if the proper z frame is showed)
         controller.show_cellshapeON.set(1)
@@ -95,6 +98,7 @@ class ImManualPanel(tk.Frame):
 
         self.parent = parent
         self.bodyimage = []
+        self.bodyimshow = None # image of the cell body skeleton, updated when the threshold changes
 
         image = image - np.min(image)
         imagescaled = cv2.convertScaleAbs(image, alpha=(255.0/(np.max(image))))
@@ -104,7 +108,7 @@ class ImManualPanel(tk.Frame):
         self.physpace = self.skelbody['physical-space']
 
         cellmask = cellshape.contour['mask']
-        medialAxis, distance = medial_axis(cellmask, return_distance=True)
+        medialAxis, distance = skpro.seeded_medial_axis(cellmask)
         self.distmap = np.array(distance * medialAxis)
 
         self.fig = mplfig.Figure(figsize=(5, 4), dpi=100)
@@ -154,7 +158,11 @@ class ImManualPanel(tk.Frame):
         self.bodyimage[dilated, 1] = rgbCol[1]
         self.bodyimage[dilated, 2] = rgbCol[2]
 
-        self.ax.imshow(self.bodyimage)
+        if self.bodyimshow is None:
+            self.bodyimshow = self.ax.imshow(self.bodyimage)
+        else:
+            # update the image instead of adding a new one for each threshold
+            self.bodyimshow.set_data(self.bodyimage)
 
     def add_slider(self, inthr, master):
         """
@@ -0,0 +1,164 @@
+'''
+
+Module to skeletonize many cells at once: in batches of cells labelled in one image, in a pool of worker processes.
+
+Cells that don't overlap or touch each other are labelled in the same image (a batch), so that a batch is
+cropped, stored and sent to the workers once instead of one full frame mask for each cell. The bounding boxes of
+the cells of a batch are found in one pass, but the medial axis is still computed once for each cell, in its
+padded bounding box: a single medial axis of the labelled image would break its ties differently, so skeletons
+would depend on the other cells of the batch (see skeletonprocessing.skeletonize_labels). Cells overlapping or touching a cell of the batch go to another batch.
+Each batch is cropped to the bounding box of its cells and, with several workers, split in chunks of
+neighbouring cells. All the labelled crops are written to one memory-mapped file, so that workers read
+their crop from the file instead of receiving a pickled full frame.
+Skeletons are computed in crop coordinates and translated back to the full frame.
+
+'''
+
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from scipy import ndimage
+from imagepy.skeletonprocessing import CROP_PADDING, skeletonize_labels
+
+MIN_PARALLEL_CELLS = 4 # fewer cells are skeletonized in the calling process
+LABEL_DTYPE = np.int32 # labelled crops in the memory-mapped file
+NEIGHBOURHOOD = np.ones((3, 3), dtype=bool) # cells closer than this neighbourhood touch each other
+
+
+def crop_mask(mask, padding=CROP_PADDING):
+    """
+    Crop a cell mask (or a labelled image) to its bounding box, with a border of background pixels.
+    :return: cropped mask and (row, column) position of the crop in the full frame
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0:
+        raise ValueError('Empty mask.')
+    r0, c0 = max(rows[0] - padding, 0), max(cols[0] - padding, 0)
+    r1, c1 = min(rows[-1] + padding + 1, mask.shape[0]), min(cols[-1] + padding + 1, mask.shape[1])
+
+    return mask[r0:r1, c0:c1], np.array([r0, c0])
+
+def separate_masks(masks):
+    """
+    Group cell masks in batches of cells that don't overlap or touch each other, labelled in one image.
+    Each cell joins the first batch it doesn't touch. Empty masks are left out.
+    :param masks: dictionary { Cell # : full frame mask }
+    :return: list of (labelled image, dictionary { label : Cell # })
+    """
+    batches = []
+    for cellid, mask in masks.items():
+        region = ndimage.find_objects(mask.view(np.uint8))
+        if len(region) == 0:
+            continue
+        region = region[0]
+        # bounding box with the pixels touching the cell
+        grown = tuple(slice(max(s.start - 1, 0), min(s.stop + 1, size)) for s, size in zip(region, mask.shape))
+        touching = ndimage.binary_dilation(mask[grown], NEIGHBOURHOOD)
+
+        for labels, cells in batches:
+            if not labels[grown][touching].any():
+                break
+        else:
+            labels, cells = np.zeros(mask.shape, dtype=LABEL_DTYPE), dict()
+            batches.append((labels, cells))
+
+        cells[len(cells) + 1] = cellid
+        labels[region][mask[region]] = len(cells)
+
+    return batches
+
+def batch_crops(masks, chunks=1):
+    """
+    Labelled crops to skeletonize: the batches of cells (see separate_masks) cropped to their bounding box,
+    each batch split in chunks of neighbouring cells (e.g. one for each worker process).
+    :param masks: dictionary { Cell # : full frame mask }
+    :return: list of (labelled crop, (row, column) position of the crop in the full frame, { label : Cell # })
+    """
+    crops = []
+    for labels, cells in separate_masks(masks):
+        regions = ndimage.find_objects(labels)
+        order = sorted(cells, key=lambda label: (regions[label - 1][0].start, regions[label - 1][1].start))
+
+        for chunk in np.array_split(order, min(chunks, len(order))):
+            chunklabels = labels if len(chunk) == len(order) else np.where(np.isin(labels, chunk), labels, 0)
+            crop, offset = crop_mask(chunklabels)
+            crops.append((crop, offset, {int(label): cells[label] for label in chunk}))
+
+    return crops
+
+def skeletonize_crop(path, start, shape, offset, frameshape, physicspacing):
+    """
+    Skeletonize the cells of a labelled crop read from the memory-mapped file of the crops
+    (task of the worker processes).
+    :param start: position of the crop in the file [bytes]
+    :return: list of (label, result) (see skeletonprocessing.skeletonize_labels)
+    """
+    crop = np.memmap(path, dtype=LABEL_DTYPE, mode='r', offset=start, shape=tuple(shape))
+
+    return list(skeletonize_labels(np.array(crop), physicspacing, offset, frameshape))
+
+def skeletonize_cells(masks, physicspacing=1, workers=None):
+    """
+    Skeletonize cell masks in batches (see separate_masks), in a pool of worker processes.
+    Results are generated as soon as each crop is done (not in the order of masks).
+    :param masks: dictionary { Cell # : full frame mask }
+    :param workers: number of processes, all the available cores if None
+    :return: generator of (Cell #, (threshold, skelbody, skelprot)), or (Cell #, exception) if the skeletonization fails
+    (e.g. empty masks, or all the cells of a crop if its worker fails): a failed cell doesn't stop the others.
+    The masks are read before the first result, so the caller can release each mask as its result arrives.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parallel = len(masks) >= MIN_PARALLEL_CELLS and workers >= 2
+
+    crops = batch_crops(masks, chunks=workers if parallel else 1)
+
+    batched = set(cellid for _, _, cells in crops for cellid in cells.values())
+    empty = [cellid for cellid in masks if cellid not in batched]
+    frameshape = next(iter(masks.values())).shape if len(masks) > 0 else None
+    del masks  # the crops hold the cells from now on
+
+    for cellid in empty:
+        yield cellid, ValueError('Cell # {}: empty mask'.format(cellid))
+
+    if len(crops) == 0:
+        return
+
+    if not parallel:
+        for crop, offset, cells in crops:
+            for label, result in skeletonize_labels(crop, physicspacing, offset, frameshape):
+                yield cells[label], result
+        return
+
+    # all the crops in one memory-mapped file
+    starts = []
+    size = 0
+    for crop, _, _ in crops:
+        starts.append(size)
+        size += crop.nbytes
+    fd, path = tempfile.mkstemp(suffix='.masks')
+    os.close(fd)
+
+    try:
+        mapped = np.memmap(path, dtype=np.uint8, mode='w+', shape=(max(size, 1),))
+        for start, (crop, _, _) in zip(starts, crops):
+            mapped[start:start + crop.nbytes] = np.ascontiguousarray(crop, dtype=LABEL_DTYPE).view(np.uint8).ravel()
+        mapped.flush()
+        del mapped
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(skeletonize_crop, path, start, crop.shape, offset, frameshape, physicspacing): cells
+                       for start, (crop, offset, cells) in zip(starts, crops)}
+
+            for future in as_completed(futures):
+                cells = futures[future]
+                try:
+                    results = future.result()
+                except Exception as error:
+                    results = [(label, error) for label in cells]
+                for label, result in results:
+                    yield cells[label], result
+    finally:
+        os.remove(path)
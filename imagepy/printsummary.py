@@ -11,101 +11,16 @@ from tkinter import Toplevel
 from tkinter import ttk
 from tkinter import Label
 import tkinter as tk
+import tkinter.font as tkfont
+import re
 import pandas as pd
 import numpy as np
-import tkinter.filedialog as tkfd
+from imagepy.engine import CONNECTION_TIP
+from imagepy.export import protusion_tab, volume_protusion_tab
+from imagepy.skeletonprocessing import pixel_spacing
+from imagepy.tracking import track_tab
 
 
-def save_excel_tab(controller):
-    """
-    Save cell shape parameters in a csv file. Cells shape data are stored in a dictionary.
-    """
-
-    unit = controller.img.imgfile.unit  # metadata info, physical size unit (see imagemanager module)
-
-    if unit is None:
-        unit = 'pixel'
-
-    shapecells = controller.img.processed.shapecells
-    protDataFrame = protusion_tab(shapecells)
-    protDataFrame.columns = ['Cell #',
-                          'Cell Area' + ' [' + unit + '\u00B2]',
-                          '# Prim. Prot.',
-                          'Prim. Prot. Lengths' + ' [' + unit + ']']
-
-    connectionsDataFrame = controller.img.processed.connections
-    connectionsDataFrame.columns = ['Z Frame',
-                          '# Cell 1',
-                          '# Cell 2',
-                          'Center X',
-                          'Center Y']
-
-    imgfile = controller.img.imgfile
-    dataimgSize = {'Timepoints' : [imgfile.imgcount],
-            'Image Size - X' : [imgfile.imgsize['x']],
-            'Image Size - Y': [imgfile.imgsize['y']],
-            'Z-stack Frames' : [imgfile.shape[2]],
-            'Unit': [unit]}
-    try:
-        dataimgSize['Pixels Physical Size - X'] = [imgfile.dxyz[0]]
-        dataimgSize['Pixels Physical Size - Y'] = [imgfile.dxyz[1]]
-        dataimgSize['Imaged Volume Size - X'] = [imgfile.volxyz[0]]
-        dataimgSize['Imaged Volume Size - Y'] = [imgfile.volxyz[1]]
-    except AttributeError:
-        dataimgSize['Pixels Physical Size - X'] = [np.nan]
-        dataimgSize['Pixels Physical Size - Y'] = [np.nan]
-        dataimgSize['Imaged Volume Size - X'] = [np.nan]
-        dataimgSize['Imaged Volume Size - Y'] = [np.nan]
-
-    try:
-        dataimgSize['Pixels Physical Size - Z'] = [imgfile.dxyz[2]]
-        dataimgSize['Imaged Volume Size - Z'] = [imgfile.volxyz[2]]
-    except AttributeError:
-        dataimgSize['Pixels Physical Size - Z'] = [np.nan]
-        dataimgSize['Imaged Volume Size - Z'] = [np.nan]
-
-    imgsizeDataFrame = pd.DataFrame(data = dataimgSize)
-
-    path = tkfd.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files (*.xlsx)", "*.xlsx ")])
-    if len(path) == 0:  # asksaveasfile return `None` if dialog closed with "cancel".
-        return
-
-    # Create a Pandas Excel writer using XlsxWriter as the engine.
-    writer = pd.ExcelWriter(path, engine='xlsxwriter')
-
-    # Convert the dataframe to an XlsxWriter Excel object.
-    protDataFrame.to_excel(writer, sheet_name='Cells Protusions')
-    connectionsDataFrame.to_excel(writer, sheet_name='Cells Connections')
-    imgsizeDataFrame.to_excel(writer, sheet_name='Imaged Size')
-
-    # Close the Pandas Excel writer and output the Excel file.
-    writer.save()
-
-def protusion_tab(shapecells):
-    """
-    Create the updated protusion tab.
-         Insert some rows
-         define the array that will be than showed in the print summary window (see module)
-         list of values:
-         cell  area
-         number of primary protusions
-         length of each primary protusion
-         connecting cells
-    """
-    row = ['cell#', 'area', 'protusion_id', 'euclidean-length']
-    emptydata = np.empty((0, 5), int)
-    protTab = pd.DataFrame(emptydata.tolist(), columns=row)
-    for i in shapecells.keys():
-        rowFrame = [int(i),
-                np.around(shapecells[i].contour['area'], decimals=1),
-                max(shapecells[i].skelprot['protusion_id']),
-                0]
-        cellRow = pd.DataFrame([rowFrame], columns=list(protTab))
-        cellRow.loc[[0], row[-1]] = pd.Series([[np.around(len, decimals=1) for len in shapecells[i].skelprot['euclidean-length']]])
-        protTab = protTab.append(cellRow, ignore_index=True)
-
-    return protTab
-
 class PrintParameters(tk.Frame):
     """
     Class that contains all the methods necessary to visualize cell shape parameters in a dedicated window.
@@ -128,6 +43,13 @@ class PrintParameters(tk.Frame):
 
         connectionlabel = Label(master = self.master, text='Cells Connections Tab', font=(14), pady = 5)
         self.tableConnectionSummary = TabConnectionSummary(data = parent.connections, master = self.master, controller = controller)
+        # statistics of the connection network (see connectivity module)
+        self.networkSummary = Label(master = self.master, text = 'Network: ' + parent.update_network().summary_text(),
+                                    anchor = 'w', justify = 'left')
+
+        tracklabel = Label(master = self.master, text='Cell Tracks Tab', font=(14), pady = 5)
+        self.tableTrackSummary = TabTrackSummary(data = parent.update_tracks(), shapecells = parent.shapecells,
+                                                 master = self.master, controller = controller)
 
         imsizelabel = Label(master=self.master, text='Imaged Size Tab', font=(14), pady = 5)
         self.imSizeSummary = TabImageSizeSummary(imgfile = controller.img.imgfile, master = self.master, controller = controller)
@@ -139,33 +61,57 @@ class PrintParameters(tk.Frame):
         controller.printWindow.grid_rowconfigure(2, weight=1)
         controller.printWindow.grid_rowconfigure(3, weight=20)
         controller.printWindow.grid_rowconfigure(4, weight=1)
-        controller.printWindow.grid_rowconfigure(5, weight=20)
+        controller.printWindow.grid_rowconfigure(5, weight=1)
+        controller.printWindow.grid_rowconfigure(6, weight=20)
+        controller.printWindow.grid_rowconfigure(7, weight=1)
+        controller.printWindow.grid_rowconfigure(8, weight=20)
 
         protusionlabel.grid(row=0, column=0, columnspan = 2, sticky="nsw")
         self.tableProtusionSummary.grid(row=1, column=0, columnspan = 2, sticky="nsew")
 
         connectionlabel.grid(row=2, column=0, columnspan = 2, sticky="nsw")
         self.tableConnectionSummary.grid(row=3, column=0, columnspan = 2, sticky="nsew")
+        self.networkSummary.grid(row=4, column=0, columnspan = 2, sticky="nsw")
 
-        imsizelabel.grid(row=4, column=0, columnspan = 2, sticky="nsw")
-        self.imSizeSummary.grid(row=5, column=0, columnspan = 2, sticky="nsew")
+        tracklabel.grid(row=5, column=0, columnspan = 2, sticky="nsw")
+        self.tableTrackSummary.grid(row=6, column=0, columnspan = 2, sticky="nsew")
 
-class TabProtusionSummary(tk.Frame):
+        imsizelabel.grid(row=7, column=0, columnspan = 2, sticky="nsw")
+        self.imSizeSummary.grid(row=8, column=0, columnspan = 2, sticky="nsew")
+
+class VirtualTable(tk.Frame):
     """
-    Class that shows cell shape parameters in a treeview widget.
+    Class that shows a table in a treeview widget, inserting only the rows visible in the window.
+    Rows are read from the columns of the table (no text formatting of the whole table),
+    sorting (click on a heading) and filtering (filter bar) are done on the columns.
     """
 
-    def __init__(self, data, master, controller):
+    def __init__(self, data, headings, master, controller, widths = None, formats = None):
         """
-        Initialize the summary table to show
+        Initialize the table to show
+        :param data: pandas DataFrame
+        :param headings: heading of each column of data
+        :param widths: width of each column [pixel]
+        :param formats: function converting the values of each column to text (None for the default format)
         """
 
         tk.Frame.__init__(self, master)
 
         self.controller = controller
 
+        self.columns = [data[c].values for c in data.columns]
+        self.headings = headings
+        self.formats = [f or format_value for f in (formats or [None] * len(headings))]
+        self.nrows = len(data)
+
+        self.order = np.arange(self.nrows) # rows shown (filtered and sorted)
+        self.offset = 0 # first row visible
+        self.visible = 10 # number of rows visible
+        self.sortcolumn = None
+        self.ascending = True
+
         self.grid_columnconfigure(0, weight=1)
-        self.grid_rowconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
 
         # Customize a treeview
         style = ttk.Style()
@@ -174,50 +120,227 @@ class TabProtusionSummary(tk.Frame):
         style.configure("mystyle.Treeview.Heading", font=('Calibri', 13, 'bold'))  # Modify the font of the headings
         style.layout("mystyle.Treeview", [('mystyle.Treeview.treearea', {'sticky': 'nswe'})])  # Remove the borders
 
+        try:
+            self.rowheight = int(style.lookup("mystyle.Treeview", "rowheight"))
+        except (ValueError, tk.TclError):
+            self.rowheight = tkfont.Font(font=('Calibri', 11)).metrics('linespace') + 3
+
+        # Filter bar: column, condition (e.g. '> 10', '!= 0' or a text) and number of rows shown
+        filterbar = tk.Frame(self)
+        Label(master = filterbar, text = 'Filter').grid(row=0, column=0, padx = 5)
+        self.filtercolumn = ttk.Combobox(filterbar, values = headings, state = 'readonly', width = 30)
+        self.filtercolumn.current(0)
+        self.filtercolumn.grid(row=0, column=1, padx = 5)
+        self.filtertext = ttk.Entry(filterbar, width = 20)
+        self.filtertext.grid(row=0, column=2, padx = 5)
+        self.filtertext.bind('<Return>', lambda event: self.apply_filter())
+        self.filtercolumn.bind('<<ComboboxSelected>>', lambda event: self.apply_filter())
+        self.rowslabel = Label(master = filterbar)
+        self.rowslabel.grid(row=0, column=3, padx = 5)
+        filterbar.grid(row=0, column=0, columnspan = 2, sticky="nsw")
+
         # Create the widget
-        self.tree = ttk.Treeview(self, style="mystyle.Treeview")
+        self.tree = ttk.Treeview(self, style="mystyle.Treeview", show = 'headings', selectmode = 'browse')
+        self.scrollbar = ttk.Scrollbar(self, orient = 'vertical', command = self.yview)
 
-        # Definition of the columns
-        self.tree["columns"] = ("one", "two", "three")
-        self.tree.column("#0", width=100)
-        self.tree.column("one", width=200)
-        self.tree.column("two", width=150)
-        self.tree.column("three", width=250)
+        # Definition of the columns and the headings
+        self.tree["columns"] = ['c' + str(i) for i in range(len(headings))]
+        for i, heading in enumerate(headings):
+            if widths is not None:
+                self.tree.column('c' + str(i), width=widths[i])
+            self.tree.heading('c' + str(i), text = heading, anchor=tk.W, command = lambda i=i: self.sort(i))
+
+        self.tree.bind('<Configure>', self.resize)
+        self.tree.bind('<MouseWheel>', lambda event: self.yview('scroll', -int(np.sign(event.delta)), 'units'))
+        self.tree.bind('<Button-4>', lambda event: self.yview('scroll', -1, 'units'))
+        self.tree.bind('<Button-5>', lambda event: self.yview('scroll', 1, 'units'))
+
+        self.tree.grid(row=1, column=0, sticky="nswe")
+        self.scrollbar.grid(row=1, column=1, sticky="ns")
+
+        self.render()
+
+    def render(self):
+        """
+        Insert in the treeview the rows visible in the window.
+        """
+
+        self.tree.delete(*self.tree.get_children())
+
+        rows = self.order[self.offset:self.offset + self.visible]
+        for r in rows:
+            self.tree.insert('', 'end', values = [f(c[r]) for f, c in zip(self.formats, self.columns)])
+
+        nshown = len(self.order)
+        if nshown > 0:
+            self.scrollbar.set(self.offset / nshown, (self.offset + len(rows)) / nshown)
+        else:
+            self.scrollbar.set(0, 1)
+        self.rowslabel.config(text = '{} / {} rows'.format(nshown, self.nrows))
+
+    def yview(self, *args):
+        """
+        Scroll the rows visible in the window (command of the scrollbar).
+        """
+
+        if args[0] == 'moveto':
+            offset = int(round(float(args[1]) * len(self.order)))
+        elif args[2] == 'pages':
+            offset = self.offset + int(args[1]) * self.visible
+        else:
+            offset = self.offset + int(args[1])
+
+        offset = min(max(offset, 0), max(len(self.order) - self.visible, 0))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def resize(self, event):
+        """
+        Update the number of rows visible when the window is resized.
+        """
+
+        visible = max((event.height - self.rowheight - 4) // self.rowheight, 1) # first row is the heading
+        if visible != self.visible:
+            self.visible = visible
+            self.offset = min(self.offset, max(len(self.order) - self.visible, 0))
+            self.render()
+
+    def sort(self, column):
+        """
+        Sort the rows by the values of a column (a second click reverses the order).
+        """
+
+        if self.sortcolumn == column:
+            self.ascending = not self.ascending
+        else:
+            self.sortcolumn = column
+            self.ascending = True
+
+        self.sort_order()
+        self.offset = 0
+        self.render()
+
+    def sort_order(self):
+        """
+        Sort the rows shown by the values of the column selected.
+        """
+
+        if self.sortcolumn is None:
+            return
+
+        values = self.columns[self.sortcolumn][self.order]
+        if values.dtype.kind in 'iuf':
+            # negative values to sort in descending order keeping missing values (NaN) at the end
+            values = values if self.ascending else -values.astype(float)
+            self.order = self.order[np.argsort(values, kind='mergesort')]
+        else:
+            self.order = self.order[np.argsort(values.astype(str), kind='mergesort')]
+            if not self.ascending:
+                self.order = self.order[::-1]
+
+    def apply_filter(self):
+        """
+        Show only the rows whose value in the column selected satisfies the condition of the filter bar.
+        """
+
+        index = self.filtercolumn.current()
+        column = self.columns[index]
+        condition = self.filtertext.get().strip()
+        textformat = self.formats[index] if self.formats[index] is not format_value else None
+
+        self.order = np.flatnonzero(filter_mask(column, condition, textformat))
+        self.sort_order()
+        self.offset = 0
+        self.render()
+
+
+def format_value(value):
+    """
+    Text of a value shown in a summary table.
+    """
+
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return ''
+        return '{:.2f}'.format(value).rstrip('0').rstrip('.')
+
+    return str(value)
+
+def filter_mask(column, condition, textformat = None):
+    """
+    Rows of a column satisfying a condition: comparison with a number (e.g. '> 10', '<= 2.5', '!= 0', '3')
+    for numeric columns, otherwise the value must be equal ('== text'), different ('!= text') or contain the text
+    of the condition.
+    :param textformat: function converting the values of the column to the text shown (see VirtualTable),
+    the condition is compared with the values shown (e.g. z-frames counted from 1, kinds of connection as text)
+    """
+
+    if len(condition) == 0:
+        return np.ones(len(column), dtype=bool)
+
+    if textformat is not None:
+        values, inverse = np.unique(column, return_inverse=True)
+        shown = [textformat(v) for v in values]
+        try:
+            shown = np.array([float(s) if len(s) > 0 else np.nan for s in shown])
+        except ValueError:
+            shown = np.array(shown, dtype=object)
+        column = shown[inverse.ravel()]
+
+    match = re.match(r'^(<=|>=|!=|==|=|<|>)?\s*(.*)$', condition)
+    operator, value = match.group(1) or '==', match.group(2)
+
+    if column.dtype.kind in 'iuf':
+        try:
+            value = float(value)
+        except ValueError:
+            return np.zeros(len(column), dtype=bool)
+
+        with np.errstate(invalid='ignore'):
+            return {'<': np.less, '>': np.greater, '<=': np.less_equal, '>=': np.greater_equal,
+                    '!=': np.not_equal, '==': np.equal, '=': np.equal}[operator](column, value)
+
+    text = np.array([str(v) for v in column], dtype=object)
+    if match.group(1) in ('==', '='):
+        return np.array(text == value, dtype=bool)
+    if match.group(1) == '!=':
+        return np.array(text != value, dtype=bool)
+
+    return np.array([condition in t for t in text], dtype=bool)
+
+
+class TabProtusionSummary(VirtualTable):
+    """
+    Class that shows cell shape parameters in a treeview widget, one row for each primary protusion.
+    """
+
+    def __init__(self, data, master, controller):
+        """
+        Initialize the summary table to show
+        """
 
         unit = controller.img.imgfile.unit # metadata info, physical size unit (see imagemanager module)
 
         if unit is None:
             unit = 'pixel'
 
-        # Definition of the headings
-        self.tree.heading("#0", text="Name", anchor=tk.W)
-        self.tree.heading("one", text=('Cell Area' + ' [' + unit + '\u00B2]'), anchor=tk.W)
-        # \u00B2 is the unicode super character for number 2
-        self.tree.heading("two", text="# Prim Prot.", anchor=tk.W)
-        self.tree.heading("three", text = ('Prim Prot Lengths' + ' [' + unit + ']'), anchor=tk.W)
-
         self.protTab = protusion_tab(data)
 
-        stringValue = self.protTab.loc[:, self.protTab.columns != 'euclidean-length'].to_string(header=False,
-                                                                                                index=False,
-                                                                                                index_names=False).split('\n')
-        values = [ele.strip(' ').split() for ele in stringValue]
-        protlengthString = self.protTab.loc[:, self.protTab.columns == 'euclidean-length'].to_string(header=False,
-                                                                                                     index=False,
-                                                                                                     index_names=False).split('\n')
-        try:
-            for i in range(len(values)):
-                values[i].append(protlengthString[i].strip(' '))
-                self.tree.insert('', 'end', text= ('Cell # ' + values[i][0]), values = values[i][1:])
-        except IndexError:
-            self.tree.insert('', 'end', text = '', values=('', '', ''))
+        # \u00B2 is the unicode super character for number 2
+        headings = ['Cell #', 'Z Frame', 'Cell Area' + ' [' + unit + '\u00B2]', 'Prot. #',
+                    'Prim Prot Length' + ' [' + unit + ']', '# Prim Prot.', 'Total Prim Prot Length' + ' [' + unit + ']',
+                    '# Branches', 'Max Order', 'Branch Length' + ' [' + unit + ']', 'Tortuosity',
+                    'Width' + ' [' + unit + ']', 'Orientation [deg]']
+        formats = [None, lambda z: str(z + 1)] + [None] * 11
 
-        self.tree.grid(row=0, column=0, sticky="nswe")
+        VirtualTable.__init__(self, data = self.protTab, headings = headings, master = master, controller = controller,
+                              widths = [80, 80, 180, 80, 220, 120, 250, 100, 100, 180, 100, 140, 150], formats = formats)
 
 
-class TabConnectionSummary(tk.Frame):
+class TabConnectionSummary(VirtualTable):
     """
-    Class that shows cell shape parameters in a treeview widget.
+    Class that shows cell connections in a treeview widget.
     """
 
     def __init__(self, data, master, controller):
@@ -225,49 +348,38 @@ class TabConnectionSummary(tk.Frame):
         Initialize the summary table to show
         """
 
-        tk.Frame.__init__(self, master)
+        headings = ['Z Frame', '# Cell 1', '# Cell 2', 'Center X', 'Center Y', 'Kind']
+        formats = [lambda z: str(z + 1), None, None, None, None, lambda k: 'Tip' if k == CONNECTION_TIP else 'Overlap']
 
-        self.controller = controller
+        VirtualTable.__init__(self, data = data, headings = headings, master = master, controller = controller,
+                              widths = [100, 200, 200, 200, 200, 100], formats = formats)
 
-        self.grid_columnconfigure(0, weight=1)
-        self.grid_rowconfigure(0, weight=1)
 
-        # Customize a treeview
-        style = ttk.Style()
-        style.configure("mystyle.Treeview", highlightthickness=0, bd=0,
-                        font=('Calibri', 11))  # Modify the font of the body
-        style.configure("mystyle.Treeview.Heading", font=('Calibri', 13, 'bold'))  # Modify the font of the headings
-        style.layout("mystyle.Treeview", [('mystyle.Treeview.treearea', {'sticky': 'nswe'})])  # Remove the borders
+class TabTrackSummary(VirtualTable):
+    """
+    Class that shows the cells linked through the z-frames in a treeview widget, one row for each track.
+    """
 
-        # Create the widget
-        self.tree = ttk.Treeview(self, style="mystyle.Treeview")
+    def __init__(self, data, shapecells, master, controller):
+        """
+        Initialize the summary table to show
+        :param data: list of tracks (see tracking.CellLinker.tracks)
+        """
 
-        # Definition of the columns
-        self.tree["columns"] = ("one", "two", "three","four")
-        self.tree.column("#0", width=100)
-        self.tree.column("one", width=200)
-        self.tree.column("two", width=200)
-        self.tree.column("three", width=200)
-        self.tree.column("four", width=200)
+        unit = controller.img.imgfile.unit # metadata info, physical size unit (see imagemanager module)
 
-        # Definition of the headings
-        self.tree.heading("#0", text='Z Frame', anchor=tk.W)
-        self.tree.heading("one", text = '# Cell 1', anchor=tk.W)
-        self.tree.heading("two", text = '# Cell 2', anchor=tk.W)
-        self.tree.heading("three", text = 'Center X', anchor=tk.W)
-        self.tree.heading("four", text = 'Center Y', anchor=tk.W)
-
-        x = data.loc[:, data.columns != 'zframe'].to_string(header=False, index=False, index_names=False).split('\n')
-        values = [ele.strip(' ').split() for ele in x]
-        try:
-            for i in range(len(values)):
-                self.tree.insert('', 'end', text= str(data.zframe.tolist()[i]+1), values = values[i])
-        except IndexError:
-            self.tree.insert('', 'end', text = '', values=('', '', '', ''))
-        except AttributeError:
-            self.tree.insert('', 'end', text = '', values=('', '', '', ''))
+        if unit is None:
+            unit = 'pixel'
 
-        self.tree.grid(row=0, column=0, sticky="nswe")
+        self.trackTab = track_tab(data, shapecells, pixel_spacing(controller.img.imgfile.dxyz, ndim=3)[0])
+
+        # \u00B3 is the unicode super character for number 3
+        headings = ['Track #', 'Cells #', 'Z Frames', '# Slices', 'Volume' + ' [' + unit + '\u00B3]', 'Max # Prot.',
+                    'Mean # Prot.', 'Max Prot Length' + ' [' + unit + ']', 'Mean Total Length' + ' [' + unit + ']',
+                    'Tortuosity', 'Width' + ' [' + unit + ']', 'Max # Branches']
+
+        VirtualTable.__init__(self, data = self.trackTab, headings = headings, master = master, controller = controller,
+                              widths = [80, 200, 100, 80, 180, 100, 100, 200, 220, 100, 140, 120])
 
 
 class TabImageSizeSummary(tk.Frame):
@@ -324,14 +436,15 @@ class TabImageSizeSummary(tk.Frame):
         values = [str(imgfile.imgcount),
                   '{} x {}'.format(*(imgfile.imgsize['x'], imgfile.imgsize['y'])),
                   str(imgfile.shape[2])]
-        try:
+        if imgfile.dxyz is not None:
             l = [str(round(i,2)) for i in imgfile.dxyz]
             values.append(' x '.join(l))
             l = [str(round(i,1)) for i in imgfile.volxyz]
             values.append(' x '.join(l))
-        except AttributeError:
-            values.append('-')
-            values.append('-')
+        else:
+            # pixel units: 1 pixel along each axis, imaged size equal to the image size
+            values.append(' x '.join(['1'] * len(imgfile.shape)))
+            values.append(' x '.join(str(i) for i in imgfile.shape))
 
         self.tree.insert('', 'end', values=values)
 
@@ -0,0 +1,245 @@
+'''
+
+Module to profile the stages of the analysis (e.g. cell mask, skeletonization, connections and redraw
+when a cell is saved), switched on and off at runtime.
+
+Stages are timed by the stage context manager (or the profiled decorator) and events are counted by count.
+When profiling is disabled they cost about a microsecond. When it is enabled, each stage records its calls, total
+and longest time, and optionally the high-water mark of the memory allocated while it runs (tracemalloc).
+The memory of each stage needs tracemalloc.reset_peak (Python >= 3.9): with older versions only the peak of
+the session is traced, the memory of the stages is reported as not available.
+The events of the session can be exported as a trace file (Chrome trace format, opened by chrome://tracing
+or https://ui.perfetto.dev). Profiling is enabled at startup by the IMAGEPY_PROFILE environment variable
+('memory' to trace the memory as well).
+
+'''
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+MAX_EVENTS = 200000 # events kept for the trace file, the oldest ones are dropped
+STAGE_PEAKS = hasattr(tracemalloc, 'reset_peak') # memory peak of each stage can be traced (python >= 3.9)
+
+
+class Profiler():
+    """
+    Class that collects the timers, counters and trace events of a profiling session.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.memory = False # trace the memory allocated by each stage
+        self.listeners = [] # functions called when a stage ends, outside of any other stage
+        self.lock = threading.Lock()
+        self.local = threading.local() # stages running in each thread
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the statistics and the events of the session.
+        """
+        with self.lock:
+            self.stats = dict() # { stage : [calls, total time [s], longest time [s], memory peak [bytes] or None] }
+            self.counters = dict() # { counter : value }
+            self.events = [] # trace events (see export_trace)
+            self.dropped = 0
+            self.origin = time.perf_counter()
+
+    def enable(self, memory=False):
+        """
+        Start profiling.
+        :param memory: also trace the memory allocated by each stage (slower)
+        """
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.memory = memory
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stop profiling, the statistics of the session are kept.
+        """
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    def add_event(self, event):
+        if len(self.events) >= MAX_EVENTS:
+            del self.events[:MAX_EVENTS // 10]
+            self.dropped += MAX_EVENTS // 10
+        self.events.append(event)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the analysis (context manager), stages can be nested.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        memory = self.memory and STAGE_PEAKS and tracemalloc.is_tracing()
+        if memory:
+            # peak of the stage: reset the peak, the peak of the enclosing stage is kept in the stack
+            current, peak = tracemalloc.get_traced_memory()
+            if len(stack) > 0:
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        entry = [name, 0]
+        stack.append(entry)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            peak = None
+            if memory and tracemalloc.is_tracing():
+                peak = max(tracemalloc.get_traced_memory()[1], entry[1])
+                if len(stack) > 0:
+                    stack[-1][1] = max(stack[-1][1], peak)
+                peak -= current
+
+            with self.lock:
+                stats = self.stats.setdefault(name, [0, 0., 0., None])
+                stats[0] += 1
+                stats[1] += duration
+                stats[2] = max(stats[2], duration)
+                if peak is not None:
+                    stats[3] = max(stats[3] or 0, peak)
+
+                event = {'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                         'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6}
+                if peak is not None:
+                    event['args'] = {'memory-peak': peak}
+                self.add_event(event)
+
+            if len(stack) == 0:
+                for listener in self.listeners:
+                    listener(self)
+
+    def count(self, name, value=1):
+        """
+        Increase a counter of the analysis (e.g. cells saved).
+        """
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+            self.add_event({'name': name, 'ph': 'C', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                            'ts': (time.perf_counter() - self.origin) * 1e6, 'args': {name: self.counters[name]}})
+
+    def summary(self):
+        """
+        Statistics of the stages, from the longest total time.
+        :return: list of (stage, calls, total time [s], mean time [s], longest time [s], memory peak [bytes]),
+        memory peak is None if not traced (see STAGE_PEAKS)
+        """
+        with self.lock:
+            rows = [(name, calls, total, total / calls, longest, peak)
+                    for name, (calls, total, longest, peak) in self.stats.items()]
+
+        return sorted(rows, key=lambda row: -row[2])
+
+    def summary_text(self, stages=4):
+        """
+        Short summary of the longest stages (e.g. for a status bar).
+        """
+        summary = self.summary()
+        parts = ['{} {:.2f} s ({}x)'.format(name, total, calls) for name, calls, total, _, _, _ in summary[:stages]]
+        peaks = [row[5] for row in summary if row[5] is not None]
+        if self.memory and len(peaks) > 0:
+            parts.append('memory peak {:.1f} MB'.format(max(peaks) / 2 ** 20))
+        elif self.memory and tracemalloc.is_tracing():
+            parts.append('memory peak {:.1f} MB (session)'.format(tracemalloc.get_traced_memory()[1] / 2 ** 20))
+
+        return ' | '.join(parts)
+
+    def print_summary(self):
+        """
+        Print the statistics of the stages and the counters.
+        """
+        print('\n---- PROFILING ---')
+        print('{:<32}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('stage', 'calls', 'total [s]', 'mean [s]', 'max [s]',
+                                                          'peak [MB]'))
+        for name, calls, total, mean, longest, peak in self.summary():
+            print('{:<32}{:>8}{:>12.4f}{:>12.4f}{:>12.4f}{:>12}'.format(name, calls, total, mean, longest,
+                                                                         'n/a' if peak is None else
+                                                                         '{:.1f}'.format(peak / 2 ** 20)))
+        if self.memory and not STAGE_PEAKS:
+            print('Memory of the stages not available (Python < 3.9), traced memory peak of the session: '
+                  '{:.1f} MB'.format(tracemalloc.get_traced_memory()[1] / 2 ** 20))
+        for name, value in sorted(self.counters.items()):
+            print('{:<32}{:>8}'.format(name, value))
+        rss = max_resident_memory()
+        if rss is not None:
+            print('\nProcess memory high-water mark: {:.1f} MB'.format(rss / 2 ** 20))
+
+    def export_trace(self, path):
+        """
+        Write the events of the session to a trace file (Chrome trace format).
+        """
+        with self.lock:
+            events = list(self.events)
+            metadata = {'counters': dict(self.counters), 'dropped-events': self.dropped,
+                        'max-resident-memory': max_resident_memory()}
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': metadata}, f)
+
+def max_resident_memory():
+    """
+    High-water mark of the memory of the process [bytes], None if unknown.
+    """
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+# profiler of the session, shared by all the modules
+PROFILER = Profiler()
+
+if os.environ.get('IMAGEPY_PROFILE'):
+    PROFILER.enable(memory=os.environ['IMAGEPY_PROFILE'] == 'memory')
+
+def stage(name):
+    """
+    Time a stage of the analysis with the profiler of the session (see Profiler.stage).
+    """
+    return PROFILER.stage(name)
+
+def count(name, value=1):
+    """
+    Increase a counter of the profiler of the session (see Profiler.count).
+    """
+    PROFILER.count(name, value)
+
+def profiled(name):
+    """
+    Decorator timing every call of a function as a stage of the analysis.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with PROFILER.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,358 @@
+'''
+
+Module to save and load analysis projects.
+
+A project file is a zip archive that stores a reference to the source image (path, size and
+content hash) instead of the image data, and the analysis results as compressed arrays:
+    project.json        format version, image reference and project tables
+    connections.npz     cell connections table, one array per column
+    cells/<id>.rec      contour, mask and skeleton of each cell (see cellrecord module)
+    volumes/<id>.npz    3D skeletons (see volumeprocessing module)
+Full frame boolean images (e.g. cell masks) are cropped to their bounding box and bit-packed.
+Project files with format version 1 store cells as compressed numpy archives (cells/<id>.npz).
+The manifest also contains an index of the cells (z-frame, color, area, number of protusions), so that
+a project can be opened reading only the manifest: cell data are loaded when first used (see LazyCellStore).
+Loaded cells are released, least recently used first, when the memory exceeds the budget (see memory module).
+
+'''
+
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from collections.abc import MutableMapping
+import numpy as np
+import pandas as pd
+import imagepy.cellrecord as cr
+import imagepy.memory as mem
+
+FORMAT_VERSION = 2
+PROJECT_EXTENSION = '.ipj'
+
+
+class LazyCellStore(MutableMapping):
+    """
+    Dictionary of the cell shape objects of a project file { Cell # : cell object }.
+    Cells are read from the project file when first accessed, the cell index is available without loading them.
+    Cells not modified since they were loaded can be released (see release), they are read again when needed:
+    cells must be modified by assigning them (store[cellid] = cell), not in place.
+    """
+
+    def __init__(self, path, index, version=FORMAT_VERSION, accountant=mem.ACCOUNTANT):
+        """
+        :param path: project file
+        :param index: cell index of the project manifest { Cell # : index entry } (see cell_index_entry)
+        :param version: format version of the project file
+        :param accountant: memory accountant enforcing the budget when cells are loaded (see memory module)
+        """
+        self.path = path
+        self.index = index
+        self.version = version
+        self.accountant = accountant
+        self.loaded = OrderedDict() # cells in memory, from the least recently used
+        self.sizes = dict() # bytes of the cells in memory { Cell # : bytes }
+        self.modified = set() # cells added or modified, not stored in the project file
+        self.lock = threading.Lock()
+
+    def __getitem__(self, cellid):
+        if cellid not in self.index:
+            raise KeyError(cellid)
+
+        with self.lock:
+            if cellid in self.loaded:
+                self.loaded.move_to_end(cellid)
+                return self.loaded[cellid]
+
+            cell = unpack_cell(self.raw(cellid))
+            self.loaded[cellid] = cell
+            self.sizes[cellid] = mem.nbytes(cell)
+
+        if self.accountant is not None:
+            self.accountant.enforce()
+
+        return cell
+
+    def __setitem__(self, cellid, cell):
+        with self.lock:
+            self.loaded[cellid] = cell
+            self.loaded.move_to_end(cellid)
+            self.sizes[cellid] = mem.nbytes(cell)
+            self.modified.add(cellid)
+            self.index[cellid] = cell_index_entry(cell)
+
+    def __delitem__(self, cellid):
+        with self.lock:
+            del self.index[cellid]
+            self.loaded.pop(cellid, None)
+            self.sizes.pop(cellid, None)
+            self.modified.discard(cellid)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def raw(self, cellid, archive=None):
+        """
+        Serialized data of a cell, as stored in the project file.
+        :param archive: project file already open, to read many cells
+        """
+        if archive is not None:
+            return archive.read(cell_entry(cellid, self.version))
+
+        with zipfile.ZipFile(self.path, 'r') as archive:
+            return archive.read(cell_entry(cellid, self.version))
+
+    def summary(self, cellid):
+        """
+        Index entry of a cell, read without loading the cell data (see cell_index_entry).
+        """
+        return self.index[cellid]
+
+    def nbytes(self):
+        """
+        Memory of the cells loaded, in bytes.
+        """
+        return sum(self.sizes.values())
+
+    def release(self, size):
+        """
+        Remove from memory the least recently used cells that are stored in the project file,
+        until at least size bytes are released.
+        :return: bytes released
+        """
+        released = 0
+        with self.lock:
+            for cellid in [c for c in self.loaded if c not in self.modified]:
+                if released >= size:
+                    break
+                del self.loaded[cellid]
+                released += self.sizes.pop(cellid)
+
+        return released
+
+
+def cell_entry(cellid, version=FORMAT_VERSION):
+    """
+    Name of the archive entry of a cell in a project file.
+    """
+    if version == 1:
+        return 'cells/' + cellid + '.npz'
+
+    return 'cells/' + cellid + '.rec'
+
+def cell_index_entry(cell):
+    """
+    Lightweight description of a cell shape object: z-frame, color, area and number of protusions.
+    """
+    try:
+        nprotusions = int(max(cell.skelprot['protusion_id']))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        nprotusions = 0
+
+    return {'zframe': int(cell.zframe),
+            'color': [float(c) for c in cell.contour['color']],
+            'area': float(cell.contour['area']),
+            'protusions': nprotusions}
+
+def cell_summary(shapecells, cellid):
+    """
+    Index entry of a cell (see cell_index_entry), without loading the cell data if shapecells is a LazyCellStore.
+    """
+    if isinstance(shapecells, LazyCellStore) and cellid not in shapecells.loaded:
+        return shapecells.summary(cellid)
+
+    return cell_index_entry(shapecells[cellid])
+
+def file_sha256(path, blocksize=2 ** 20):
+    """
+    Content hash of a file, read in blocks so that memory does not depend on the file size.
+    """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+def image_reference(imgfile):
+    """
+    Reference to the source image of a project: path, size and content hash.
+    The hash is computed once and stored in imgfile, as long as the file is not modified.
+    """
+    path = os.path.abspath(imgfile.path)
+    stat = os.stat(path)
+
+    reference = getattr(imgfile, 'reference', None)
+    if reference is None or reference['size'] != stat.st_size or reference['mtime'] != stat.st_mtime:
+        reference = {'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': file_sha256(path)}
+        imgfile.reference = reference
+
+    return dict(reference, path=path)
+
+def check_image_reference(reference, path):
+    """
+    Check if the image file in path is the source image of a project.
+    """
+    if os.path.getsize(path) != reference['size']:
+        return False
+
+    return file_sha256(path) == reference['sha256']
+
+def arrays_to_bytes(arrays):
+    """
+    Serialize a dictionary of arrays in the compressed numpy format (.npz).
+    """
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+
+    return buffer.getvalue()
+
+def bytes_to_arrays(data):
+    """
+    Deserialize a dictionary of arrays written by arrays_to_bytes.
+    """
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        return {name: npz[name] for name in npz.files}
+
+def table_to_bytes(table):
+    """
+    Serialize a table of numbers (e.g. cell connections), one array per column.
+    Columns of python objects (e.g. empty tables) are stored as numbers.
+    """
+    arrays = dict()
+    for i, c in enumerate(table.columns):
+        values = table[c].values
+        if values.dtype == object:
+            values = np.array(values.tolist(), dtype=np.int64 if len(values) == 0 else None)
+        arrays['c' + str(i)] = values
+
+    return arrays_to_bytes(arrays)
+
+def bytes_to_table(data, columns):
+    """
+    Deserialize a table written by table_to_bytes.
+    """
+    arrays = bytes_to_arrays(data)
+
+    return pd.DataFrame({c: arrays['c' + str(i)] for i, c in enumerate(columns)}, columns=columns)
+
+def pack_cell(cell):
+    """
+    Serialize a cell shape object (see cellrecord module).
+    """
+    return cr.encode_cell(cell)
+
+def unpack_cell(data):
+    """
+    Deserialize a cell shape object written by pack_cell (or by older versions).
+    """
+    return cr.decode_cell(data)
+
+def cells_nbytes(shapecells):
+    """
+    Memory of the cells in memory, in bytes (only the cells loaded if shapecells is a LazyCellStore).
+    """
+    if isinstance(shapecells, LazyCellStore):
+        return shapecells.nbytes()
+
+    return sum(mem.nbytes(cell) for cell in shapecells.values())
+
+def release_cells(shapecells, size):
+    """
+    Release cells from memory (see LazyCellStore.release), only cells of project files can be released.
+    :return: bytes released
+    """
+    if isinstance(shapecells, LazyCellStore):
+        return shapecells.release(size)
+
+    return 0
+
+def save_project(path, imgfile, shapecells, cell_zframes, connections, volumecells=None):
+    """
+    Save the analysis results of an image to a project file.
+    :return: cells of the project file (see LazyCellStore), holding the cells in memory: it can replace shapecells,
+    so that cells can be released from memory
+    """
+    manifest = {'format-version': FORMAT_VERSION,
+                'image': image_reference(imgfile),
+                'cells': sorted(shapecells.keys(), key=int),
+                'cell-index': {cellid: cell_summary(shapecells, cellid) for cellid in shapecells.keys()},
+                'cell_zframes': {z: [int(i) for i in ids] for z, ids in cell_zframes.items()},
+                'connections-columns': list(connections.columns),
+                'volumes': sorted((volumecells or dict()).keys(), key=int)}
+
+    # cells never loaded are copied from the previous project file
+    source = None
+    if isinstance(shapecells, LazyCellStore):
+        source = zipfile.ZipFile(shapecells.path, 'r')
+
+    tmppath = path + '.tmp'
+    with zipfile.ZipFile(tmppath, 'w', compression=zipfile.ZIP_STORED) as archive:
+        archive.writestr('project.json', json.dumps(manifest, indent=1))
+
+        archive.writestr('connections.npz', table_to_bytes(connections))
+
+        for cellid in manifest['cells']:
+            if source is not None and cellid not in shapecells.loaded:
+                # cell records of older versions are migrated when loaded (see cellrecord module)
+                archive.writestr(cell_entry(cellid), shapecells.raw(cellid, source))
+            else:
+                archive.writestr(cell_entry(cellid), pack_cell(shapecells[cellid]))
+
+        for volumeid in manifest['volumes']:
+            arrays = dict()
+            cr.pack_value('volume', volumecells[volumeid], arrays)
+            archive.writestr('volumes/' + volumeid + '.npz', arrays_to_bytes(arrays))
+
+    if source is not None:
+        source.close()
+
+    # replace the previous file only when the new one is complete
+    os.replace(tmppath, path)
+
+    store = LazyCellStore(os.path.abspath(path), manifest['cell-index'])
+    if isinstance(shapecells, LazyCellStore):
+        store.loaded.update(shapecells.loaded)
+        store.sizes.update(shapecells.sizes)
+    else:
+        for cellid, cell in shapecells.items():
+            store.loaded[cellid] = cell
+            store.sizes[cellid] = mem.nbytes(cell)
+
+    return store
+
+def load_project(path, lazy=True):
+    """
+    Load the analysis results stored in a project file.
+    The source image is not loaded: its reference is returned in the 'image' entry.
+    :param lazy: if True, cells are loaded when first used (see LazyCellStore)
+    :return: dictionary with the same entries of the pickle projects (except for the image file)
+    """
+    with zipfile.ZipFile(path, 'r') as archive:
+        manifest = json.loads(archive.read('project.json').decode('utf-8'))
+        if manifest['format-version'] > FORMAT_VERSION:
+            raise ValueError('Project file created by a newer version of the software.')
+
+        connections = bytes_to_table(archive.read('connections.npz'), manifest['connections-columns'])
+
+        if lazy and 'cell-index' in manifest:  # no cell index in older project files
+            shapecells = LazyCellStore(os.path.abspath(path),
+                                       {cellid: manifest['cell-index'][cellid] for cellid in manifest['cells']},
+                                       manifest['format-version'])
+        else:
+            shapecells = {cellid: unpack_cell(archive.read(cell_entry(cellid, manifest['format-version'])))
+                          for cellid in manifest['cells']}
+
+        volumecells = {volumeid: cr.unpack_values(bytes_to_arrays(archive.read('volumes/' + volumeid + '.npz')))['volume']
+                       for volumeid in manifest['volumes']}
+
+    return dict(image=manifest['image'],
+                shapecells=shapecells,
+                cell_zframes=manifest['cell_zframes'],
+                connections=connections,
+                volumecells=volumecells)
@@ -0,0 +1,139 @@
+'''
+
+Module to propagate a cell contour traced on one z-frame to the neighbouring z-frames.
+
+The contour is refined on each z-frame starting from the contour of the previous one (warm start):
+each vertex moves along the contour normal towards the lowest edge cost (see livewire module),
+then the displacements are smoothed along the contour. Frames above and below the traced one
+are processed by two independent chains in a pool of worker threads.
+
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import ndimage
+import imagepy.livewire as lw
+
+# default parameters of the contour refinement
+PROPAGATION_PARAMETERS = {'step': 2.0,  # distance between the contour vertices [pixel]
+                          'search': 6,  # maximum displacement of a vertex along its normal at each iteration [pixel]
+                          'smoothing': 5,  # number of vertices averaged when smoothing the displacements
+                          'iterations': 3,  # refinement iterations on each z-frame
+                          'max_cost': 0.85,  # mean edge cost above which the cell is considered lost
+                          'min_area': 0.25,  # minimum area, relative to the traced contour, to keep propagating
+                          }
+
+
+def polygon_area(xdata, ydata):
+    """
+    Area of a polygon (shoelace formula) [pixel^2].
+    """
+    return 0.5 * np.abs(np.dot(xdata, np.roll(ydata, 1)) - np.dot(ydata, np.roll(xdata, 1)))
+
+def resample_contour(xdata, ydata, step=2.0):
+    """
+    Resample a closed contour with vertices equally spaced along its perimeter.
+    :return: (n, 2) array of (x, y) vertices
+    """
+    points = np.column_stack([xdata, ydata]).astype(float)
+    closed = np.vstack([points, points[:1]])
+    arclength = np.concatenate([[0], np.cumsum(np.hypot(*np.diff(closed, axis=0).T))])
+
+    npoints = max(int(arclength[-1] / step), 8)
+    samples = np.linspace(0, arclength[-1], npoints, endpoint=False)
+
+    return np.column_stack([np.interp(samples, arclength, closed[:, 0]),
+                            np.interp(samples, arclength, closed[:, 1])])
+
+def refine_contour(costmap, points, search=6, smoothing=5, iterations=3):
+    """
+    Move the vertices of a closed contour towards the edges of the cost map.
+    All the vertices are updated at once: the cost is sampled along the normal of each
+    vertex and the position of minimum cost is selected.
+    :param points: (n, 2) array of (x, y) vertices
+    :return: refined (n, 2) array of vertices and mean edge cost along the contour
+    """
+    offsets = np.arange(-search, search + 1, dtype=float)
+    kernel = np.ones(smoothing) / smoothing
+
+    for _ in range(iterations):
+        # normal of each vertex from its neighbours (central differences on the closed contour)
+        tangent = np.roll(points, -1, axis=0) - np.roll(points, 1, axis=0)
+        normal = np.column_stack([tangent[:, 1], -tangent[:, 0]])
+        normal /= np.maximum(np.hypot(normal[:, 0], normal[:, 1]), 1e-9)[:, None]
+
+        # cost sampled along the normals: (vertices, offsets) array
+        candidates = points[:, None, :] + offsets[None, :, None] * normal[:, None, :]
+        cost = ndimage.map_coordinates(costmap, [candidates[..., 1].ravel(), candidates[..., 0].ravel()],
+                                       order=1, mode='nearest').reshape(candidates.shape[:2])
+        # small penalty on large displacements, to keep the warm start when edges are weak
+        cost += 0.01 * np.abs(offsets)[None, :] / search
+        displacement = offsets[cost.argmin(axis=1)]
+
+        # circular smoothing of the displacements along the contour
+        padded = np.concatenate([displacement[-smoothing:], displacement, displacement[:smoothing]])
+        displacement = np.convolve(padded, kernel, mode='same')[smoothing:-smoothing]
+
+        points = points + displacement[:, None] * normal
+
+    meancost = ndimage.map_coordinates(costmap, [points[:, 1], points[:, 0]], order=1, mode='nearest').mean()
+
+    return points, meancost
+
+def propagate_chain(costmaps, xdata, ydata, parameters):
+    """
+    Propagate a contour through a sequence of z-frames, each one warm started from the previous result.
+    The propagation stops when the cell is lost (weak edges or collapsed contour).
+    :param costmaps: list of (z-frame, function returning the edge cost map of the z-frame)
+    :return: dictionary { z-frame : (xdata, ydata) }
+    """
+    param = dict(PROPAGATION_PARAMETERS, **parameters)
+
+    points = resample_contour(xdata, ydata, param['step'])
+    initial_area = polygon_area(points[:, 0], points[:, 1])
+
+    contours = dict()
+    for zframe, costmap in costmaps:
+        points, meancost = refine_contour(costmap(), points, param['search'], param['smoothing'],
+                                          param['iterations'])
+        area = polygon_area(points[:, 0], points[:, 1])
+        if meancost > param['max_cost'] or area < param['min_area'] * initial_area:
+            break
+
+        contours[zframe] = (points[:, 0].tolist(), points[:, 1].tolist())
+        # keep vertices equally spaced for the next z-frame
+        points = resample_contour(points[:, 0], points[:, 1], param['step'])
+
+    return contours
+
+def propagate_contour(framecache, imgfile, xdata, ydata, zframe, nframes, workers=None, **parameters):
+    """
+    Propagate a contour traced on zframe to the nframes z-frames above and below it.
+    Edge cost maps are read from (and stored in) the frame cache shared with the manual selection tool.
+    :param workers: number of threads, all the available cores if None
+    :return: dictionary { z-frame : (xdata, ydata) }, the traced z-frame is not included
+    """
+    if workers is None:
+        workers = max(os.cpu_count() or 1, 2)
+
+    nz = imgfile.shape[2]
+    above = range(zframe + 1, min(zframe + nframes, nz - 1) + 1)
+    below = range(zframe - 1, max(zframe - nframes, 0) - 1, -1)
+
+    def costmap_getter(z):
+        return lambda: lw.cached_edge_cost_map(framecache, imgfile, z)
+
+    # cost maps of all the z-frames are kept until both chains are done
+    with framecache.reserve(len(above) + len(below) + 1), ThreadPoolExecutor(max_workers=workers) as pool:
+        # cost maps are computed in parallel, then each chain reads them from the cache
+        for z in list(above) + list(below):
+            pool.submit(costmap_getter(z))
+        chains = [pool.submit(propagate_chain, [(z, costmap_getter(z)) for z in frames], xdata, ydata, parameters)
+                  for frames in (above, below)]
+
+        contours = dict()
+        for chain in chains:
+            contours.update(chain.result())
+
+    return contours
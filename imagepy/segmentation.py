@@ -0,0 +1,135 @@
+'''
+
+Module to automatically segment the cells of a microscope image (single z-frame or whole stack).
+
+The segmentation pipeline is: denoising (gaussian filter), thresholding (Otsu or adaptive),
+morphological clean up and watershed splitting of touching cells. Each segmented region is
+converted to a polygonal contour, the same format saved by the manual selection tool.
+
+'''
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import ndimage
+from skimage import filters
+from skimage.feature import peak_local_max
+from skimage.measure import find_contours, approximate_polygon
+from skimage.morphology import binary_opening, binary_closing, disk, remove_small_objects
+try:
+    from skimage.segmentation import watershed
+except ImportError:  # scikit-image < 0.17
+    from skimage.morphology import watershed
+
+# default parameters of the segmentation pipeline
+SEGMENTATION_PARAMETERS = {'method': 'otsu',  # 'otsu' (global) or 'adaptive' (local) threshold
+                           'sigma': 2,  # standard deviation of the gaussian filter [pixel]
+                           'block_size': 51,  # neighbourhood size of the adaptive threshold [pixel]
+                           'offset': 0,  # constant subtracted from the adaptive threshold
+                           'smoothing_radius': 2,  # radius of the opening/closing disk [pixel]
+                           'min_size': 200,  # smallest region kept [pixel]
+                           'min_distance': 20,  # minimum distance between two cell centres [pixel]
+                           'min_radius': 5,  # minimum radius of a cell body, thinner regions are protusions [pixel]
+                           'tolerance': 1.0,  # maximum distance between the contour and its polygon [pixel]
+                           }
+
+
+def threshold_plane(image, method='otsu', sigma=2, block_size=51, offset=0):
+    """
+    Denoise a 2D image with a gaussian filter and threshold it.
+    :return: boolean mask of the foreground
+    """
+    smoothed = filters.gaussian(image.astype(float), sigma=sigma, preserve_range=True)
+
+    if method == 'adaptive':
+        return smoothed > filters.threshold_local(smoothed, block_size, offset=offset)
+
+    return smoothed > filters.threshold_otsu(smoothed)
+
+def clean_mask(mask, smoothing_radius=2, min_size=200):
+    """
+    Morphological clean up of a thresholded mask: opening and closing, holes filling and small regions removal.
+    """
+    selem = disk(smoothing_radius)
+    mask = binary_closing(binary_opening(mask, selem), selem)
+    mask = ndimage.binary_fill_holes(mask)
+
+    return remove_small_objects(mask, min_size=min_size)
+
+def split_cells(mask, min_distance=20, min_radius=5):
+    """
+    Split touching cells with a watershed on the distance transform of the mask.
+    Markers are the local maxima of the distance transform, i.e. the centres of the cell bodies.
+    Maxima closer than min_radius to the background lie on protusions and are discarded.
+    :return: labeled image, 0 is the background
+    """
+    distance = ndimage.distance_transform_edt(mask)
+    regions, nregions = ndimage.label(mask)
+
+    peaks = peak_local_max(distance, min_distance=min_distance, threshold_abs=min_radius,
+                           labels=regions, exclude_border=False)
+    markers = np.zeros(mask.shape, dtype=np.int32)
+    markers[tuple(np.transpose(peaks))] = np.arange(1, len(peaks) + 1)
+
+    # regions without any peak (e.g. thin fragments) are kept as a single cell
+    missing = np.setdiff1d(np.arange(1, nregions + 1), regions[tuple(np.transpose(peaks))])
+    if missing.size > 0:
+        positions = ndimage.maximum_position(distance, regions, missing)
+        markers[tuple(np.transpose(positions))] = np.arange(len(peaks) + 1, len(peaks) + missing.size + 1)
+
+    return watershed(-distance, markers, mask=mask)
+
+def segment_plane(image, **parameters):
+    """
+    Full segmentation pipeline of a 2D image (see SEGMENTATION_PARAMETERS for the options).
+    :return: labeled image, 0 is the background
+    """
+    param = dict(SEGMENTATION_PARAMETERS, **parameters)
+
+    mask = threshold_plane(image, param['method'], param['sigma'], param['block_size'], param['offset'])
+    mask = clean_mask(mask, param['smoothing_radius'], param['min_size'])
+
+    if not mask.any():
+        return np.zeros(mask.shape, dtype=np.int32)
+
+    return split_cells(mask, param['min_distance'], param['min_radius'])
+
+def region_contours(labeled, offset=(0, 0), tolerance=1.0):
+    """
+    Convert each region of a labeled image to a polygonal contour.
+    :param offset: (row, column) position of the labeled image in the full frame (e.g. ROI origin)
+    :return: list of (xdata, ydata) lists of vertices, in full frame coordinates
+    """
+    contours = []
+    for region, bbox in enumerate(ndimage.find_objects(labeled)):
+        if bbox is None:
+            continue
+        # pad the region so that contours are always closed
+        regionmask = np.pad(labeled[bbox] == region + 1, 1, mode='constant')
+        outline = max(find_contours(regionmask.astype(float), 0.5), key=len)
+        outline = approximate_polygon(outline, tolerance=tolerance)[:-1]
+        if len(outline) < 3:
+            continue
+
+        ydata = outline[:, 0] + bbox[0].start + offset[0] - 1
+        xdata = outline[:, 1] + bbox[1].start + offset[1] - 1
+        contours.append((xdata.tolist(), ydata.tolist()))
+
+    return contours
+
+def segment_stack(planes, workers=None, **parameters):
+    """
+    Segment several 2D images in parallel, one task per image.
+    numpy, scipy and scikit-image release the GIL in their heavy loops, so a pool of threads
+    avoids copying the frames to other processes.
+    :param planes: dictionary { z-frame : 2D image }
+    :param workers: number of threads, all the available cores if None
+    :return: dictionary { z-frame : labeled image }
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {zframe: pool.submit(segment_plane, image, **parameters) for zframe, image in planes.items()}
+
+        return {zframe: future.result() for zframe, future in futures.items()}
@@ -0,0 +1,426 @@
+'''
+
+Module to represent the skeleton of a cell as a graph, built once and queried by the display, the summary and
+the exported tables.
+
+The skeletonization (see skeletonprocessing module) stores the skeleton of a cell in two dictionaries of lists:
+skelbody (paths of the cell body) and skelprot (primary and secondary paths of each protusion).
+SkeletonGraph packs the paths in a few arrays:
+    coords          pixel coordinates (row, column) of all the paths, one after the other
+    offsets         start of each path in coords (the last entry is the number of pixels)
+    path_protusion  protusion id of each path, 0 for the cell body
+    path_rank       RANK_BODY, RANK_PRIMARY or RANK_SECONDARY
+    path_number     number of the path in its protusion: 0 for the primary path, 1, 2, ... for the secondary paths
+    path_length     physical length along the pixels of each path
+    path_euclidean  physical distance between the end pixels of each path
+The topology of the protusions is built from the graph of the protusion pixels the first time it is queried:
+nodes are the end points, the branch points and the roots (pixels next to the cell body), edges are the chains
+of pixels between two nodes. The graph of the pixels is built here (see pixel_graph) rather than by skan, whose
+versions handle the pixels around a branch point differently (e.g. skan 0.7 merges them in one node at their
+centroid), so that each branch point is one pixel node with any version. Queries (e.g. branch order, tortuosity, total length, line segments to display,
+morphology metrics of each protusion) are computed once and cached. The graph of a cell is kept with the cell until its skeleton changes (see cell_graph).
+
+'''
+
+import numpy as np
+from matplotlib.collections import LineCollection
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from imagepy.skeletonprocessing import path_lengths
+
+RANK_BODY = 0
+RANK_PRIMARY = 1
+RANK_SECONDARY = 2
+
+# colors of the paths displayed, drawn in this order (primary paths over the secondary paths they overlap)
+DISPLAY_COLORS = ((RANK_BODY, '#ff0000'), (RANK_SECONDARY, '#ffffff'), (RANK_PRIMARY, '#ffff00'))
+
+
+def pixel_graph(image, spacing):
+    """
+    Graph of the pixels of a skeleton image, as skan's csgraph: each pixel is joined to its 8 neighbours, weights
+    are the physical distances between the pixels. Diagonal steps between two pixels that are also joined through
+    their common 4-connected neighbour (e.g. around a branch point) are left out, so that the pixels of a junction
+    are not joined to each other in a loop.
+    :return: CSR graph and (row, column) of each pixel id, ids from 1 (as skan, id 0 is not a pixel)
+    """
+    points = np.argwhere(image).astype(np.int32)
+    pixelcoords = np.concatenate([np.zeros((1, 2), dtype=np.int32), points])
+    ids = np.zeros(image.shape, dtype=int)
+    ids[tuple(points.T)] = np.arange(1, len(pixelcoords))
+
+    first, last, weights = [], [], []
+    for step in ((0, 1), (1, 0), (1, 1), (1, -1)):
+        neighbours = points + step
+        inbounds = np.all((neighbours >= 0) & (neighbours < image.shape), axis=1)
+        joined = np.zeros(len(points), dtype=bool)
+        joined[inbounds] = image[tuple(neighbours[inbounds].T)]
+        if step[0] != 0 and step[1] != 0:
+            corner = image[points[inbounds, 0], neighbours[inbounds, 1]] | \
+                     image[neighbours[inbounds, 0], points[inbounds, 1]]
+            joined[inbounds] &= ~corner
+        first.append(np.flatnonzero(joined) + 1)
+        last.append(ids[tuple(neighbours[joined].T)])
+        weights.append(np.full(np.count_nonzero(joined), np.sqrt(np.sum((np.array(step) * spacing) ** 2))))
+
+    first, last, weights = np.concatenate(first), np.concatenate(last), np.concatenate(weights)
+    graph = sparse.coo_matrix((np.concatenate([weights, weights]),
+                               (np.concatenate([first, last]), np.concatenate([last, first]))),
+                              shape=(len(pixelcoords), len(pixelcoords))).tocsr()
+
+    return graph, pixelcoords
+
+
+class SkeletonGraph():
+    """
+    Class that stores the skeleton of a cell as packed arrays and answers queries about its topology and lengths.
+    """
+
+    def __init__(self, skelbody, skelprot):
+        """
+        :param skelbody: cell body skeleton dictionary (see skeletonprocessing.cellbody_skeletonization)
+        :param skelprot: protusions skeleton dictionary (see skeletonprocessing.branch_parameters_extration)
+        """
+        self.source = (skelbody, skelprot) # skeleton dictionaries of the graph, see cell_graph
+        self.spacing = np.ones(2) * skelprot.get('physical-space', 1)
+
+        # paths in the order of the skeleton dictionaries: cell body, then primary and secondary paths of each protusion
+        paths = list(skelbody['paths'])
+        labels = [(0, RANK_BODY, n) for n in range(len(paths))]
+        for protid, (primary, secondary) in enumerate(zip(skelprot['primary-path'], skelprot['secondary-paths']),
+                                                      start=1):
+            paths += [primary] + list(secondary)
+            labels += [(protid, RANK_PRIMARY, 0)] + [(protid, RANK_SECONDARY, n + 1) for n in range(len(secondary))]
+
+        npoints = [len(path) for path in paths]
+        self.offsets = np.cumsum([0] + npoints)
+        if len(paths) > 0:
+            self.coords = np.concatenate([np.asarray(path, dtype=np.int32).reshape(-1, 2) for path in paths])
+        else:
+            self.coords = np.zeros((0, 2), dtype=np.int32)
+        labels = np.array(labels, dtype=np.int32).reshape(-1, 3)
+        self.path_protusion = labels[:, 0]
+        self.path_rank = labels[:, 1]
+        self.path_number = labels[:, 2]
+
+        # length along the pixels: differences of the cumulative length of the steps between consecutive pixels
+        steps = np.sqrt(np.sum((np.diff(self.coords, axis=0) * self.spacing) ** 2, axis=1))
+        cumulative = np.concatenate([[0.], np.cumsum(steps)])
+        ends = np.maximum(self.offsets[1:] - 1, self.offsets[:-1])
+        self.path_length = cumulative[ends] - cumulative[self.offsets[:-1]] if len(paths) > 0 else np.empty(0)
+        self.path_euclidean = path_lengths(paths, self.spacing)
+
+        self.cache = dict() # results of the queries { query : value }
+
+    def cached(self, query, compute):
+        """
+        Result of a query, computed the first time.
+        """
+        if query not in self.cache:
+            self.cache[query] = compute()
+
+        return self.cache[query]
+
+    def path(self, index):
+        """
+        Pixel coordinates of a path (a view of the packed coordinates).
+        """
+        return self.coords[self.offsets[index]:self.offsets[index + 1]]
+
+    def paths(self, rank=None, protusion=None):
+        """
+        Pixel coordinates of the paths of a rank and/or of a protusion, all the paths if None.
+        """
+        selected = np.ones(len(self.path_rank), dtype=bool)
+        if rank is not None:
+            selected &= self.path_rank == rank
+        if protusion is not None:
+            selected &= self.path_protusion == protusion
+
+        return [self.path(index) for index in np.flatnonzero(selected)]
+
+    def protusion_ids(self):
+        return np.unique(self.path_protusion[self.path_rank == RANK_PRIMARY])
+
+    def primary_paths(self):
+        """
+        Primary path of each protusion, in the order of the protusion ids.
+        """
+        return self.cached('primary-paths', lambda: self.paths(rank=RANK_PRIMARY))
+
+    def secondary_paths(self, protusion):
+        return self.paths(rank=RANK_SECONDARY, protusion=protusion)
+
+    def segments(self, rank):
+        """
+        Paths of a rank as (x, y) line segments, e.g. for a matplotlib LineCollection.
+        """
+        return self.cached(('segments', rank), lambda: [path[:, ::-1] for path in self.paths(rank=rank)])
+
+    def tortuosity(self):
+        """
+        Tortuosity of each path: length along the pixels divided by the distance between the end pixels
+        (nan for paths of one pixel).
+        """
+        def compute():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(self.path_euclidean > 0, self.path_length / self.path_euclidean, np.nan)
+
+        return self.cached('tortuosity', compute)
+
+    def body_length(self):
+        """
+        Length of the cell body skeleton, sum of the euclidean length of its paths (as skelbody['lengths']).
+        """
+        return float(self.path_euclidean[self.path_rank == RANK_BODY].sum())
+
+    def total_length(self):
+        """
+        Length along the pixels of all the protusions, each pixel chain counted once
+        (secondary paths share their first pixels with the primary path).
+        """
+        return self.cached('total-length', lambda: float(self.topology()['edge-length'].sum()))
+
+    def topology(self):
+        """
+        Nodes and edges of the protusions, built from the graph of the protusion pixels (see pixel_graph).
+        :return: dictionary of arrays:
+            node-coord      (row, column) of each node
+            node-degree     number of edges of each node
+            node-root       True for the roots of the protusions (pixels next to the cell body)
+            edge-nodes      (first node, last node) of each edge, first node is the closest to the root
+            edge-length     physical length along the pixels of each edge
+            edge-protusion  protusion id of each edge
+            edge-coords     pixel coordinates of all the edges, one after the other
+            edge-offsets    start of each edge in edge-coords
+        """
+        return self.cached('topology', self.build_topology)
+
+    def build_topology(self):
+        protusions = self.path_rank != RANK_BODY
+        roots = {int(self.path_protusion[index]): tuple(self.path(index)[0])
+                 for index in np.flatnonzero(self.path_rank == RANK_PRIMARY)}
+        topology = {'node-coord': np.zeros((0, 2), dtype=np.int32), 'node-degree': np.zeros(0, dtype=int),
+                    'node-root': np.zeros(0, dtype=bool), 'edge-nodes': np.zeros((0, 2), dtype=int),
+                    'edge-length': np.zeros(0), 'edge-protusion': np.zeros(0, dtype=int),
+                    'edge-coords': np.zeros((0, 2), dtype=np.int32), 'edge-offsets': np.zeros(1, dtype=int)}
+        if not protusions.any():
+            return topology
+
+        # image of the protusion pixels, cropped to their bounding box
+        pixels = np.concatenate([self.path(index) for index in np.flatnonzero(protusions)])
+        origin = pixels.min(axis=0)
+        image = np.zeros(tuple(pixels.max(axis=0) - origin + 1), dtype=bool)
+        image[tuple((pixels - origin).T)] = True
+
+        # graph of the pixels: ids from 1, coordinates of pixel id in pixelcoords[id]
+        graph, pixelcoords = pixel_graph(image, self.spacing)
+        pixelcoords = pixelcoords + origin
+        ids = np.zeros(image.shape, dtype=int)
+        ids[tuple((pixelcoords[1:] - origin).T)] = np.arange(1, len(pixelcoords))
+        degree = np.diff(graph.indptr)
+
+        isnode = degree != 2
+        isnode[0] = False
+        rootids = {protid: ids[tuple(np.array(root) - origin)] for protid, root in roots.items()}
+        isnode[list(rootids.values())] = True
+
+        # protusion of each pixel: connected components of the graph, named by their root
+        _, component = connected_components(graph, directed=False)
+        protusion_of = {component[pixelid]: protid for protid, pixelid in rootids.items()}
+
+        # walk the chains of pixels between the nodes
+        indptr, indices, weights = graph.indptr, graph.indices, graph.data
+        walked = set()
+        chains, lengths = [], []
+        for start in np.flatnonzero(isnode):
+            for k in range(indptr[start], indptr[start + 1]):
+                if (start, indices[k]) in walked:
+                    continue
+                chain, length = [start], weights[k]
+                previous, current = start, indices[k]
+                while not isnode[current]:
+                    chain.append(current)
+                    for j in range(indptr[current], indptr[current + 1]):
+                        if indices[j] != previous:
+                            previous, current = current, indices[j]
+                            length += weights[j]
+                            break
+                chain.append(current)
+                walked.add((chain[0], chain[1]))
+                walked.add((chain[-1], chain[-2]))
+                chains.append(chain)
+                lengths.append(length)
+
+        # edges oriented and listed from the roots (breadth first), so that each edge follows its parent edge
+        incident = dict() # { pixel id of a node : [edges] }
+        for edge, chain in enumerate(chains):
+            incident.setdefault(chain[0], []).append(edge)
+            incident.setdefault(chain[-1], []).append(edge)
+        nodeids = list(rootids.values())
+        visited, visited_edges = set(nodeids), set()
+        ordered = []
+        for node in nodeids:  # nodeids grows while visiting
+            for edge in incident.get(node, []):
+                if edge in visited_edges:
+                    continue
+                if chains[edge][0] != node:
+                    chains[edge] = chains[edge][::-1]
+                ordered.append(edge)
+                visited_edges.add(edge)
+                if chains[edge][-1] not in visited:
+                    visited.add(chains[edge][-1])
+                    nodeids.append(chains[edge][-1])
+        nodeids += [node for node in np.flatnonzero(isnode) if node not in visited]
+        ordered += [edge for edge in range(len(chains)) if edge not in visited_edges]
+
+        nodeindex = {pixelid: n for n, pixelid in enumerate(nodeids)}
+        topology['node-coord'] = pixelcoords[nodeids]
+        topology['node-degree'] = degree[nodeids]
+        topology['node-root'] = np.arange(len(nodeids)) < len(rootids)
+        if len(chains) > 0:
+            chains = [chains[edge] for edge in ordered]
+            topology['edge-nodes'] = np.array([[nodeindex[chain[0]], nodeindex[chain[-1]]] for chain in chains])
+            topology['edge-length'] = np.array([lengths[edge] for edge in ordered], dtype=float)
+            topology['edge-protusion'] = np.array([protusion_of.get(component[chain[0]], 0) for chain in chains])
+            topology['edge-coords'] = pixelcoords[np.concatenate(chains)]
+            topology['edge-offsets'] = np.cumsum([0] + [len(chain) for chain in chains])
+
+        return topology
+
+    def branch_order(self):
+        """
+        Branch order of each edge of the protusions (see topology): 1 for the edges of the primary path,
+        2 for the branches of the primary path, 3 for the branches of the branches and so on.
+        At each branch point, the branch leading to the longest subtree continues the order of the parent branch.
+        """
+        return self.cached('branch-order', self.compute_branch_order)
+
+    def compute_branch_order(self):
+        topology = self.topology()
+        edgenodes = topology['edge-nodes']
+        lengths = topology['edge-length']
+        order = np.zeros(len(edgenodes), dtype=int)
+
+        children = dict() # { node : [edges starting from the node] }
+        parent = dict() # { node : edge ending at the node }
+        for edge, (first, last) in enumerate(edgenodes):
+            children.setdefault(first, []).append(edge)
+            parent.setdefault(last, edge)
+
+        # longest path from each node to a leaf, from the last edges (edges are listed from the roots)
+        height = dict()
+        for edge in reversed(range(len(edgenodes))):
+            first, last = edgenodes[edge]
+            height[first] = max(height.get(first, 0.), lengths[edge] + height.get(last, 0.))
+
+        # edges of the primary paths, from their last pixel back to the root
+        tips = {tuple(path[-1]) for path in self.primary_paths()}
+        primary = set()
+        for node, coord in enumerate(topology['node-coord']):
+            if tuple(coord) in tips:
+                while node in parent and parent[node] not in primary:
+                    primary.add(parent[node])
+                    node = edgenodes[parent[node]][0]
+
+        for edge, (first, last) in enumerate(edgenodes):
+            if first in parent:
+                current = order[parent[first]]
+            else:
+                current = 1  # edges starting from a root
+            branches = children[first]
+            continuing = [e for e in branches if e in primary] or \
+                         [max(branches, key=lambda e: lengths[e] + height.get(edgenodes[e][1], 0.))]
+            order[edge] = current if edge == continuing[0] else current + 1
+
+        return order
+
+    def protusion_metrics(self):
+        """
+        Morphology metrics of each protusion, in one pass over the packed paths and the edges of the topology.
+        :return: dictionary of arrays, one value for each protusion (in the order of the protusion ids):
+            branches            number of branches (branch order 2 or more, see branch_order)
+            max-order           highest branch order
+            secondary-length    physical length along the pixels of the branches
+            tortuosity          tortuosity of the primary path (see tortuosity)
+            width               mean width along the primary path (see skeletonprocessing.protusion_widths),
+                                nan for skeletons computed by older versions
+            orientation         direction from the root to the end of the primary path [degrees],
+                                counterclockwise from the x axis of the image
+        """
+        return self.cached('protusion-metrics', self.compute_protusion_metrics)
+
+    def compute_protusion_metrics(self):
+        primary = np.flatnonzero(self.path_rank == RANK_PRIMARY)
+        protids = self.path_protusion[primary]
+        nprotusions = len(primary)
+
+        # direction of the primary paths, rows grow downwards in the image
+        delta = (self.coords[self.offsets[primary + 1] - 1] - self.coords[self.offsets[primary]]) * self.spacing
+        orientation = np.degrees(np.arctan2(-delta[:, 0], delta[:, 1]))
+
+        width = np.asarray(self.source[1].get('width', np.full(nprotusions, np.nan)), dtype=float)
+
+        # branches of each protusion: edges of order 2 or more, a branch starts where the order increases
+        topology = self.topology()
+        order = self.branch_order()
+        edgenodes = topology['edge-nodes']
+        index = np.searchsorted(protids, topology['edge-protusion']) # position of the protusion of each edge
+        valid = (index < nprotusions) & (order > 0)
+        valid[valid] = protids[index[valid]] == topology['edge-protusion'][valid]
+
+        parent = dict()
+        for edge, last in enumerate(edgenodes[:, 1]):
+            parent.setdefault(last, edge)
+        parentorder = np.array([order[parent[first]] if first in parent else 1 for first in edgenodes[:, 0]],
+                               dtype=int).reshape(-1)
+        branching = valid & (order >= 2)
+        starts = branching & (order > parentorder)
+
+        maxorder = np.ones(nprotusions, dtype=int)
+        np.maximum.at(maxorder, index[valid], order[valid])
+
+        return {'branches': np.bincount(index[starts], minlength=nprotusions)[:nprotusions],
+                'max-order': maxorder,
+                'secondary-length': np.bincount(index[branching], weights=topology['edge-length'][branching],
+                                                minlength=nprotusions)[:nprotusions],
+                'tortuosity': self.tortuosity()[primary],
+                'width': width,
+                'orientation': orientation}
+
+    def nbytes(self):
+        """
+        Memory of the packed arrays and of the cached queries, in bytes.
+        """
+        arrays = [self.coords, self.offsets, self.path_protusion, self.path_rank, self.path_number,
+                  self.path_length, self.path_euclidean]
+        size = sum(array.nbytes for array in arrays)
+        for value in self.cache.values():
+            values = value.values() if isinstance(value, dict) else value if isinstance(value, list) else [value]
+            size += sum(v.nbytes for v in values if isinstance(v, np.ndarray))
+
+        return size
+
+def line_collections(graph, **linekwargs):
+    """
+    Line collections displaying the paths of a skeleton graph, one for each rank (see DISPLAY_COLORS).
+    """
+    return [LineCollection(graph.segments(rank), colors=color, **linekwargs)
+            for rank, color in DISPLAY_COLORS if (graph.path_rank == rank).any()]
+
+def cell_graph(cell):
+    """
+    Skeleton graph of a cell, built the first time and kept with the cell until its skeleton dictionaries change.
+    :return: SkeletonGraph, None if the cell was not skeletonized
+    """
+    try:
+        skelbody, skelprot = cell.skelbody, cell.skelprot
+    except AttributeError:
+        return None
+
+    graph = getattr(cell, 'skeletongraph', None)
+    if graph is None or graph.source[0] is not skelbody or graph.source[1] is not skelprot:
+        graph = SkeletonGraph(skelbody, skelprot)
+        cell.skeletongraph = graph
+
+    return graph
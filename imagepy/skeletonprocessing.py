@@ -15,15 +15,69 @@ from copy import deepcopy
 from skimage.graph import route_through_array
 from skan import csr
 from scipy import ndimage
+import imagepy.profiling as prof
 
+CROP_PADDING = 2 # background pixels around the cell in the crops
 
-def path_length(pixel_path, skel_image, physicspacing):
-    "Measure the euclidian length of a pixel path (e.g. skeleton branch)"
-    prot = np.zeros(skel_image.shape)
-    prot[pixel_path[:, 0], pixel_path[:, 1]] = 1
 
-    length = csr.summarise(prot, spacing = physicspacing)['euclidean-distance'][0]
-    return length
+def pixel_spacing(dxyz, ndim=2):
+    """
+    Per-axis physical size of a pixel, ordered as the axes of the image array.
+    Metadata stores the pixel size as [X, Y, Z], while images are indexed as [row, column] (2D)
+    or [plane, row, column] (3D), so the order is reversed here.
+    Files without metadata are measured in pixel units (spacing of 1 along every axis).
+
+    :param dxyz: pixel physical size from the image metadata (see imagemanager module) or None
+    :param ndim: number of dimensions of the image array
+    :return: numpy array with one spacing value per array axis
+    """
+    spacing = np.ones(ndim, dtype=float)
+
+    if dxyz is not None:
+        dxyz = list(dxyz)[:ndim]
+        spacing[ndim - len(dxyz):] = dxyz[::-1]
+
+    return spacing
+
+def path_length(pixel_path, physicspacing=1):
+    """
+    Measure the euclidian length of a pixel path (e.g. skeleton branch), i.e. the
+    distance between its end pixels scaled by the physical size of each axis.
+    """
+    pixel_path = np.asarray(pixel_path)
+    spacing = np.ones(pixel_path.shape[1]) * physicspacing
+
+    return float(np.sqrt(np.sum(((pixel_path[-1] - pixel_path[0]) * spacing) ** 2)))
+
+def path_lengths(pixel_paths, physicspacing=1):
+    """
+    Vectorized version of path_length for a list of pixel paths.
+    :return: numpy array with the length of each path
+    """
+    if len(pixel_paths) == 0:
+        return np.empty(0)
+
+    ends = np.array([[path[0], path[-1]] for path in pixel_paths])
+    spacing = np.ones(ends.shape[2]) * physicspacing
+
+    return np.sqrt(np.sum(((ends[:, 1] - ends[:, 0]) * spacing) ** 2, axis=1))
+
+def protusion_widths(distmap, pixel_paths, physicspacing=1):
+    """
+    Mean width of protusions along their paths: twice the distance to the background (distance map of the
+    medial axis) of the path pixels, less one pixel as distances are measured between pixel centres.
+    Widths of all the paths are computed at once. They are scaled by the mean pixel physical size.
+    :return: numpy array with the width of each path
+    """
+    if len(pixel_paths) == 0:
+        return np.empty(0)
+
+    npoints = np.array([len(path) for path in pixel_paths])
+    pixels = np.concatenate(pixel_paths)
+    distances = distmap[pixels[:, 0], pixels[:, 1]]
+    sums = np.add.reduceat(distances, np.cumsum(npoints) - npoints)
+
+    return (2 * sums / npoints - 1) * np.mean(physicspacing)
 
 def automatic_cellbody_threshold(distmap):
     """The automatic algorithm to extract cell body skeleton assumes that pixels of the medial axis
@@ -75,16 +129,12 @@ def cellbody_skeletonization(distmap, threshold, maxthre, physicspacing):
     skelCellBody['endpointCoord'] = edgepoint_detect(skelCellBody['skeleton'])
 
     pathCellBody = []
-    cellBodyLengths = []
     for coord in skelCellBody['endpointCoord'][1:]:
         Path, _ = route_through_array(skelCellBody['skeleton'] == 0, start=skelCellBody['endpointCoord'][0], end=coord)
-        Path = np.array(Path)
-        pathCellBody.append(Path)
-        Length = path_length(Path, skelCellBody['skeleton'], physicspacing)
-        cellBodyLengths.append(Length)
+        pathCellBody.append(np.array(Path))
 
     skelCellBody['paths'] = pathCellBody
-    skelCellBody['lengths'] = cellBodyLengths
+    skelCellBody['lengths'] = path_lengths(pathCellBody, physicspacing).tolist()
 
     return skelCellBody
 
@@ -158,6 +208,7 @@ def branch_parameters_extration(distmap, skelbranch, physicspacing):
                 'primary-path': [],
                 'secondary-paths': [],
                 'total-protlength': [],
+                'width': [],
                 'physical-space': physicspacing,
                  }
 
@@ -211,19 +262,16 @@ def branch_parameters_extration(distmap, skelbranch, physicspacing):
         endprotNodeID = np.where((nodeIDallPixels == endprotCoord[:, None]).all(-1))[1]
 
         protPaths = []
-        protLengths = []
         for coord in endprotCoord:
             Path, _ = route_through_array(np.invert(skelProt), start=endbodycoord[i], end=coord)
-            Path = np.array(Path)
-            protPaths.append(Path)
-            Length = path_length(Path, skelProt, physicspacing)
-            protLengths.append(Length)
+            protPaths.append(np.array(Path))
+        protLengths = path_lengths(protPaths, physicspacing)
 
 
-        maxLength = np.array(protLengths).max()
+        maxLength = protLengths.max()
         skeldict['euclidean-length'].append(maxLength)
 
-        primaryPathID = np.array(protLengths).argmax()
+        primaryPathID = protLengths.argmax()
         primaryPath = protPaths[primaryPathID]
         skeldict['primary-path'].append(primaryPath)
 
@@ -235,6 +283,9 @@ def branch_parameters_extration(distmap, skelbranch, physicspacing):
         skeldict['final_node-coord-0'].append(endprotCoord[primaryPathID, 0])
         skeldict['final_node-coord-1'].append(endprotCoord[primaryPathID, 1])
 
+    # mean width along the primary paths, while the distance map is available
+    skeldict['width'] = protusion_widths(distmap, skeldict['primary-path'], physicspacing).tolist()
+
     return skeldict
 
 def branch_skletonization(distmap, bodydict, physicspacing):
@@ -263,17 +314,117 @@ def full_cell_skeletonization(distmap, threshold, maxthreshold, physicspacing =
     used to separate cell body skeleton from branches.
     :param distmap:
     :param threshold:
-    :param physicspacing:
+    :param physicspacing: pixel physical size, either a scalar or one value per axis of distmap (see pixel_spacing)
     :return:
     """
+    # skeletons saved by older versions store a scalar spacing: extend it to every axis
+    physicspacing = np.ones(distmap.ndim) * physicspacing
+
     # full cell body skeletonization and analysis
-    bodydict = cellbody_skeletonization(distmap, threshold, maxthreshold, physicspacing)
+    with prof.stage('skeleton.cellbody'):
+        bodydict = cellbody_skeletonization(distmap, threshold, maxthreshold, physicspacing)
 
     # full cell branches skeletonization and analysis
-    protdusiondict = branch_skletonization(distmap, bodydict, physicspacing)
+    with prof.stage('skeleton.protusions'):
+        protdusiondict = branch_skletonization(distmap, bodydict, physicspacing)
 
     return bodydict, protdusiondict
 
+def seeded_medial_axis(mask):
+    """
+    Medial axis and distance transform of a mask. medial_axis breaks ties with a permutation of the mask pixels,
+    seeded here so that the same mask always gives the same skeleton: scikit-image >= 0.21 takes rng,
+    0.19 and 0.20 take random_state (both unseeded by default), older versions always use a seeded permutation.
+    """
+    for seed in ({'rng': 0}, {'random_state': 0}):
+        try:
+            return medial_axis(mask, return_distance=True, **seed)
+        except TypeError:
+            continue
+
+    return medial_axis(mask, return_distance=True)
+
+def skeletonize_mask(cellmask, physicspacing = 1):
+    """
+    Skeletonize a cell mask image, applying an automatic algorithm to identify cell body.
+    :param physicspacing: pixel physical size (see pixel_spacing)
+    :return: cell body threshold, cell body and protusions skeleton dictionaries
+    """
+    # Compute the medial axis (skeleton) and the distance transform
+    with prof.stage('skeleton.medial_axis'):
+        medialAxis, distance = seeded_medial_axis(cellmask)
+
+    # Distance to the background for pixels of the skeleton
+    distmap = np.array(distance * medialAxis)
+
+    with prof.stage('skeleton.threshold'):
+        thresh, maxthreshold = automatic_cellbody_threshold(distmap)
+
+    skelbody, skelprot = full_cell_skeletonization(distmap, thresh, maxthreshold, physicspacing)
+
+    return thresh, skelbody, skelprot
+
+def translate_skeleton(skelbody, skelprot, offset, shape):
+    """
+    Translate the skeleton of a cropped mask to the full frame.
+    :param offset: (row, column) position of the crop in the full frame
+    :param shape: shape of the full frame
+    """
+    skeleton = np.zeros(shape, dtype=bool)
+    crop = skelbody['skeleton']
+    skeleton[offset[0]:offset[0] + crop.shape[0], offset[1]:offset[1] + crop.shape[1]] = crop
+    skelbody['skeleton'] = skeleton
+
+    skelbody['endpointCoord'] = skelbody['endpointCoord'] + offset
+    skelbody['paths'] = [path + offset for path in skelbody['paths']]
+
+    skelprot['primary-path'] = [path + offset for path in skelprot['primary-path']]
+    skelprot['secondary-paths'] = [[path + offset for path in paths] for paths in skelprot['secondary-paths']]
+    for axis in (0, 1):
+        for node in ('initial_node-coord-', 'final_node-coord-'):
+            skelprot[node + str(axis)] = [c + offset[axis] for c in skelprot[node + str(axis)]]
+
+    return skelbody, skelprot
+
+def skeletonize_labels(labels, physicspacing = 1, offset = (0, 0), shape = None, padding = CROP_PADDING):
+    """
+    Skeletonize all the cells of a labelled image, each one in its bounding box (found for all the labels in one pass).
+    The medial axis of each cell is computed on its mask cropped with a border of background pixels: the cell
+    pixels, their order and their distances to the background are the same as in the full frame, so the skeleton is
+    the same computed by skeletonize_mask on the mask of the cell alone (medial_axis breaks ties with a permutation
+    of the masked pixels, a medial axis of the whole labelled image would break them differently).
+    :param labels: labelled image, 0 is the background
+    :param physicspacing: pixel physical size (see pixel_spacing)
+    :param offset: (row, column) position of the labelled image in the frame (e.g. if it's cropped)
+    :param shape: shape of the frame, shape of labels if None
+    :return: generator of (label, (threshold, skelbody, skelprot)) in frame coordinates,
+    or (label, exception) if the skeletonization fails
+    """
+    if shape is None:
+        shape = labels.shape
+
+    for index, region in enumerate(ndimage.find_objects(labels), start=1):
+        if region is None:
+            continue
+        region = tuple(slice(max(s.start - padding, 0), min(s.stop + padding, size))
+                       for s, size in zip(region, labels.shape))
+
+        # mask of the cell only, other cells may be in its bounding box
+        with prof.stage('skeleton.medial_axis'):
+            medialAxis, distance = seeded_medial_axis(labels[region] == index)
+        celldist = distance * medialAxis
+        try:
+            with prof.stage('skeleton.threshold'):
+                thresh, maxthreshold = automatic_cellbody_threshold(celldist)
+            skelbody, skelprot = full_cell_skeletonization(celldist, thresh, maxthreshold, physicspacing)
+        except (IndexError, ValueError) as error:
+            yield index, error
+            continue
+
+        celloffset = np.array([region[0].start + offset[0], region[1].start + offset[1]])
+        skelbody, skelprot = translate_skeleton(skelbody, skelprot, celloffset, shape)
+        yield index, (thresh, skelbody, skelprot)
+
 class SkelProc():
 
     """
@@ -297,18 +448,9 @@ class SkelProc():
         self.mask = cellmask
         controller = self.controller
 
-        # Compute the medial axis (skeleton) and the distance transform
-        medialAxis, distance = medial_axis(cellmask, return_distance=True)
-
-        if controller.img.imgfile.dxyz is not None:
-            physpace = controller.img.imgfile.dxyz[0]
-
-        # Distance to the background for pixels of the skeleton
-        distmap = np.array(distance * medialAxis)
-
-        self.thresh, maxthreshold = automatic_cellbody_threshold(distmap)
+        physpace = pixel_spacing(controller.img.imgfile.dxyz, ndim=cellmask.ndim)
 
-        self.skelbody, self.skelprot = full_cell_skeletonization(distmap, self.thresh, maxthreshold, physpace)
+        self.thresh, self.skelbody, self.skelprot = skeletonize_mask(cellmask, physpace)
 
 
 
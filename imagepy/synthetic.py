@@ -0,0 +1,173 @@
+'''
+
+Module to create synthetic cells and images, used to benchmark the analysis without microscope images.
+
+Cells are star shaped: a round cell body with straight protusions, each protusion can have secondary branches.
+Synthetic stacks (multi z-frame, multi timepoint images with metadata) are read by SyntheticReader, which has
+the interface of the bioformats reader, so they are loaded by the same code of the microscope images
+(see imagefile.pbf2pickle).
+
+'''
+
+import numpy as np
+from scipy import ndimage
+from skimage.draw import line
+try:
+    from skimage.draw import disk
+except ImportError:  # scikit-image < 0.19
+    from skimage.draw import circle
+
+    def disk(center, radius, shape=None):
+        return circle(center[0], center[1], radius, shape=shape)
+from imagepy.segmentation import region_contours
+
+
+def star_mask(shape=(512, 512), center=None, body_radius=30, protusions=5, length=80, width=4,
+              branches=0, branch_length=25, seed=None):
+    """
+    Mask of a star shaped cell.
+    :param shape: (rows, columns) of the frame
+    :param center: (row, column) of the cell body, center of the frame if None
+    :param body_radius: radius of the cell body [pixel]
+    :param protusions: number of primary protusions, evenly spaced with a random jitter of the angle
+    :param length: length of the primary protusions from the border of the cell body [pixel]
+    :param width: width of the protusions [pixel]
+    :param branches: number of secondary branches of each protusion
+    :param branch_length: length of the secondary branches [pixel]
+    :param seed: seed of the random jitter, the same seed gives the same cell
+    """
+    rng = np.random.RandomState(seed)
+    if center is None:
+        center = (shape[0] // 2, shape[1] // 2)
+
+    # one pixel wide protusions, thickened all at once
+    lines = np.zeros(shape, dtype=bool)
+
+    def draw_segment(start, angle, seglength):
+        end = (start[0] + seglength * np.sin(angle), start[1] + seglength * np.cos(angle))
+        rr, cc = line(int(round(start[0])), int(round(start[1])), int(round(end[0])), int(round(end[1])))
+        inside = (rr >= 0) & (rr < shape[0]) & (cc >= 0) & (cc < shape[1])
+        lines[rr[inside], cc[inside]] = True
+
+    angles = 2 * np.pi * np.arange(protusions) / max(protusions, 1)
+    angles += rng.uniform(-0.25, 0.25, protusions) * np.pi / max(protusions, 1)
+    for angle in angles:
+        draw_segment(center, angle, body_radius + length)
+        # secondary branches from evenly spaced points of the protusion, alternately on each side
+        for b in range(branches):
+            t = body_radius + length * (b + 1) / (branches + 1)
+            start = (center[0] + t * np.sin(angle), center[1] + t * np.cos(angle))
+            draw_segment(start, angle + (-1) ** b * np.pi / 4, branch_length)
+
+    structure = np.zeros((width + 1, width + 1), dtype=bool)
+    structure[disk((width / 2, width / 2), width / 2 + 0.5, shape=structure.shape)] = True
+    mask = ndimage.binary_dilation(lines, structure)
+    mask[disk(center, body_radius, shape=shape)] = True
+
+    return mask
+
+def cell_patch_shape(body_radius=30, length=80, width=4, **_):
+    """
+    Shape of the smallest frame containing a star shaped cell at its center (see star_mask).
+    """
+    side = 2 * (body_radius + length + width) + 3
+
+    return side, side
+
+def synthetic_stack(zframes=10, timepoints=1, size=(1024, 1024), cells=16, dxyz=(0.2, 0.2, 0.5), seed=0,
+                    **cellparameters):
+    """
+    Create a synthetic stack of star shaped cells on a noisy background.
+    Cells are placed on a jittered grid and span all the z-frames, their protusions get shorter away from
+    the central z-frame.
+    :param zframes: number of z-frames
+    :param timepoints: number of timepoints (the same cells, with a different noise)
+    :param size: (rows, columns) of the frames
+    :param cells: number of cells
+    :param dxyz: pixel physical size [micron]
+    :param cellparameters: parameters of the cells (see star_mask)
+    :return: image reader (see SyntheticReader) and list of cell contours (xdata, ydata, z-frame)
+    """
+    rng = np.random.RandomState(seed)
+    length = cellparameters.pop('length', 80)
+    patchshape = cell_patch_shape(length=length, **cellparameters)
+
+    # cell centres on a grid, jittered
+    ncols = int(np.ceil(np.sqrt(cells)))
+    nrows = int(np.ceil(cells / ncols))
+    rows = (np.arange(cells) // ncols + 0.5) * size[0] / nrows + rng.uniform(-0.1, 0.1, cells) * size[0] / nrows
+    cols = (np.arange(cells) % ncols + 0.5) * size[1] / ncols + rng.uniform(-0.1, 0.1, cells) * size[1] / ncols
+
+    masks = np.zeros((zframes,) + tuple(size), dtype=bool)
+    contours = []
+    for n in range(cells):
+        cellseed = rng.randint(2 ** 31)
+        for z in range(zframes):
+            scale = 1 - 0.5 * abs(z - (zframes - 1) / 2) / max((zframes - 1) / 2, 1)
+            patch = star_mask(shape=patchshape, length=int(length * scale), seed=cellseed, **cellparameters)
+
+            # paste the cell in the frame, cropped at the borders
+            r0, c0 = int(rows[n]) - patchshape[0] // 2, int(cols[n]) - patchshape[1] // 2
+            fr = slice(max(r0, 0), min(r0 + patchshape[0], size[0]))
+            fc = slice(max(c0, 0), min(c0 + patchshape[1], size[1]))
+            patch = patch[fr.start - r0:fr.stop - r0, fc.start - c0:fc.stop - c0]
+            masks[z, fr, fc] |= patch
+
+            for xdata, ydata in region_contours(patch.astype(int), offset=(fr.start, fc.start)):
+                contours.append((xdata, ydata, z))
+
+    frames = []
+    for t in range(timepoints):
+        noise = rng.normal(200, 30, masks.shape)
+        frame = np.clip(noise + 1500 * masks, 0, 2 ** 16 - 1).astype(np.uint16)
+        frames.append(frame if zframes > 1 else frame[0])
+
+    return SyntheticReader(frames, dxyz[:2] if zframes == 1 else dxyz), contours
+
+
+class SyntheticMetadata():
+    """
+    Metadata of a synthetic image, with the interface of the bioformats metadata used by imagefile.pbf2pickle.
+    """
+
+    def __init__(self, count, dxyz):
+        self.count = count
+        self.dxyz = dxyz
+
+    def ImageCount(self):
+        return self.count
+
+    def PixelsPhysicalSizeX(self, series):
+        return self.dxyz[0]
+
+    def PixelsPhysicalSizeY(self, series):
+        return self.dxyz[1]
+
+    def PixelsPhysicalSizeZ(self, series):
+        return self.dxyz[2]
+
+
+class SyntheticReader():
+    """
+    Reader of a synthetic image, with the interface of pims.bioformats.BioformatsReader used by imagefile.pbf2pickle:
+    iterating the reader gives the frames of each timepoint, (z, rows, columns) arrays or (rows, columns) if
+    the image has one z-frame.
+    """
+
+    def __init__(self, frames, dxyz, unit='micron'):
+        self.frames = frames
+        shape = frames[0].shape
+        self.sizes = {'x': shape[-1], 'y': shape[-2], 't': len(frames)}
+        if len(shape) == 3:
+            self.sizes['z'] = shape[0]
+        self.metadata = SyntheticMetadata(len(frames), list(dxyz))
+        self.unit = unit
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def get_metadata_raw(self):
+        return {'Unit': self.unit}
@@ -0,0 +1,320 @@
+'''
+
+Module to link the cells traced on different z-frames that are the same physical cell.
+
+Cells of adjacent z-frames are matched one to one by a linear assignment (scipy linear_sum_assignment):
+    overlapping masks       cost 1 - overlap (intersection over union), from 0 to 1
+    close centroids         cost 1 + distance / (radius1 + radius2), from 1 to 2, when the masks don't overlap
+                            and the centroids are closer than the largest radius of the two cells
+so that overlaps are always preferred. Pairs of cells that are neither overlapping nor close are never linked.
+Overlapping cells are closer than the sum of their radii (exact for convex cells), so only the pairs whose centroids
+are closer than radius1 + radius2 are candidates. They are found with a KD-tree (scipy cKDTree) of the centroids of
+the second z-frame, searched around each cell of the first z-frame up to its radius plus the largest radius.
+Candidates farther than the sum of their own radii are discarded before measuring the overlap.
+Linked cells form tracks (see CellTrack), whose protusion metrics are aggregated across the z-frames.
+Each cell is measured once (centroid, radius and mask crop) when it is added: the links of its z-frame with the
+z-frames above and below are solved again, the other links are kept (see CellLinker.link_cell). Cells added in
+batches are only measured, and the links are solved when the tracks are requested (see CellLinker.update).
+Mask crops are released when memory is short (see CellLinker.release) and measured again before their z-frame
+is linked again.
+
+'''
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy import ndimage
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import cKDTree
+from imagepy.skeletongraph import cell_graph
+
+INFEASIBLE = 1e6 # cost of the pairs of cells that can't be linked
+TRACK_COLUMNS = ['track#', 'cells', 'zframes', 'slices', 'volume', 'max-protusions', 'mean-protusions', 'max-length',
+                 'mean-total-length', 'tortuosity', 'width', 'max-branches']
+
+
+def measure_cell(mask, physicspacing):
+    """
+    Measure a cell mask for the linking: centroid and radius of the disk with the same area, in physical units,
+    and mask cropped to its bounding box.
+    :return: dictionary with centroid, radius, crop and offset (position of the crop), None if the mask is empty
+    """
+    region = ndimage.find_objects(mask.view(np.uint8))
+    if len(region) == 0:
+        return None
+    region = region[0]
+
+    crop = mask[region]
+    offset = np.array([s.start for s in region])
+    points = np.argwhere(crop)
+
+    return {'centroid': (points.mean(axis=0) + offset) * physicspacing,
+            'radius': np.sqrt(len(points) * np.prod(physicspacing) / np.pi),
+            'crop': crop,
+            'offset': offset}
+
+def mask_overlap(cell1, cell2):
+    """
+    Intersection over union of two cropped masks (see measure_cell).
+    """
+    start = np.maximum(cell1['offset'], cell2['offset'])
+    stop = np.minimum(cell1['offset'] + cell1['crop'].shape, cell2['offset'] + cell2['crop'].shape)
+    if np.any(stop <= start):
+        return 0.
+
+    box1 = tuple(slice(a - o, b - o) for a, b, o in zip(start, stop, cell1['offset']))
+    box2 = tuple(slice(a - o, b - o) for a, b, o in zip(start, stop, cell2['offset']))
+    intersection = np.count_nonzero(cell1['crop'][box1] & cell2['crop'][box2])
+
+    return intersection / float(np.count_nonzero(cell1['crop']) + np.count_nonzero(cell2['crop']) - intersection)
+
+def link_frames(cells1, cells2):
+    """
+    Match the cells of two adjacent z-frames one to one (see module description).
+    :param cells1: measured cells of the first z-frame { Cell # : measures } (see measure_cell)
+    :param cells2: measured cells of the second z-frame
+    :return: dictionary { Cell # of the first z-frame : Cell # of the second z-frame }
+    """
+    ids1, ids2 = list(cells1.keys()), list(cells2.keys())
+    if len(ids1) == 0 or len(ids2) == 0:
+        return dict()
+
+    tree2 = cKDTree(np.array([cells2[i]['centroid'] for i in ids2]))
+    largest = max(cell['radius'] for cell in cells2.values())
+
+    cost = np.full((len(ids1), len(ids2)), INFEASIBLE)
+    for n1, id1 in enumerate(ids1):
+        cell1 = cells1[id1]
+        for n2 in tree2.query_ball_point(cell1['centroid'], cell1['radius'] + largest):
+            cell2 = cells2[ids2[n2]]
+            distance = np.linalg.norm(cell1['centroid'] - cell2['centroid'])
+            if distance > cell1['radius'] + cell2['radius']:
+                continue
+            overlap = mask_overlap(cell1, cell2)
+            if overlap > 0:
+                cost[n1, n2] = 1 - overlap
+            elif distance <= max(cell1['radius'], cell2['radius']):
+                cost[n1, n2] = 1 + distance / (cell1['radius'] + cell2['radius'])
+
+    rows, cols = linear_sum_assignment(cost)
+
+    return {ids1[r]: ids2[c] for r, c in zip(rows, cols) if cost[r, c] < INFEASIBLE}
+
+def track_tab(tracks, shapecells, zspacing=1):
+    """
+    Create the tab of the cell tracks, one row for each track (see CellTrack.metrics).
+    """
+    data = []
+    for track in tracks:
+        metrics = track.metrics(shapecells, zspacing)
+        data.append(dict(metrics, **{'track#': track.trackid,
+                                     'cells': ', '.join(map(str, track.cells)),
+                                     'zframes': '{} - {}'.format(track.zframes[0] + 1, track.zframes[-1] + 1),
+                                     'slices': len(track.cells)}))
+
+    table = pd.DataFrame(data, columns=TRACK_COLUMNS)
+    decimals = {'volume': 1, 'mean-protusions': 2, 'max-length': 1, 'mean-total-length': 1, 'tortuosity': 3,
+                'width': 2}
+
+    return table.round(decimals)
+
+
+class CellTrack():
+    """
+    Class of the cells traced on consecutive z-frames that are the same physical cell.
+    """
+
+    def __init__(self, trackid, cells, zframes):
+        """
+        :param cells: cells # of the track, ordered by z-frame
+        :param zframes: z-frame of each cell
+        """
+        self.trackid = trackid
+        self.cells = cells
+        self.zframes = zframes
+
+    def metrics(self, shapecells, zspacing=1):
+        """
+        Protusion metrics of the track, aggregated across the z-frames of its cells:
+            volume              sum of the cell areas times the z spacing
+            max-protusions      largest number of primary protusions of a cell
+            mean-protusions     mean number of primary protusions of the cells
+            max-length          longest primary protusion (euclidean length)
+            mean-total-length   mean total length of the primary protusions of the cells
+            tortuosity, width   mean of the protusions of all the cells (see skeletongraph.protusion_metrics)
+            max-branches        largest number of branches of a protusion
+        Cells that were not skeletonized count only for the volume.
+        :param zspacing: physical distance between the z-frames
+        :return: dictionary of metrics
+        """
+        areas, counts, totals, lengths, tortuosity, width, branches = [], [], [], [], [], [], []
+        for cellid in self.cells:
+            cell = shapecells[str(cellid)]
+            areas.append(cell.contour['area'])
+            graph = cell_graph(cell)
+            if graph is None:  # cell not skeletonized
+                continue
+
+            celllengths = np.asarray(cell.skelprot['euclidean-length'], dtype=float)
+            counts.append(len(celllengths))
+            totals.append(celllengths.sum())
+            lengths.append(celllengths)
+            protusions = graph.protusion_metrics()
+            tortuosity.append(protusions['tortuosity'])
+            width.append(protusions['width'])
+            branches.append(protusions['branches'])
+
+        def aggregate(function, values):
+            values = np.concatenate([np.atleast_1d(v) for v in values] + [np.empty(0)]).astype(float)
+            values = values[np.isfinite(values)]
+            return float(function(values)) if len(values) > 0 else np.nan
+
+        return {'volume': float(np.sum(areas) * zspacing),
+                'max-protusions': aggregate(np.max, counts),
+                'mean-protusions': aggregate(np.mean, counts),
+                'max-length': aggregate(np.max, lengths),
+                'mean-total-length': aggregate(np.mean, totals),
+                'tortuosity': aggregate(np.mean, tortuosity),
+                'width': aggregate(np.mean, width),
+                'max-branches': aggregate(np.max, branches)}
+
+
+class CellLinker():
+    """
+    Class that links the cells of adjacent z-frames and builds the tracks of the cells (see module description).
+    """
+
+    def __init__(self, physicspacing=1):
+        """
+        :param physicspacing: pixel physical size (row, column) (see skeletonprocessing.pixel_spacing)
+        """
+        self.spacing = np.broadcast_to(np.asarray(physicspacing, dtype=float), (2,))
+        # measured cells of each z-frame { z-frame : { Cell # : measures } }, least recently linked first
+        self.frames = OrderedDict()
+        self.links = dict() # links of each z-frame with the next one { z-frame : { Cell # : Cell # of z-frame + 1 } }
+        self.outdated = set() # z-frames whose links with the next z-frame must be solved again
+        self.cache = dict() # tracks, built again when the links change
+
+    def add_cell(self, zframe, cellid, mask):
+        """
+        Measure a cell, its z-frame will be linked again with the z-frames above and below.
+        """
+        zframe = int(zframe)
+        measures = measure_cell(mask, self.spacing)
+        if measures is None:
+            return
+        self.frames.setdefault(zframe, dict())[int(cellid)] = measures
+        self.outdated.update([zframe - 1, zframe])
+
+    def link_cell(self, zframe, cellid, mask, cell_zframes, shapecells):
+        """
+        Add a cell and solve again the links of its z-frame (e.g. when a cell is saved in the GUI).
+        Cells of the same and adjacent z-frames that are not measured yet are read from shapecells.
+        :param cell_zframes: cells of each z-frame { z-frame : [Cell #] }
+        """
+        zframe = int(zframe)
+        self.add_cell(zframe, cellid, mask)
+        for z in (zframe - 1, zframe, zframe + 1):
+            self.ensure_cells(z, cell_zframes.get(str(z), []), shapecells)
+        self.solve([zframe - 1, zframe])
+
+    def ensure_cells(self, zframe, cellIDs, shapecells, crops=True):
+        """
+        Measure the cells of a z-frame that are not measured yet (e.g. cells of a project file).
+        :param crops: measure again the mask crops released (see release), before the z-frame is linked
+        """
+        zframe = int(zframe)
+        cells = self.frames.get(zframe, dict())
+        for cellid in cellIDs:
+            measures = cells.get(int(cellid))
+            if measures is None:
+                self.add_cell(zframe, cellid, shapecells[str(cellid)].contour['mask'])
+            elif crops and measures['crop'] is None:
+                measures.update(measure_cell(shapecells[str(cellid)].contour['mask'], self.spacing))
+        if crops and zframe in self.frames:
+            self.frames.move_to_end(zframe)
+
+    def solve(self, zframes):
+        """
+        Solve again the links of the z-frames given with the next z-frames, if outdated.
+        """
+        for zframe in zframes:
+            if zframe in self.outdated:
+                self.links[zframe] = link_frames(self.frames.get(zframe, dict()), self.frames.get(zframe + 1, dict()))
+                self.outdated.discard(zframe)
+                self.cache.clear()
+
+    def update(self, cell_zframes, shapecells):
+        """
+        Measure all the cells of the analysis and solve the outdated links.
+        :return: the linker
+        """
+        for zframe, cellIDs in cell_zframes.items():
+            self.ensure_cells(int(zframe), cellIDs, shapecells, crops=False)
+        outdated = sorted(self.outdated)
+        for zframe in set(outdated) | set(z + 1 for z in outdated):
+            self.ensure_cells(zframe, cell_zframes.get(str(zframe), []), shapecells)
+        self.solve(outdated)
+
+        return self
+
+    def nbytes(self):
+        """
+        Memory of the mask crops of the measured cells, in bytes.
+        """
+        return sum(cell['crop'].nbytes for cells in self.frames.values() for cell in cells.values()
+                   if cell['crop'] is not None)
+
+    def release(self, size):
+        """
+        Release the mask crops of the z-frames whose links are solved, least recently linked first, until at least
+        size bytes are released. Centroids and radii are kept, crops are measured again when needed (see ensure_cells).
+        :return: bytes released
+        """
+        released = 0
+        for zframe, cells in self.frames.items():
+            if released >= size:
+                break
+            if zframe in self.outdated or zframe - 1 in self.outdated:
+                continue
+            for cell in cells.values():
+                if cell['crop'] is not None:
+                    released += cell['crop'].nbytes
+                    cell['crop'] = None
+
+        return released
+
+    def tracks(self):
+        """
+        Tracks of the linked cells, numbered by their first cell # (single cells are tracks of one cell).
+        :return: list of CellTrack
+        """
+        def compute():
+            previous = {cell2: cell1 for links in self.links.values() for cell1, cell2 in links.items()}
+            zframe = {cellid: z for z, cells in self.frames.items() for cellid in cells}
+
+            chains = []
+            for cellid in sorted(zframe, key=lambda c: (zframe[c], c)):
+                if cellid in previous:
+                    continue
+                chain = [cellid]
+                while chain[-1] in self.links.get(zframe[chain[-1]], dict()):
+                    chain.append(self.links[zframe[chain[-1]]][chain[-1]])
+                chains.append(chain)
+
+            chains.sort(key=min)
+            return [CellTrack(n + 1, chain, [zframe[c] for c in chain]) for n, chain in enumerate(chains)]
+
+        if 'tracks' not in self.cache:
+            self.cache['tracks'] = compute()
+
+        return self.cache['tracks']
+
+    def track_of(self, cellid):
+        """
+        Track of a cell, None if the cell is not measured.
+        """
+        if 'index' not in self.cache:
+            self.cache['index'] = {c: track for track in self.tracks() for c in track.cells}
+
+        return self.cache['index'].get(int(cellid))
@@ -0,0 +1,257 @@
+'''
+
+Module to process cell shapes traced on consecutive z-frames as a single volume
+and to extract the 3D skeleton of the cell (cell body and protusions).
+
+The volume is processed in bounded chunks of z-frames, so that the memory needed by the
+skeletonization and the distance transform does not depend on the number of frames of the stack.
+Volumes larger than SCRATCH_BYTES (the stacked masks and the skeleton) are written to temporary memory-mapped
+files, and the distance map is kept only on the skeleton voxels.
+Each chunk is extended by a halo of z-frames. The halo of the distance transform is sized from the largest
+in-plane distance, which bounds the 3D distance, so distances are exact at the chunk seams. The thinning of
+skeletonize_3d is not bounded in the same way: with the same halo skeletons match the whole volume in practice,
+but they may differ by a few voxels at the seams of very thick structures.
+
+'''
+
+import tempfile
+import numpy as np
+from scipy import ndimage
+from scipy.sparse.csgraph import connected_components, dijkstra
+from skimage import filters
+from skimage.morphology import skeletonize_3d
+from skan import csr
+from imagepy.skeletonprocessing import pixel_spacing
+
+ZCHUNK = 16 # number of z-frames skeletonized at once
+ZHALO = 4 # least z-frames added on both sides of a chunk to avoid artifacts at the chunk borders
+SCRATCH_BYTES = 2 ** 26 # larger volumes are written to temporary memory-mapped files
+PATH_SOURCES = 64 # attachment nodes whose path lengths are computed at once
+
+
+def scratch_volume(shape, dtype=bool):
+    """
+    Empty volume, in a temporary memory-mapped file (deleted when the volume is released) if larger than SCRATCH_BYTES.
+    """
+    if np.prod(shape) * np.dtype(dtype).itemsize <= SCRATCH_BYTES:
+        return np.zeros(shape, dtype=dtype)
+
+    return np.memmap(tempfile.TemporaryFile(), dtype=dtype, mode='w+', shape=tuple(shape))
+
+def distance_halo(volume, physicspacing, zchunk=ZCHUNK, zhalo=ZHALO):
+    """
+    Z-frames to add on both sides of a chunk for an exact distance transform: the distance of a voxel to the
+    mask boundary is at most its in-plane distance, so the closest background voxel is never farther
+    than the largest in-plane distance.
+    :return: number of z-frames, at least zhalo
+    """
+    largest = 0.
+    for start in range(0, volume.shape[0], zchunk):
+        for plane in volume[start:start + zchunk]:
+            if plane.any():
+                largest = max(largest, ndimage.distance_transform_edt(plane, sampling=physicspacing[1:]).max())
+
+    return max(zhalo, int(np.ceil(largest / physicspacing[0])) + 1)
+
+
+def stack_cell_masks(shapecells, cellIDs):
+    """
+    Stack the masks of cells traced on different z-frames in a volume cropped to their bounding box.
+    Cells traced on the same z-frame are merged, while z-frames between two traced frames
+    are filled with the intersection of the closest traced masks.
+    :param shapecells: dictionary containing cell shape objects { Cell # : cell object } (see imageprocesser)
+    :param cellIDs: list of cell ids to stack
+    :return: boolean volume [plane, row, column] and offset of its origin in the image stack
+    """
+    masks = [shapecells[str(i)].contour['mask'] for i in cellIDs]
+    zframes = np.array([int(shapecells[str(i)].zframe) for i in cellIDs])
+
+    footprint = np.logical_or.reduce(masks)
+    rows = np.flatnonzero(footprint.any(axis=1))
+    cols = np.flatnonzero(footprint.any(axis=0))
+
+    # one empty voxel all around the cell, so that the skeleton never touches the volume border
+    offset = np.array([zframes.min() - 1, rows[0] - 1, cols[0] - 1])
+    shape = (zframes.max() - zframes.min() + 3, rows[-1] - rows[0] + 3, cols[-1] - cols[0] + 3)
+    volume = scratch_volume(shape, dtype=bool)
+
+    rowslice = slice(rows[0], rows[-1] + 1)
+    colslice = slice(cols[0], cols[-1] + 1)
+    for mask, z in zip(masks, zframes):
+        volume[z - offset[0], 1:-1, 1:-1] |= mask[rowslice, colslice]
+
+    traced = np.unique(zframes - offset[0])
+    for z in range(traced[0] + 1, traced[-1]):
+        if z not in traced:
+            below = traced[traced < z][-1]
+            above = traced[traced > z][0]
+            volume[z] = volume[below] & volume[above]
+
+    return volume, offset
+
+def chunked_skeletonize(volume, zchunk=ZCHUNK, zhalo=ZHALO):
+    """
+    Skeletonize a 3D mask in chunks of z-frames. Each chunk is extended by zhalo frames on both
+    sides and only its central part is kept.
+    :return: boolean 3D skeleton
+    """
+    nz = volume.shape[0]
+    skeleton = scratch_volume(volume.shape, dtype=bool)
+
+    for start in range(0, nz, zchunk):
+        stop = min(start + zchunk, nz)
+        low = max(start - zhalo, 0)
+        high = min(stop + zhalo, nz)
+        skelchunk = skeletonize_3d(volume[low:high]) > 0
+        skeleton[start:stop] = skelchunk[start - low:stop - low]
+
+    return skeleton
+
+def chunked_distance_on_skeleton(volume, skeleton, physicspacing, zchunk=ZCHUNK, zhalo=ZHALO):
+    """
+    Physical distance to the mask boundary of the skeleton voxels (3D distance map),
+    computed in chunks of z-frames as in chunked_skeletonize (zhalo should be sized by distance_halo).
+    :return: flat index of the skeleton voxels (sorted) and their float32 distances
+    """
+    nz = volume.shape[0]
+    indices, distances = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.float32)]
+
+    for start in range(0, nz, zchunk):
+        stop = min(start + zchunk, nz)
+        low = max(start - zhalo, 0)
+        high = min(stop + zhalo, nz)
+        distance = ndimage.distance_transform_edt(volume[low:high], sampling=physicspacing)
+        core = distance[start - low:stop - low]
+        skelcore = np.asarray(skeleton[start:stop])
+        voxels = np.argwhere(skelcore)
+        voxels[:, 0] += start
+        indices.append(np.ravel_multi_index(tuple(voxels.T), volume.shape).astype(np.int64))
+        distances.append(core[skelcore].astype(np.float32))
+
+    return np.concatenate(indices), np.concatenate(distances)
+
+def volume_skeletonization(volume, physicspacing, zchunk=ZCHUNK, zhalo=ZHALO):
+    """
+    Extract cell body and protusions from the 3D skeleton of a cell volume.
+    As in the 2D analysis (see skeletonprocessing module), the cell body is made of the skeleton voxels
+    with highest distance to the mask boundary (Otsu threshold), while the remaining branches are protusions.
+    The analysis is performed on the skan n-dimensional graph of the skeleton.
+
+    :param volume: boolean 3D mask [plane, row, column]
+    :param physicspacing: voxel physical size, one value per axis of volume (see skeletonprocessing.pixel_spacing)
+    :return: dictionary with skeleton coordinates and protusion parameters
+    """
+    physicspacing = np.ones(volume.ndim) * physicspacing
+
+    zhalo = distance_halo(volume, physicspacing, zchunk, zhalo)
+    skeleton = chunked_skeletonize(volume, zchunk, zhalo)
+    skelindex, skeldist = chunked_distance_on_skeleton(volume, skeleton, physicspacing, zchunk, zhalo)
+
+    skelvol = {'skeleton-coord': np.empty((0, 3), int),
+               'body-coord': np.empty((0, 3), int),
+               'protusion_id': [],
+               'euclidean-length': [],
+               'path-length': [],
+               'total-protlength': 0,
+               'final_node-coord-0': [],
+               'final_node-coord-1': [],
+               'final_node-coord-2': [],
+               'physical-space': physicspacing,
+               'threshold': np.nan}
+
+    if not skeleton.any():
+        return skelvol
+
+    # graph of the skeleton: edge weights are the physical distances between neighbour voxels
+    graph, coords, _ = csr.skeleton_to_csgraph(skeleton, spacing=physicspacing)
+    coords = coords.astype(int)
+    # skan reserves node 0, which doesn't correspond to any skeleton voxel
+    nodes = np.flatnonzero(skeleton[tuple(coords.T)])
+    graph = graph[nodes][:, nodes].tocsr()
+    coords = coords[nodes]
+    nodedist = skeldist[np.searchsorted(skelindex, np.ravel_multi_index(tuple(coords.T), skeleton.shape))]
+    skelvol['skeleton-coord'] = coords
+
+    # cell body: largest connected group of nodes above the Otsu threshold
+    threshold = filters.threshold_otsu(nodedist) if np.unique(nodedist).size > 1 else nodedist.min()
+    skelvol['threshold'] = threshold
+    body = nodedist >= threshold
+    bodyidx = np.flatnonzero(body)
+    _, bodylabels = connected_components(graph[bodyidx][:, bodyidx], directed=False)
+    bodylabels_count = np.bincount(bodylabels)
+    body[:] = False
+    body[bodyidx[bodylabels == bodylabels_count.argmax()]] = True
+    skelvol['body-coord'] = coords[body]
+
+    # protusions: connected groups of the remaining nodes
+    protidx = np.flatnonzero(~body)
+    if protidx.size == 0:
+        return skelvol
+
+    protgraph = graph[protidx][:, protidx].tocsr()
+    nprot, protlabels = connected_components(protgraph, directed=False)
+
+    # nodes attached to the cell body and end nodes (tips) of each protusion
+    attached = np.asarray(graph[protidx][:, np.flatnonzero(body)].sum(axis=1)).ravel() > 0
+    degree = np.diff(graph.indptr)[protidx]
+    tips = degree == 1
+
+    # total length: each edge is stored twice in the symmetric graph
+    protgraph_coo = protgraph.tocoo()
+    totlength = np.bincount(protlabels[protgraph_coo.row], weights=protgraph_coo.data, minlength=nprot) / 2
+
+    attachidx = np.flatnonzero(attached)
+    if attachidx.size > 0:
+        # path length along the skeleton from the closest attachment node, a few attachment nodes at a time
+        pathdist = np.full(protidx.size, np.inf)
+        for start in range(0, attachidx.size, PATH_SOURCES):
+            sources = attachidx[start:start + PATH_SOURCES]
+            pathdist = np.minimum(pathdist, dijkstra(protgraph, directed=False, indices=sources).min(axis=0))
+    else:
+        pathdist = np.full(protidx.size, np.nan)
+
+    protid = 0
+    for p in range(nprot):
+        members = protlabels == p
+        start = np.flatnonzero(members & attached)
+        end = np.flatnonzero(members & tips & ~attached)
+        if start.size == 0 or end.size == 0:
+            # isolated branches not connected to the cell body
+            continue
+
+        protid += 1
+        deltas = (coords[protidx[end]][:, None, :] - coords[protidx[start]][None, :, :]) * physicspacing
+        euclidean = np.sqrt((deltas ** 2).sum(-1)).min(axis=1)
+        finaltip = euclidean.argmax()
+        finalcoord = coords[protidx[end[finaltip]]]
+
+        skelvol['protusion_id'].append(protid)
+        skelvol['euclidean-length'].append(euclidean[finaltip])
+        skelvol['path-length'].append(pathdist[end[finaltip]])
+        skelvol['total-protlength'] += totlength[p]
+        skelvol['final_node-coord-0'].append(finalcoord[0])
+        skelvol['final_node-coord-1'].append(finalcoord[1])
+        skelvol['final_node-coord-2'].append(finalcoord[2])
+
+    return skelvol
+
+def cell_volume_skeleton(shapecells, cellIDs, dxyz, zchunk=ZCHUNK, zhalo=ZHALO):
+    """
+    Full 3D skeleton analysis of the cells traced on different z-frames of the stack.
+    Coordinates returned are expressed in the image stack [zframe, row, column].
+    """
+    volume, offset = stack_cell_masks(shapecells, cellIDs)
+    # voxel physical size ordered as [plane, row, column], z spacing from dxyz[2]
+    physicspacing = pixel_spacing(dxyz, ndim=3)
+
+    skelvol = volume_skeletonization(volume, physicspacing, zchunk, zhalo)
+
+    skelvol['cells'] = [int(i) for i in cellIDs]
+    skelvol['zframes'] = sorted(set(int(shapecells[str(i)].zframe) for i in cellIDs))
+    skelvol['skeleton-coord'] = skelvol['skeleton-coord'] + offset
+    skelvol['body-coord'] = skelvol['body-coord'] + offset
+    for axis in range(3):
+        skelvol['final_node-coord-' + str(axis)] = (np.array(skelvol['final_node-coord-' + str(axis)], dtype=int)
+                                                    + offset[axis]).tolist()
+
+    return skelvol
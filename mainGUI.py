@@ -40,6 +40,8 @@ class ImagePyGUI(tk.Tk):
         self.filemenu = mbh.MenuWindow(self.container, controller=self)
 
 
-interface = ImagePyGUI()
-interface.minsize(800, 480)
-interface.mainloop()
\ No newline at end of file
+# guard needed by the worker processes of the parallel skeletonization (see parallelskeleton module)
+if __name__ == '__main__':
+    interface = ImagePyGUI()
+    interface.minsize(800, 480)
+    interface.mainloop()
\ No newline at end of file
@@ -0,0 +1,53 @@
+'''
+
+Tests of the merge of the results of a batch in one dataset (see imagepy.batch).
+
+'''
+
+import json
+import os
+import pandas as pd
+import pytest
+import imagepy.batch as bt
+
+SUMMARY = {'cells': 2, 'connections': 0, 'seconds': 1.}
+
+
+def write_files(output):
+    # the name of the second file is longer than the first one, as its track cells
+    folder = os.path.join(output, bt.FILES_FOLDER)
+    os.makedirs(folder)
+    done = dict()
+    for name, cells in (('a', '1, 2'), ('longer-name', '1, 2, 3, 4, 5')):
+        pd.DataFrame({'cell#': [1, 2], 'area': [10., 12.5]}).to_csv(os.path.join(folder, name + '_cells.csv'),
+                                                                     index=False)
+        pd.DataFrame({'track#': [1], 'cells': [cells]}).to_csv(os.path.join(folder, name + '_tracks.csv'),
+                                                               index=False)
+        with open(os.path.join(folder, name + '_metadata.json'), 'w') as f:
+            json.dump({'unit': 'micron'}, f)
+        done[name] = {'source': {'path': name + '.tif'}, 'summary': SUMMARY}
+
+    return done
+
+@pytest.mark.parametrize('extension, module', [('.csv', None), ('.parquet', 'pyarrow'), ('.h5', 'tables')])
+def test_merge_results(tmp_path, extension, module):
+    if module is not None:
+        pytest.importorskip(module)
+    output = str(tmp_path)
+    done = write_files(output)
+    path = os.path.join(output, 'merged' + extension)
+
+    bt.merge_results(output, done, path, tables=('cells', 'tracks'))
+
+    if extension == '.csv':
+        read = lambda table: pd.read_csv(os.path.join(output, 'merged_' + table + '.csv'))
+    elif extension == '.parquet':
+        read = lambda table: pd.read_parquet(os.path.join(output, 'merged_' + table + '.parquet'))
+    else:
+        read = lambda table: pd.read_hdf(path, table).reset_index(drop=True)
+
+    assert read('files')['file'].tolist() == ['a', 'longer-name']
+    assert read('cells')['file'].tolist() == ['a', 'a', 'longer-name', 'longer-name']
+    tracks = read('tracks')
+    assert tracks['file'].tolist() == ['a', 'longer-name']
+    assert tracks['cells'].tolist() == ['1, 2', '1, 2, 3, 4, 5']
@@ -0,0 +1,138 @@
+'''
+
+Tests of the cell records and of the loading of older project files (see imagepy.cellrecord).
+
+'''
+
+import base64
+import io
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+import imagepy.cellrecord as cr
+import imagepy.projectfile as pf
+
+# project file pickled by pandas 0.23.4 and numpy 1.16 (the pinned versions), without cells:
+# { 'cell_zframes': {'3': [1]}, 'connections': DataFrame([[3, 1, 2, 4., 5.]]), 'shapecells': {}, 'imgfile': None }
+PINNED_PROJECT = base64.b64decode(
+    'gAN9cQAoWAwAAABjZWxsX3pmcmFtZXNxAX1xAlgBAAAAM3EDXXEESwFhc1gLAAAAY29ubmVjdGlvbnNxBWNwYW5kYXMuY29yZS5mcmFtZQpEYXRh'
+    'RnJhbWUKcQYpgXEHfXEIKFgFAAAAX2RhdGFxCWNwYW5kYXMuY29yZS5pbnRlcm5hbHMKQmxvY2tNYW5hZ2VyCnEKKYFxCyhdcQwoY3BhbmRhcy5j'
+    'b3JlLmluZGV4ZXMuYmFzZQpfbmV3X0luZGV4CnENY3BhbmRhcy5jb3JlLmluZGV4ZXMuYmFzZQpJbmRleApxDn1xDyhYBAAAAGRhdGFxEGNudW1w'
+    'eS5jb3JlLm11bHRpYXJyYXkKX3JlY29uc3RydWN0CnERY251bXB5Cm5kYXJyYXkKcRJLAIVxE0MBYnEUh3EVUnEWKEsBSwWFcRdjbnVtcHkKZHR5'
+    'cGUKcRhYAgAAAE84cRlLAEsBh3EaUnEbKEsDWAEAAAB8cRxOTk5K/////0r/////Sz90cR1iiV1xHihYBgAAAHpmcmFtZXEfWAUAAABjZWxsMXEg'
+    'WAUAAABjZWxsMnEhWAcAAABjZW50ZXJYcSJYBwAAAGNlbnRlcllxI2V0cSRiWAQAAABuYW1lcSVOdYZxJlJxJ2gNY3BhbmRhcy5jb3JlLmluZGV4'
+    'ZXMucmFuZ2UKUmFuZ2VJbmRleApxKH1xKShoJU5YBQAAAHN0YXJ0cSpLAFgEAAAAc3RvcHErSwFYBAAAAHN0ZXBxLEsBdYZxLVJxLmVdcS8oaBFo'
+    'EksAhXEwaBSHcTFScTIoSwFLAksBhnEzaBhYAgAAAGY4cTRLAEsBh3E1UnE2KEsDWAEAAAA8cTdOTk5K/////0r/////SwB0cThiiUMQAAAAAAAA'
+    'EEAAAAAAAAAUQHE5dHE6YmgRaBJLAIVxO2gUh3E8UnE9KEsBSwNLAYZxPmgYWAIAAABpOHE/SwBLAYdxQFJxQShLA2g3Tk5OSv////9K/////0sA'
+    'dHFCYolDGAMAAAAAAAAAAQAAAAAAAAACAAAAAAAAAHFDdHFEYmVdcUUoaA1oDn1xRihoEGgRaBJLAIVxR2gUh3FIUnFJKEsBSwKFcUpoG4ldcUso'
+    'aCJoI2V0cUxiaCVOdYZxTVJxTmgNaA59cU8oaBBoEWgSSwCFcVBoFIdxUVJxUihLAUsDhXFTaBuJXXFUKGgfaCBoIWV0cVViaCVOdYZxVlJxV2V9'
+    'cVhYBgAAADAuMTQuMXFZfXFaKFgEAAAAYXhlc3FbaAxYBgAAAGJsb2Nrc3FcXXFdKH1xXihYBgAAAHZhbHVlc3FfaDJYCAAAAG1ncl9sb2NzcWBj'
+    'YnVpbHRpbnMKc2xpY2UKcWFLA0sFSwGHcWJScWN1fXFkKGhfaD1oYGhhSwBLA0sBh3FlUnFmdWV1c3RxZ2JYBAAAAF90eXBxaFgJAAAAZGF0YWZy'
+    'YW1lcWlYCQAAAF9tZXRhZGF0YXFqXXFrdWJYCgAAAHNoYXBlY2VsbHNxbH1xbVgHAAAAaW1nZmlsZXFuTnUu')
+
+
+def make_cell():
+    mask = np.zeros((64, 80), dtype=bool)
+    mask[10:30, 20:45] = True
+    skelbody = {'skeleton-coord': np.array([[15, 25], [16, 26]]), 'physical-space': np.array([0.5, 0.5]),
+                'threshold': 2.5}
+    skelprot = {'protusion_id': [1, 2], 'euclidean-length': [3.5, 4.0],
+                'paths': [np.array([[1, 2], [2, 3], [3, 4]]), np.array([[5, 6]])],
+                'secondary-paths': [[np.array([[1, 1], [2, 2]])], []],
+                'final_node-coord-0': [12, 28], 'final_node-coord-1': [22, 40]}
+    contour = {'allxpoints': [20., 45., 45., 20.], 'allypoints': [10., 10., 30., 30.], 'color': (1.0, 0.2, 0.1, 1.0),
+               'area': 500., 'mask': mask}
+
+    return cr.CellRecord(zframe=3, contour=contour, skelbody=skelbody, skelprot=skelprot)
+
+def assert_same_cell(cell, other):
+    assert other.zframe == cell.zframe
+    np.testing.assert_array_equal(other.contour['mask'], cell.contour['mask'])
+    assert other.contour['allxpoints'] == cell.contour['allxpoints']
+    assert tuple(other.contour['color']) == cell.contour['color']
+    np.testing.assert_array_equal(other.skelbody['skeleton-coord'], cell.skelbody['skeleton-coord'])
+    assert other.skelbody['threshold'] == cell.skelbody['threshold']
+    assert other.skelprot['euclidean-length'] == cell.skelprot['euclidean-length']
+    for path, otherpath in zip(cell.skelprot['paths'], other.skelprot['paths']):
+        np.testing.assert_array_equal(otherpath, path)
+    assert [len(p) for p in other.skelprot['secondary-paths']] == [1, 0]
+
+def test_round_trip():
+    cell = make_cell()
+    cell.summary = 'not part of the schema'
+
+    record = cr.decode_cell(cr.encode_cell(cell))
+    assert_same_cell(cell, record)
+    assert sorted(vars(record)) == sorted(cr.CELL_FIELDS)
+
+def test_round_trip_without_skeleton():
+    cell = make_cell()
+    del cell.skelbody, cell.skelprot
+
+    record = cr.decode_cell(cr.encode_cell(cell))
+    assert not hasattr(record, 'skelbody')
+    np.testing.assert_array_equal(record.contour['mask'], cell.contour['mask'])
+
+def test_empty_mask():
+    cell = make_cell()
+    cell.contour['mask'] = np.zeros((64, 80), dtype=bool)
+
+    record = cr.decode_cell(cr.encode_cell(cell))
+    np.testing.assert_array_equal(record.contour['mask'], cell.contour['mask'])
+
+def test_npz_record_migration():
+    cell = make_cell()
+    cell.summary = 'not part of the schema'
+    arrays = dict()
+    for attribute, value in vars(cell).items():
+        cr.pack_value(attribute, value, arrays)
+
+    record = cr.decode_cell(pf.arrays_to_bytes(arrays))
+    assert_same_cell(cell, record)
+    assert not hasattr(record, 'summary')
+
+def test_newer_schema():
+    data = bytearray(cr.encode_cell(make_cell()))
+    data[4:6] = (cr.SCHEMA_VERSION + 1).to_bytes(2, 'little')
+
+    with pytest.raises(ValueError):
+        cr.decode_cell(bytes(data))
+
+def test_legacy_project():
+    cell = make_cell()
+    cell.skelbody['physical-space'] = 0.5  # scalar spacing of older versions
+    connections = pd.DataFrame([[3, 1, 2, 4., 5.]], columns=['zframe', 'cell1', 'cell2', 'centerX', 'centerY'])
+    data = pickle.dumps({'shapecells': {'1': cell}, 'cell_zframes': {'3': [1]}, 'connections': connections,
+                         'imgfile': None})
+
+    project = cr.load_legacy_project(io.BytesIO(data))
+    assert_same_cell(cell, project['shapecells']['1'])
+    np.testing.assert_array_equal(project['shapecells']['1'].skelbody['physical-space'], [0.5, 0.5])
+    pd.testing.assert_frame_equal(project['connections'], connections)
+
+def test_pinned_legacy_project():
+    # project files of older versions were pickled by the pinned pandas and numpy, whatever the versions loading them
+    project = cr.load_legacy_project(io.BytesIO(PINNED_PROJECT))
+
+    assert project['cell_zframes'] == {'3': [1]}
+    assert project['connections'].columns.tolist() == ['zframe', 'cell1', 'cell2', 'centerX', 'centerY']
+    assert project['connections'].values.tolist() == [[3, 1, 2, 4., 5.]]
+
+@pytest.mark.parametrize('module, name', [('os', 'system'),
+                                          ('builtins', 'eval'),
+                                          ('numpy.testing._private.utils', 'runstring'),
+                                          ('numpy', 'load'),
+                                          ('pandas.io.pickle', 'read_pickle'),
+                                          ('imagepy.journal', 'replay_journal')])
+def test_legacy_unpickler_rejects(module, name):
+    # protocol 0 pickle calling module.name('payload')
+    data = 'c{}\n{}\n(Vpayload\ntR.'.format(module, name).encode('ascii')
+
+    with pytest.raises(pickle.UnpicklingError):
+        cr.LegacyUnpickler(io.BytesIO(data)).load()
+
+def test_legacy_unpickler_rejects_functions():
+    with pytest.raises(pickle.UnpicklingError):
+        cr.LegacyUnpickler(io.BytesIO(pickle.dumps(os.getcwd))).load()
@@ -0,0 +1,82 @@
+'''
+
+Tests of the network of the cell connections (see imagepy.connectivity).
+
+'''
+
+import numpy as np
+import pandas as pd
+from imagepy.connectivity import ConnectionGraph, NETWORK_COLUMNS
+
+
+def connections_table(rows):
+    return pd.DataFrame([row + [0., 0., 0] for row in rows],
+                        columns=['zframe', 'cell1', 'cell2', 'centerX', 'centerY', 'kind'])
+
+def analysis():
+    """
+    Cells 1-2-3 in a chain and 4 alone on z-frame 0, cells 5-6 on z-frame 1, cell 7 alone on z-frame 2.
+    Cells 3 and 5 are the same cell (3D skeleton).
+    """
+    cell_zframes = {'0': [1, 2, 3, 4], '1': [5, 6], '2': [7]}
+    connections = connections_table([[0, 1, 2], [0, 2, 3], [0, 3, 2], [1, 5, 6]])
+    volumecells = {'1': {'cells': [5, 3]}}
+
+    return cell_zframes, connections, volumecells
+
+def test_degrees_and_components():
+    network = ConnectionGraph.from_analysis(*analysis())
+    summary = network.summary()
+
+    assert summary['cells'] == 7
+    assert summary['contacts'] == 3  # duplicated connections are one edge
+    assert summary['links'] == 1
+    assert summary['degree-distribution'] == [2, 4, 1]
+    assert summary['isolated-cells'] == 2
+    assert summary['components'] == 3
+    assert summary['largest-component'] == 5
+
+def test_paths():
+    network = ConnectionGraph.from_analysis(*analysis())
+
+    assert network.distance(1, 6) == 4  # 1-2-3, link 3-5, 5-6
+    assert network.distance(1, 4) == np.inf
+    meanpath, diameter, sampled = network.path_statistics()
+    assert diameter == 4
+    assert not sampled
+    # paths of the component of 5 cells: 1+2+3+4 + 1+1+2+3 + 2+1+1+2 + 3+2+1+1 + 4+3+2+1, 20 ordered pairs
+    assert meanpath == 40 / 20.
+
+    _, _, sampled = network.path_statistics(samples=3)
+    assert sampled
+
+def test_incremental_update():
+    cell_zframes, connections, volumecells = analysis()
+    network = ConnectionGraph()
+    network.update({'0': cell_zframes['0'][:2]}, connections.iloc[:1])
+    assert network.summary()['contacts'] == 1
+
+    network.update(cell_zframes, connections, volumecells)
+    full = ConnectionGraph.from_analysis(cell_zframes, connections, volumecells)
+    assert network.summary() == full.summary()
+    pd.testing.assert_frame_equal(network.cell_table(), full.cell_table())
+
+    # a shorter connections table (e.g. another project) builds the network again
+    network.update({'0': [1, 2]}, connections.iloc[:1])
+    assert network.summary()['cells'] == 2
+
+def test_cell_table():
+    table = ConnectionGraph.from_analysis(*analysis()).cell_table()
+
+    assert list(table.columns) == NETWORK_COLUMNS
+    assert table['cell#'].tolist() == [1, 2, 3, 4, 5, 6, 7]
+    assert table['degree'].tolist() == [1, 2, 1, 0, 1, 1, 0]
+    assert table['component-size'].tolist() == [5, 5, 5, 1, 5, 5, 1]
+    assert table['component'].nunique() == 3
+
+def test_empty():
+    network = ConnectionGraph.from_analysis(dict(), connections_table([]))
+
+    assert network.summary()['cells'] == 0
+    assert len(network.cell_table()) == 0
+    assert network.summary_text().startswith('0 cells')
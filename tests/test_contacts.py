@@ -0,0 +1,83 @@
+'''
+
+Tests of the connections between the cells of a z-frame (see imagepy.contacts and imagepy.engine).
+
+'''
+
+import numpy as np
+import imagepy.engine as eng
+from imagepy.cellrecord import CellRecord
+from imagepy.contacts import ContactIndex
+
+SHAPE = (60, 80)
+
+
+def box(rows, cols):
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[rows[0]:rows[1], cols[0]:cols[1]] = True
+    return mask
+
+def tips(*points):
+    return {'final_node-coord-0': [p[0] for p in points], 'final_node-coord-1': [p[1] for p in points]}
+
+def cells(masks, skelprots):
+    return {str(cellid): CellRecord(zframe=0, contour={'mask': mask}, skelprot=skelprots.get(cellid))
+            for cellid, mask in masks.items()}
+
+def test_tip_contacts():
+    # cell 1 on the left, its two tips 1 and 2 pixels from cell 2 on the right; cell 3 far away
+    masks = {1: box((10, 30), (5, 30)), 2: box((10, 30), (32, 50)), 3: box((40, 55), (60, 75))}
+    skelprots = {1: tips((15, 29), (25, 29))}
+    index = ContactIndex(tolerance=3)
+    for cellid in (2, 3):
+        index.add_cell(0, cellid, masks[cellid])
+
+    contacts = index.tip_contacts(0, 1, masks[1], skelprots[1], [2, 3])
+    assert sorted(contacts) == [(2, 15, 29), (2, 25, 29)]
+
+    # tips of the cells already in the index touching the new cell
+    index.add_cell(0, 1, masks[1], skelprots[1])
+    assert sorted(index.tip_contacts(0, 2, masks[2], None, [1, 3])) == [(1, 15, 29), (1, 25, 29)]
+
+    # farther than the tolerance
+    assert ContactIndex(tolerance=1).tip_contacts(0, 1, masks[1], skelprots[1], []) == []
+    far = ContactIndex(tolerance=1)
+    far.add_cell(0, 2, masks[2])
+    assert far.tip_contacts(0, 1, masks[1], skelprots[1], [2]) == []
+
+def test_tips_inside_are_overlaps():
+    masks = {1: box((10, 30), (5, 35)), 2: box((10, 30), (32, 50))}
+    index = ContactIndex(tolerance=3)
+    index.add_cell(0, 2, masks[2])
+
+    # the tip is inside cell 2: left to the overlap detection
+    assert index.tip_contacts(0, 1, masks[1], tips((20, 33)), [2]) == []
+
+def test_one_tip_connection_for_each_pair():
+    masks = {1: box((10, 30), (5, 30)), 2: box((10, 30), (32, 50))}
+    skelprots = {1: tips((15, 29), (25, 29)), 2: tips((20, 32))}
+    shapecells = cells({2: masks[2]}, skelprots)
+
+    rows = eng.cell_connections(ContactIndex(tolerance=3), masks[1], skelprots[1], 1, 0, shapecells, [2])
+    assert rows == [[0, 1, 2, 29, 15, eng.CONNECTION_TIP]]
+
+def test_overlapping_cells_have_no_tip_connection():
+    masks = {1: box((10, 30), (5, 34)), 2: box((10, 30), (32, 50))}
+    skelprots = {1: tips((12, 33)), 2: tips((28, 32))}
+    shapecells = cells({2: masks[2]}, skelprots)
+
+    rows = eng.cell_connections(ContactIndex(tolerance=3), masks[1], skelprots[1], 1, 0, shapecells, [2])
+    assert [row[-1] for row in rows] == [eng.CONNECTION_OVERLAP]
+
+def test_mask_connections_in_bounding_boxes():
+    # cell 1 overlaps cell 2 in two separate regions, and doesn't overlap cell 3
+    masks = {1: box((10, 40), (10, 20)) | box((10, 14), (10, 60)) | box((36, 40), (10, 60)),
+             2: box((5, 45), (50, 70)), 3: box((50, 58), (0, 10))}
+    shapecells = cells({2: masks[2], 3: masks[3]}, dict())
+    index = ContactIndex()
+    index.ensure_cells(0, [2, 3], shapecells)
+
+    expected = [[0, 1, 2, 54, 11, eng.CONNECTION_OVERLAP], [0, 1, 2, 54, 37, eng.CONNECTION_OVERLAP]]
+    assert eng.mask_connections(masks[1], 1, 0, shapecells, [2, 3]) == expected
+    assert eng.mask_connections(masks[1], 1, 0, shapecells, [2, 3], index) == expected
+    assert eng.mask_connections(np.zeros(SHAPE, dtype=bool), 1, 0, shapecells, [2, 3]) == []
@@ -0,0 +1,64 @@
+'''
+
+Tests of the sinks writing the exported tables (see imagepy.export).
+
+'''
+
+import json
+import pandas as pd
+import pytest
+import imagepy.export as exp
+
+METADATA = {'unit': 'micron', 'pixel-size': {'x': 0.5, 'y': 0.5}}
+
+
+def chunks():
+    # the text column of the second chunk is longer than in the first one (e.g. tracks with more cells)
+    return [pd.DataFrame({'track#': [1, 2], 'cells': ['1', '2, 3'], 'width': [0.5, 1.25]}),
+            pd.DataFrame({'track#': [3], 'cells': ['4, 5, 6, 7, 8, 9, 10'], 'width': [2.]})]
+
+def write(sink, table='tracks'):
+    for chunk in chunks():
+        sink.write(table, chunk)
+    sink.close()
+
+def expected():
+    return pd.concat(chunks(), ignore_index=True)
+
+def test_csv(tmp_path):
+    write(exp.CsvSink(str(tmp_path / 'result.csv'), METADATA))
+
+    pd.testing.assert_frame_equal(pd.read_csv(str(tmp_path / 'result_tracks.csv')), expected())
+    with open(str(tmp_path / 'result_metadata.json')) as f:
+        assert json.load(f) == METADATA
+
+def test_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+    write(exp.ParquetSink(str(tmp_path / 'result.parquet'), METADATA))
+
+    path = str(tmp_path / 'result_tracks.parquet')
+    pd.testing.assert_frame_equal(pd.read_parquet(path), expected())
+    assert json.loads(pq.read_schema(path).metadata[b'imagepy'].decode('utf-8')) == METADATA
+
+def test_hdf5(tmp_path):
+    pytest.importorskip('tables')
+    path = str(tmp_path / 'result.h5')
+    write(exp.Hdf5Sink(path, METADATA))
+
+    with pd.HDFStore(path, mode='r') as store:
+        pd.testing.assert_frame_equal(store['tracks'].reset_index(drop=True), expected())
+        assert store.get_storer('tracks').attrs.metadata == METADATA
+
+def test_excel(tmp_path):
+    pytest.importorskip('openpyxl')
+    path = str(tmp_path / 'result.xlsx')
+    sink = exp.ExcelSink(path, METADATA, engine='openpyxl')
+    sink.write('paths', pd.DataFrame({'row': [1]}))
+    write(sink)
+
+    sheets = pd.read_excel(path, sheet_name=None)
+    assert sorted(sheets.keys()) == ['Metadata', 'Tracks']
+    pd.testing.assert_frame_equal(sheets['Tracks'], expected())
+    values = dict(sheets['Metadata'].values)
+    assert values['unit'] == 'micron' and 'not-exported.paths' in values
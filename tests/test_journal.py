@@ -0,0 +1,89 @@
+'''
+
+Tests of the journal of the analysis edits (see imagepy.journal).
+
+'''
+
+import numpy as np
+import pandas as pd
+import imagepy.journal as jr
+from imagepy.cellrecord import CellRecord
+
+
+def connections_table(rows):
+    return pd.DataFrame(rows, columns=['zframe', 'cell1', 'cell2', 'centerX', 'centerY', 'kind'])
+
+def empty_project():
+    return {'shapecells': dict(), 'cell_zframes': dict(), 'connections': connections_table([]), 'volumecells': dict()}
+
+def test_replay(tmp_path):
+    path = str(tmp_path / 'autosave' / 'img.journal')
+    journal = jr.ProjectJournal(path, base=None)
+
+    mask = np.eye(20, dtype=bool)
+    cell = CellRecord(zframe=3, contour={'allxpoints': [0., 1.], 'allypoints': [0., 1.], 'area': 2., 'mask': mask},
+                      skelbody=None, skelprot=None)
+    journal.record('cell', '1', cell)
+    cell.zframe = 4  # changes after the record are not journaled
+    journal.record('connections', None, connections_table([[3, 1, 2, 4., 5., 0]]))
+    journal.record('body', '1', {'skelbody': {'skeleton-coord': np.ones((3, 2))}, 'skelprot': None})
+    journal.record('volume', '1', {'cells': [1, 2]})
+    journal.close()
+
+    records = jr.read_journal(path)
+    assert jr.journal_base(records) is None
+    assert jr.has_edits(records, None)
+
+    project = empty_project()
+    jr.replay_journal(records, project)
+    assert project['cell_zframes'] == {'3': [1]}
+    assert project['shapecells']['1'].zframe == 3
+    np.testing.assert_array_equal(project['shapecells']['1'].contour['mask'], mask)
+    np.testing.assert_array_equal(project['shapecells']['1'].skelbody['skeleton-coord'], np.ones((3, 2)))
+    assert project['connections'][['zframe', 'cell1', 'cell2']].values.tolist() == [[3, 1, 2]]
+    assert list(project['volumecells']['1']['cells']) == [1, 2]
+
+def test_truncated_record(tmp_path):
+    path = str(tmp_path / 'img.journal')
+    journal = jr.ProjectJournal(path, base='project.ipj')
+    journal.record('connections', None, connections_table([[0, 1, 2, 4., 5., 0]]))
+    journal.record('connections', None, connections_table([[0, 2, 3, 4., 5., 0]]))
+    journal.close()
+
+    with open(path, 'r+b') as f:
+        f.truncate(f.seek(0, 2) - 3)
+
+    records = jr.read_journal(path)
+    assert len(records) == 2
+    assert jr.has_edits(records, 'project.ipj')
+    assert not jr.has_edits(records, 'other.ipj')
+
+def test_failed_record(tmp_path, capsys):
+    path = str(tmp_path / 'img.journal')
+    journal = jr.ProjectJournal(path, base=None)
+    write_record = journal.write_record
+
+    def failing(header, payload):
+        if header['key'] == 'bad':
+            raise IOError('disk full')
+        write_record(header, payload)
+
+    journal.write_record = failing
+    journal.record('volume', 'bad', {'cells': [1]})
+    journal.record('volume', 'good', {'cells': [2]})
+    journal.flush()  # doesn't wait forever if a record fails
+    journal.close()
+
+    assert [header['key'] for header, _ in jr.read_journal(path)] == [None, 'good']
+    assert 'disk full' in capsys.readouterr().err
+
+def test_reset(tmp_path):
+    path = str(tmp_path / 'img.journal')
+    journal = jr.ProjectJournal(path, base=None)
+    journal.record('volume', '1', {'cells': [1]})
+    journal.reset('project.ipj')
+    journal.close()
+
+    records = jr.read_journal(path)
+    assert jr.journal_base(records) == 'project.ipj'
+    assert not jr.has_edits(records, 'project.ipj')
@@ -0,0 +1,69 @@
+'''
+
+Tests of the skeletonization of many cells at once (see imagepy.parallelskeleton).
+
+'''
+
+import numpy as np
+import pytest
+import imagepy.parallelskeleton as pskel
+import imagepy.skeletonprocessing as skpro
+from imagepy.synthetic import star_mask
+
+SHAPE = (256, 256)
+
+
+def cell_masks():
+    """
+    Masks of separate cells (two of them close enough to share their bounding boxes), and one touching a cell.
+    """
+    masks = {1: star_mask(SHAPE, (70, 70), body_radius=15, protusions=4, length=35, width=3, seed=1),
+             2: star_mask(SHAPE, (70, 150), body_radius=12, protusions=5, length=30, width=3, seed=2),
+             3: star_mask(SHAPE, (180, 100), body_radius=18, protusions=3, length=40, width=4, branches=1, seed=3)}
+    touching = np.zeros(SHAPE, dtype=bool)
+    touching[60:80, 60:80] = True
+    masks[4] = touching
+
+    return masks
+
+def test_separate_masks():
+    masks = cell_masks()
+    masks[5] = np.zeros(SHAPE, dtype=bool)
+
+    batches = pskel.separate_masks(masks)
+    assert [sorted(cells.values()) for _, cells in batches] == [[1, 2, 3], [4]]
+    for labels, cells in batches:
+        for label, cellid in cells.items():
+            np.testing.assert_array_equal(labels == label, masks[cellid])
+
+def test_crop_mask():
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[1:5, 10:20] = True
+
+    crop, offset = pskel.crop_mask(mask, padding=2)
+    np.testing.assert_array_equal(offset, [0, 8])
+    assert crop.shape == (7, 14)
+    assert crop.sum() == mask.sum()
+
+    with pytest.raises(ValueError):
+        pskel.crop_mask(np.zeros(SHAPE, dtype=bool))
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batched_skeletons_match_single_cells(workers):
+    masks = cell_masks()
+    masks[5] = np.zeros(SHAPE, dtype=bool)
+    spacing = np.array([0.5, 0.5])
+
+    results = dict(pskel.skeletonize_cells(masks, spacing, workers=workers))
+    assert sorted(results) == [1, 2, 3, 4, 5]
+    assert isinstance(results[5], ValueError)
+
+    for cellid in (1, 2, 3):
+        thresh, skelbody, skelprot = skpro.skeletonize_mask(masks[cellid], spacing)
+        batchthresh, batchbody, batchprot = results[cellid]
+        assert batchthresh == thresh
+        np.testing.assert_array_equal(batchbody['skeleton'], skelbody['skeleton'])
+        np.testing.assert_array_equal(batchbody['endpointCoord'], skelbody['endpointCoord'])
+        assert batchprot['euclidean-length'] == skelprot['euclidean-length']
+        for path, batchpath in zip(skelprot['primary-path'], batchprot['primary-path']):
+            np.testing.assert_array_equal(batchpath, path)
@@ -0,0 +1,51 @@
+'''
+
+Tests of the filters of the summary tables (see imagepy.printsummary).
+
+'''
+
+import numpy as np
+import pytest
+from imagepy.engine import CONNECTION_OVERLAP, CONNECTION_TIP
+from imagepy.printsummary import filter_mask
+
+
+VALUES = np.array([0., 1.5, 2., 10., np.nan])
+
+@pytest.mark.parametrize('condition, expected', [('', [1, 1, 1, 1, 1]),
+                                                 ('2', [0, 0, 1, 0, 0]),
+                                                 ('= 2', [0, 0, 1, 0, 0]),
+                                                 ('== 2', [0, 0, 1, 0, 0]),
+                                                 ('!= 2', [1, 1, 0, 1, 1]),
+                                                 ('> 1.5', [0, 0, 1, 1, 0]),
+                                                 ('>= 1.5', [0, 1, 1, 1, 0]),
+                                                 ('< 2', [1, 1, 0, 0, 0]),
+                                                 ('<=2', [1, 1, 1, 0, 0]),
+                                                 ('> abc', [0, 0, 0, 0, 0])])
+def test_numeric_operators(condition, expected):
+    np.testing.assert_array_equal(filter_mask(VALUES, condition), np.array(expected, dtype=bool))
+
+def test_text():
+    column = np.array(['1, 2', '3', '12, 13'], dtype=object)
+
+    np.testing.assert_array_equal(filter_mask(column, '1'), [True, False, True])
+    np.testing.assert_array_equal(filter_mask(column, '== 3'), [False, True, False])
+    np.testing.assert_array_equal(filter_mask(column, '!= 3'), [True, False, True])
+
+def test_shown_zframes():
+    # z-frames are stored from 0 and shown from 1
+    zframes = np.array([0, 2, 3, 3])
+
+    np.testing.assert_array_equal(filter_mask(zframes, '3', lambda z: str(z + 1)), [False, True, False, False])
+    np.testing.assert_array_equal(filter_mask(zframes, '> 3', lambda z: str(z + 1)), [False, False, True, True])
+
+def test_shown_kinds():
+    kinds = np.array([CONNECTION_OVERLAP, CONNECTION_TIP, CONNECTION_OVERLAP])
+    kindformat = lambda k: 'Tip' if k == CONNECTION_TIP else 'Overlap'
+
+    np.testing.assert_array_equal(filter_mask(kinds, 'Tip', kindformat), [False, True, False])
+    np.testing.assert_array_equal(filter_mask(kinds, '!= Tip', kindformat), [True, False, True])
+    np.testing.assert_array_equal(filter_mask(kinds, str(CONNECTION_TIP), kindformat), [False, False, False])
+
+def test_empty_column():
+    assert len(filter_mask(np.zeros(0), '> 1', lambda z: str(z + 1))) == 0
@@ -0,0 +1,86 @@
+'''
+
+Tests of the skeleton graph of a cell (see imagepy.skeletongraph).
+
+'''
+
+import numpy as np
+import pytest
+from imagepy.skeletongraph import SkeletonGraph, RANK_BODY, RANK_PRIMARY, RANK_SECONDARY
+from imagepy.skeletonprocessing import skeletonize_mask
+from imagepy.synthetic import star_mask
+
+
+def segment(start, end):
+    """
+    Pixels of a horizontal or vertical path.
+    """
+    steps = max(abs(end[0] - start[0]), abs(end[1] - start[1]))
+    return np.array([(start[0] + (end[0] - start[0]) * k // steps, start[1] + (end[1] - start[1]) * k // steps)
+                     for k in range(steps + 1)])
+
+def branched_graph(sidelength):
+    """
+    Cell body on the left of a protusion from (10, 10) to (10, 40), with a branch from (10, 25) down to (30, 25)
+    and a side branch of the branch from (18, 25) to the right.
+    """
+    skelbody = {'paths': [segment((10, 0), (10, 9))]}
+    skelprot = {'primary-path': [segment((10, 10), (10, 40))],
+                'secondary-paths': [[segment((11, 25), (30, 25)), segment((18, 26), (18, 25 + sidelength))]],
+                'physical-space': np.array([0.5, 0.5])}
+
+    return SkeletonGraph(skelbody, skelprot)
+
+def test_packed_paths():
+    graph = branched_graph(7)
+
+    assert graph.path_rank.tolist() == [RANK_BODY, RANK_PRIMARY, RANK_SECONDARY, RANK_SECONDARY]
+    assert graph.path_protusion.tolist() == [0, 1, 1, 1]
+    assert graph.path_number.tolist() == [0, 0, 1, 2]
+    np.testing.assert_allclose(graph.path_length, [4.5, 15., 9.5, 3.])
+    np.testing.assert_array_equal(graph.path(1)[[0, -1]], [[10, 10], [10, 40]])
+
+def test_topology():
+    topology = branched_graph(7).topology()
+
+    assert topology['node-coord'].tolist() == [[10, 10], [10, 25], [10, 40], [18, 25], [18, 32], [30, 25]]
+    assert topology['node-root'].tolist() == [True, False, False, False, False, False]
+    assert topology['edge-nodes'].tolist() == [[0, 1], [1, 2], [1, 3], [3, 4], [3, 5]]
+    np.testing.assert_allclose(topology['edge-length'], [7.5, 7.5, 4., 3.5, 6.])
+    assert topology['edge-protusion'].tolist() == [1, 1, 1, 1, 1]
+
+@pytest.mark.parametrize('sidelength, expected', [(7, [1, 1, 2, 3, 2]),  # the branch continues down
+                                                  (20, [1, 1, 2, 2, 3])])  # the side branch is longer
+def test_branch_order(sidelength, expected):
+    graph = branched_graph(sidelength)
+
+    # the primary path keeps order 1, the longest subtree continues the order of its parent branch
+    assert graph.branch_order().tolist() == expected
+
+def test_protusion_metrics():
+    metrics = branched_graph(7).protusion_metrics()
+
+    assert metrics['branches'].tolist() == [2]
+    assert metrics['max-order'].tolist() == [3]
+    np.testing.assert_allclose(metrics['secondary-length'], [13.5])
+    np.testing.assert_allclose(metrics['tortuosity'], [1.])
+    np.testing.assert_allclose(metrics['orientation'], [0.], atol=1e-9)
+
+def test_medial_axis_metrics():
+    # the branch points of a medial axis are clusters of pixels: each one must be a single node
+    _, skelbody, skelprot = skeletonize_mask(star_mask(protusions=5, length=120, branches=2, seed=1),
+                                             np.array([0.5, 0.5]))
+    graph = SkeletonGraph(skelbody, skelprot)
+    topology = graph.topology()
+
+    assert np.all(topology['edge-length'] > 0)
+    assert np.all(topology['edge-nodes'][:, 0] != topology['edge-nodes'][:, 1])
+    assert graph.protusion_metrics()['branches'].tolist() == [2, 2, 2, 2, 2]
+    assert graph.protusion_metrics()['max-order'].tolist() == [2, 2, 2, 2, 2]
+
+def test_no_protusions():
+    graph = SkeletonGraph({'paths': [segment((10, 0), (10, 9))]},
+                          {'primary-path': [], 'secondary-paths': [], 'physical-space': 1})
+
+    assert len(graph.branch_order()) == 0
+    assert len(graph.protusion_metrics()['branches']) == 0
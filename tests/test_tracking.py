@@ -0,0 +1,64 @@
+'''
+
+Tests of the links of the cells through the z-frames (see imagepy.tracking).
+
+'''
+
+import numpy as np
+from imagepy.cellrecord import CellRecord
+from imagepy.tracking import CellLinker, link_frames, measure_cell
+
+SHAPE = (80, 80)
+
+
+def disk(center, radius, hole=0):
+    rows, cols = np.ogrid[:SHAPE[0], :SHAPE[1]]
+    distance = np.hypot(rows - center[0], cols - center[1])
+    return (distance <= radius) & (distance >= hole)
+
+def frame(masks):
+    return {cellid: measure_cell(mask, np.ones(2)) for cellid, mask in masks.items()}
+
+def test_overlap_preferred():
+    # cell 2 overlaps cell 1, cell 3 has the same centroid without overlapping (inside the hole of the ring)
+    cells1 = frame({1: disk((40, 40), 15, hole=8)})
+    cells2 = frame({2: disk((40, 52), 6), 3: disk((40, 40), 5)})
+    assert link_frames(cells1, cells2) == {1: 2}
+
+    # without the overlapping cell, the close cell is linked
+    del cells2[2]
+    assert link_frames(cells1, cells2) == {1: 3}
+
+def test_far_cells_not_linked():
+    cells1 = frame({1: disk((15, 15), 8), 2: disk((60, 60), 8)})
+    cells2 = frame({3: disk((15, 40), 8), 4: disk((62, 61), 8)})
+    assert link_frames(cells1, cells2) == {2: 4}
+    assert link_frames(cells1, dict()) == dict()
+
+def test_one_to_one():
+    # both cells overlap cell 3, only the largest overlap is linked
+    cells1 = frame({1: disk((40, 30), 10), 2: disk((40, 50), 10)})
+    cells2 = frame({3: disk((40, 33), 10)})
+    assert link_frames(cells1, cells2) == {1: 3}
+
+def test_linker_tracks():
+    masks = {1: (0, disk((20, 20), 8)), 2: (1, disk((21, 21), 8)), 3: (2, disk((22, 20), 8)),
+             4: (1, disk((60, 60), 8)), 5: (2, disk((60, 62), 8))}
+    shapecells = {str(cellid): CellRecord(zframe=z, contour={'mask': mask}) for cellid, (z, mask) in masks.items()}
+    cell_zframes = {}
+    for cellid, (z, _) in masks.items():
+        cell_zframes.setdefault(str(z), []).append(cellid)
+
+    linker = CellLinker()
+    for cellid, (z, mask) in masks.items():
+        linker.add_cell(z, cellid, mask)
+    tracks = linker.update(cell_zframes, shapecells).tracks()
+    assert [track.cells for track in tracks] == [[1, 2, 3], [4, 5]]
+    assert tracks[1].zframes == [1, 2]
+    assert linker.track_of(2) is tracks[0]
+
+    # crops released are measured again before their z-frame is linked again
+    assert linker.release(linker.nbytes()) > 0
+    assert linker.nbytes() == 0
+    linker.link_cell(3, 6, disk((22, 21), 8), dict(cell_zframes, **{'3': [6]}), shapecells)
+    assert linker.track_of(6).cells == [1, 2, 3, 6]
@@ -0,0 +1,67 @@
+'''
+
+Tests of the 3D skeleton of the cells traced on consecutive z-frames (see imagepy.volumeprocessing).
+
+'''
+
+import numpy as np
+from scipy import ndimage
+import imagepy.volumeprocessing as volpro
+from imagepy.cellrecord import CellRecord
+
+SHAPE = (60, 60)
+
+
+def cell_mask():
+    """
+    Cell body of radius 10 at (30, 30) with a protusion 5 pixels wide to the right.
+    """
+    rows, cols = np.ogrid[:SHAPE[0], :SHAPE[1]]
+    mask = (rows - 30) ** 2 + (cols - 30) ** 2 <= 10 ** 2
+    mask[28:33, 30:55] = True
+    return mask
+
+def cells(zframes, mask):
+    return {str(n): CellRecord(zframe=z, contour={'mask': mask}) for n, z in enumerate(zframes, start=1)}
+
+def test_stack_two_frames():
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[10:20, 10:30] = True
+    shapecells = cells([3, 5], mask)
+    shapecells['2'].contour['mask'] = np.roll(mask, 5, axis=1)
+
+    volume, offset = volpro.stack_cell_masks(shapecells, [1, 2])
+
+    assert offset.tolist() == [2, 9, 9]
+    assert volume.shape == (5, 12, 27)
+    # the frame between the traced frames is the intersection of their masks
+    np.testing.assert_array_equal(volume[2], volume[1] & volume[3])
+    assert np.count_nonzero(volume[2]) == 10 * 15
+    assert not volume[[0, -1]].any()
+
+def test_chunked_distance():
+    shapecells = cells(range(12), cell_mask())
+    volume, _ = volpro.stack_cell_masks(shapecells, range(1, 13))
+    spacing = np.array([0.5, 0.5, 0.5])
+    skeleton = volpro.chunked_skeletonize(volume, zchunk=4, zhalo=4)
+
+    zhalo = volpro.distance_halo(volume, spacing, zchunk=4)
+    indices, distances = volpro.chunked_distance_on_skeleton(volume, skeleton, spacing, zchunk=4, zhalo=zhalo)
+
+    expected = ndimage.distance_transform_edt(volume, sampling=spacing)
+    np.testing.assert_array_equal(indices, np.flatnonzero(skeleton))
+    np.testing.assert_allclose(distances, expected.ravel()[indices], rtol=1e-6)
+
+def test_cell_volume_skeleton():
+    shapecells = cells(range(2, 14), cell_mask())
+
+    skelvol = volpro.cell_volume_skeleton(shapecells, range(1, 13), [0.5, 0.5, 0.5])
+
+    assert skelvol['cells'] == list(range(1, 13))
+    assert skelvol['zframes'] == list(range(2, 14))
+    assert skelvol['protusion_id'] == [1]
+    # tip of the protusion, in the image stack coordinates
+    assert 2 <= skelvol['final_node-coord-0'][0] <= 13
+    assert 28 <= skelvol['final_node-coord-1'][0] <= 32 and skelvol['final_node-coord-2'][0] > 40
+    assert skelvol['path-length'][0] >= skelvol['euclidean-length'][0] > 0
+    assert len(skelvol['body-coord']) > 0